@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import random
+import threading
+from types import SimpleNamespace
+from src.config import Config
+from src.rate_limiter import get_limiter
+
+
+class FakeApiError(Exception):
+    """Помилка API з HTTP-кодом (обмежувач розпізнає її так само, як справжні помилки Google)."""
+
+    def __init__(self, code: int, message: str = ""):
+        super().__init__(f"{code} {message}".strip())
+        self.code = code
+
+
+class Profile:
+    """
+    Поведінка локальної заміни API: затримка, частка помилок 5xx та частка 429.
+    latency — середня затримка в секундах (з джитером ±50%).
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, rate_429: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+
+    def simulate(self):
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+        roll = random.random()
+        if roll < self.rate_429:
+            raise FakeApiError(429, "RESOURCE_EXHAUSTED")
+        if roll < self.rate_429 + self.error_rate:
+            raise FakeApiError(503, "UNAVAILABLE")
+
+
+class ApiCounter:
+    """Потокобезпечний лічильник викликів API за назвою."""
+
+    def __init__(self):
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def hit(self, name: str):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+
+class FakeDrive:
+    """Заміна DriveService: синтетична папка з n_files записів."""
+
+    def __init__(self, n_files: int, profile: Profile, counter: ApiCounter, file_size: int = 64 * 1024):
+        self.profile = profile
+        self.counter = counter
+        self.file_size = file_size
+        self.limiter = get_limiter('drive')
+        self.files = [
+            {'id': f"fake-{i:06d}", 'name': f"call_{i:06d}.mp3",
+             'md5Checksum': f"{i:032x}", 'size': str(file_size),
+             'createdTime': time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(time.time() - 60 * (n_files - i)))}
+            for i in range(n_files)
+        ]
+
+    def _call(self, name: str, func, *args):
+        def attempt():
+            self.counter.hit(f"drive.{name}")
+            self.profile.simulate()
+            return func(*args)
+        return self.limiter.call(attempt)
+
+    def list_audio_files(self, folder_id: str) -> list:
+        pages = max(1, (len(self.files) + 999) // 1000)
+        for _ in range(pages):
+            self._call("files.list", lambda: None)
+        return list(self.files)
+
+    def get_start_page_token(self) -> str:
+        return self._call("changes.getStartPageToken", lambda: "1")
+
+    def list_changes(self, page_token: str, folder_id: str) -> tuple:
+        return self._call("changes.list", lambda: ([], page_token))
+
+    def download_file(self, file_id: str, file_name: str, md5_checksum: str = None) -> str:
+        def write():
+            os.makedirs(Config.TEMP_FOLDER, exist_ok=True)
+            local_path = os.path.join(Config.TEMP_FOLDER, f"{file_id}_{file_name}")
+            with open(local_path, "wb") as f:
+                f.write(b"ID3" + os.urandom(self.file_size - 3))
+            return local_path
+        return self._call("files.get_media", write)
+
+
+class _FakeFiles:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def upload(self, file, config=None):
+        self.owner.counter.hit("gemini.files.upload")
+        self.owner.upload.simulate()
+        name = f"files/{os.path.basename(str(file))}"
+        mime_type = (config or {}).get('mime_type', 'audio/mp3')
+        return SimpleNamespace(name=name, uri=f"https://fake/{name}", mime_type=mime_type)
+
+    def delete(self, name, config=None):
+        self.owner.counter.hit("gemini.files.delete")
+
+
+class _FakeModels:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def generate_content(self, model, contents, config=None):
+        self.owner.counter.hit("gemini.generate_content")
+        self.owner.generate.simulate()
+        score = random.randint(1, 10)
+        result = {
+            "transcription": "Добрий день! " * random.randint(20, 200),
+            "service_type": random.choice(Config.SERVICES_LIST),
+            "manager_score": score, "result": random.choice(["Записався", "Думає", "Відмова"]),
+            "is_critical_fail": score < 4, "critical_comment": "Не дізнався пробіг" if score < 4 else "",
+            "kpi_greeting": 1, "kpi_body": random.randint(0, 1), "kpi_year": random.randint(0, 1),
+            "kpi_mileage": random.randint(0, 1), "kpi_upsell": random.randint(0, 1),
+            "kpi_history": random.randint(0, 1), "kpi_closing": 1,
+        }
+        usage = SimpleNamespace(prompt_token_count=random.randint(2000, 20000),
+                                candidates_token_count=random.randint(300, 3000),
+                                cached_content_token_count=0)
+        usage.total_token_count = usage.prompt_token_count + usage.candidates_token_count
+        return SimpleNamespace(text=json.dumps(result, ensure_ascii=False), usage_metadata=usage)
+
+
+class _FakeCaches:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model, config=None):
+        self.owner.counter.hit("gemini.caches.create")
+        return SimpleNamespace(name="cachedContents/fake")
+
+    def delete(self, name, config=None):
+        self.owner.counter.hit("gemini.caches.delete")
+
+
+class FakeGenaiClient:
+    """Заміна genai.Client для AIProcessor: files, models та caches."""
+
+    def __init__(self, upload: Profile, generate: Profile, counter: ApiCounter):
+        self.upload = upload
+        self.generate = generate
+        self.counter = counter
+        self.files = _FakeFiles(self)
+        self.models = _FakeModels(self)
+        self.caches = _FakeCaches(self)
+
+
+class _FakeRequest:
+    def __init__(self, owner, name: str, func):
+        self.owner = owner
+        self.name = name
+        self.func = func
+
+    def execute(self, http=None, **kwargs):
+        self.owner.counter.hit(f"sheets.{self.name}")
+        self.owner.profile.simulate()
+        return self.func()
+
+
+def _cell(ref: str) -> tuple:
+    """'C12' -> (індекс колонки, індекс рядка); відсутня частина — None."""
+    letters = ''.join(ch for ch in ref if ch.isalpha())
+    digits = ''.join(ch for ch in ref if ch.isdigit())
+    column = None
+    if letters:
+        column = 0
+        for ch in letters.upper():
+            column = column * 26 + ord(ch) - ord('A') + 1
+        column -= 1
+    return column, int(digits) - 1 if digits else None
+
+
+def _parse_range(a1: str) -> tuple:
+    """
+    'Аркуш!A2:R' -> (перший рядок, рядок після останнього, перша колонка, колонка після останньої),
+    індекси від 0, None — без обмеження. Назва аркуша без клітинок — увесь аркуш.
+    """
+    if '!' not in a1:
+        return 0, None, 0, None
+    first, _, last = a1.split('!', 1)[1].partition(':')
+    col_start, row_start = _cell(first)
+    col_end, row_end = _cell(last) if last else (col_start, row_start)
+    return (row_start or 0, None if row_end is None else row_end + 1,
+            col_start or 0, None if col_end is None else col_end + 1)
+
+
+class _FakeValues:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def _write(self, a1: str, values: list):
+        row_start, _, col_start, _ = _parse_range(a1)
+        with self.owner.lock:
+            rows = self.owner.rows
+            while len(rows) < row_start:
+                rows.append([])
+            for offset, value in enumerate(values):
+                index = row_start + offset
+                if index == len(rows):
+                    rows.append([])
+                current = list(rows[index])
+                current.extend([""] * (col_start - len(current)))
+                current[col_start:col_start + len(value)] = value
+                rows[index] = current
+
+    def get(self, spreadsheetId, range):
+        def apply():
+            row_start, row_end, col_start, col_end = _parse_range(range)
+            with self.owner.lock:
+                values = [row[col_start:col_end] for row in self.owner.rows[row_start:row_end]]
+            # Як і справжній API: без порожніх рядків у кінці та без ключа values для порожнього діапазону
+            while values and not values[-1]:
+                values.pop()
+            return {'values': values} if values else {}
+        return _FakeRequest(self.owner, "values.get", apply)
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        def apply():
+            self._write(range, body['values'])
+            return {'updatedRows': len(body['values'])}
+        return _FakeRequest(self.owner, "values.update", apply)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def apply():
+            for item in body['data']:
+                self._write(item['range'], item['values'])
+            return {'totalUpdatedRows': sum(len(item['values']) for item in body['data'])}
+        return _FakeRequest(self.owner, "values.batchUpdate", apply)
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        def apply():
+            with self.owner.lock:
+                start = len(self.owner.rows) + 1
+                self.owner.rows.extend(list(row) for row in body['values'])
+                end = len(self.owner.rows)
+            sheet = range.split('!')[0]
+            return {'updates': {'updatedRange': f"{sheet}!A{start}:Q{end}"}}
+        return _FakeRequest(self.owner, "values.append", apply)
+
+    def clear(self, spreadsheetId, range, body=None):
+        def apply():
+            row_start, row_end, col_start, col_end = _parse_range(range)
+            with self.owner.lock:
+                for row in self.owner.rows[row_start:row_end]:
+                    row[col_start:col_end] = [""] * len(row[col_start:col_end])
+                while self.owner.rows and not any(self.owner.rows[-1]):
+                    self.owner.rows.pop()
+            return {}
+        return _FakeRequest(self.owner, "values.clear", apply)
+
+
+class _FakeSpreadsheets:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def get(self, spreadsheetId, **kwargs):
+        return _FakeRequest(self.owner, "get", lambda: {
+            'sheets': [{'properties': {'title': "Test_Run", 'sheetId': 0}}]
+        })
+
+    def values(self):
+        return _FakeValues(self.owner)
+
+    def batchUpdate(self, spreadsheetId, body):
+        def apply():
+            with self.owner.lock:
+                self.owner.requests.extend(body['requests'])
+            return {'replies': [{} for _ in body['requests']]}
+        return _FakeRequest(self.owner, "batchUpdate", apply)
+
+
+class FakeSheetsAPI:
+    """Заміна клієнта Sheets API (spreadsheets().values()...) для SheetsService(service=...)."""
+
+    def __init__(self, profile: Profile, counter: ApiCounter):
+        self.profile = profile
+        self.counter = counter
+        self.rows = []
+        # Запити spreadsheets().batchUpdate (форматування, правила) у порядку надходження
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def spreadsheets(self):
+        return _FakeSpreadsheets(self)
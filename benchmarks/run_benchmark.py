@@ -0,0 +1,182 @@
+"""
+Офлайн-бенчмарк конвеєра обробки дзвінків.
+
+Запускає main() повністю на синтетичних папках із локальними замінами
+Drive, Gemini та Sheets (benchmarks/fakes.py), без облікових даних Google.
+
+Приклад:
+    python -m benchmarks.run_benchmark --files 10 100 1000 --gemini-latency 0.3 --rate-429 0.02
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StageTimer:
+    """Збирає тривалості викликів по етапах."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, stage: str, func):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples.setdefault(stage, []).append(time.perf_counter() - started)
+        return timed
+
+    @staticmethod
+    def percentile(values: list, q: float) -> float:
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def summary(self) -> dict:
+        return {
+            stage: {f"p{q}": round(self.percentile(values, q) * 1000, 1) for q in (50, 95, 99)}
+            for stage, values in self.samples.items() if values
+        }
+
+
+def _peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux повертає КБ, macOS — байти
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def run_once(n_files: int, options: dict) -> dict:
+    """Один прогін main() на n_files синтетичних файлах (в окремому процесі)."""
+    from src.config import Config
+    workdir = tempfile.mkdtemp(prefix="call-analyzer-bench-")
+    Config.TEMP_FOLDER = os.path.join(workdir, "audio")
+    Config.DB_PATH = os.path.join(workdir, "bench.db")
+    Config.DISCOVERY_MODE = "full"
+    Config.ANALYSIS_CACHE_ENABLED = False
+    for key, value in options["config"].items():
+        setattr(Config, key, value)
+
+    from src.logger import logger
+    logger.setLevel(logging.ERROR)
+
+    import main as app
+    from src.metrics import metrics
+    from src.ai_processor import AIProcessor
+    from src.google_sheets import SheetsService
+    from benchmarks.fakes import ApiCounter, Profile, FakeDrive, FakeGenaiClient, FakeSheetsAPI
+
+    counter = ApiCounter()
+    stages = StageTimer()
+    errors = dict(error_rate=options["error_rate"], rate_429=options["rate_429"])
+
+    def make_drive():
+        drive = FakeDrive(n_files, Profile(options["drive_latency"], **errors), counter)
+        drive.download_file = stages.wrap("download", drive.download_file)
+        return drive
+
+    def make_ai():
+        client = FakeGenaiClient(Profile(options["upload_latency"], **errors),
+                                 Profile(options["gemini_latency"], **errors), counter)
+        ai = AIProcessor(client=client)
+        ai.analyze_call = stages.wrap("analyze", ai.analyze_call)
+        return ai
+
+    def make_sheets():
+        sheets = SheetsService(service=FakeSheetsAPI(Profile(options["sheets_latency"], **errors), counter))
+        sheets.write_rows = stages.wrap("sheets_write", sheets.write_rows)
+        return sheets
+
+    app.DriveService = make_drive
+    app.AIProcessor = make_ai
+    app.SheetsService = make_sheets
+
+    started = time.perf_counter()
+    asyncio.run(app.main(full_scan=True))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "files": n_files,
+        "seconds": round(elapsed, 2),
+        "files_per_sec": round(n_files / elapsed, 2) if elapsed else None,
+        "stages_ms": stages.summary(),
+        "api_calls_per_file": round(counter.total / n_files, 2) if n_files else None,
+        "api_calls": counter.calls,
+        "peak_rss_mb": _peak_rss_mb(),
+        "gemini_tokens": {kind: metrics.counter("gemini_tokens_total", kind=kind)
+                          for kind in ("prompt", "cached", "output")},
+        "gemini_cost_usd": round(metrics.counter("gemini_cost_usd_total", mode="online"), 4),
+    }
+
+
+def _print_result(result: dict):
+    print(f"\n=== {result['files']} файлів: {result['seconds']} с, {result['files_per_sec']} файлів/с, "
+          f"{result['api_calls_per_file']} викликів API/файл, пік RSS {result['peak_rss_mb']} МБ")
+    tokens = result["gemini_tokens"]
+    print(f"   токени Gemini: промпт {tokens['prompt']}, кеш {tokens['cached']}, відповідь {tokens['output']}; "
+          f"оцінена вартість ${result['gemini_cost_usd']}")
+    for stage, pct in result["stages_ms"].items():
+        print(f"   {stage:<13} p50={pct['p50']:>8} мс  p95={pct['p95']:>8} мс  p99={pct['p99']:>8} мс")
+    for name, count in sorted(result["api_calls"].items()):
+        print(f"   {name:<34} {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк CallAnalyzer")
+    parser.add_argument("--files", type=int, nargs="+", default=[10, 100, 1000],
+                        help="Розміри синтетичних папок (10..10000)")
+    parser.add_argument("--drive-latency", type=float, default=0.02)
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--gemini-latency", type=float, default=0.2)
+    parser.add_argument("--sheets-latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Частка помилок 5xx")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Частка відповідей 429")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Перевизначити Config (напр. --set ANALYZE_WORKERS=8)")
+    parser.add_argument("--json", help="Зберегти результати у JSON-файл")
+    args = parser.parse_args()
+
+    config = {
+        # Ліміти API не мають обмежувати бенчмарк, якщо їх не задано явно
+        "GEMINI_RPM": 1e6, "DRIVE_RPM": 1e6, "SHEETS_RPM": 1e6,
+    }
+    for item in args.set:
+        key, value = item.split("=", 1)
+        config[key] = json.loads(value) if value.replace(".", "", 1).isdigit() else value
+
+    options = {
+        "drive_latency": args.drive_latency, "upload_latency": args.upload_latency,
+        "gemini_latency": args.gemini_latency, "sheets_latency": args.sheets_latency,
+        "error_rate": args.error_rate, "rate_429": args.rate_429, "config": config,
+    }
+
+    results = []
+    for n_files in args.files:
+        # Кожен розмір — у свіжому процесі, щоб пік RSS не накопичувався
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(run_once, n_files, options).result()
+        _print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,161 @@
-import os
+import signal
 import asyncio
-import time
+import argparse
 from src.config import Config
 from src.google_drive import DriveService
 from src.ai_processor import AIProcessor
 from src.google_sheets import SheetsService
 from src.database import Database
+from src.pipeline import Pipeline
+from src.analysis_cache import AnalysisCache
+from src.backlog import BacklogProcessor
+from src.audio_preprocessor import AudioPreprocessor
+from src.jobs import JobQueue
+from src.scheduler import Scheduler
+from src.sheets_outbox import SheetsOutbox
+from src.transcript_search import TranscriptSearch
+from src.replay import Replay
+from src.sheet_rebuild import SheetRebuild
+from src.metrics import metrics, start_metrics_server
 from src.logger import logger
 
 
-async def main():
+DRIVE_TOKEN_KEY = "drive_changes_page_token"
+
+
+async def discover_files(drive, db, full_scan: bool = False) -> tuple:
+    """
+    Знаходить нові аудіофайли для обробки.
+    В інкрементальному режимі читає лише стрічку змін Drive від збереженого токена,
+    інакше (перший запуск, --full-scan або DISCOVERY_MODE=full) сканує всю папку.
+    Повертає (список файлів, токен, який треба зберегти після обробки).
+    """
+    saved_token = await db.get_state(DRIVE_TOKEN_KEY)
+
+    if saved_token and not full_scan and Config.DISCOVERY_MODE == "changes":
+        logger.info("🔎 Інкрементальний пошук через стрічку змін Drive...")
+        return await asyncio.to_thread(drive.list_changes, saved_token, Config.SOURCE_FOLDER_ID)
+
+    # Токен беремо ДО сканування, щоб не пропустити файли, додані під час нього
+    logger.info("🔎 Повне сканування папки Drive...")
+    start_token = await asyncio.to_thread(drive.get_start_page_token)
+    files = await asyncio.to_thread(drive.list_audio_files, Config.SOURCE_FOLDER_ID)
+    return files, start_token
+
+
+async def process_new_files(drive, ai, sheets, db, full_scan: bool = False, backlog: bool = False,
+                            stop_event: asyncio.Event = None) -> int:
+    """
+    Один прохід обробки: пошук нових файлів, відсіювання вже оброблених,
+    постановка їх у спільну чергу задач та обробка всього, що вдалося забрати
+    в оренду, через конвеєр (або пакетні задачі Gemini у режимі --backlog).
+    Повертає кількість взятих у роботу файлів.
+    """
+    jobs = JobQueue(db)
+
+    # 2. Отримання списку файлів
+    try:
+        files, next_token = await discover_files(drive, db, full_scan)
+    except Exception as e:
+        logger.error(f"❌ Помилка доступу до Google Drive: {e}")
+        return 0
+
+    if files:
+        logger.info(f"📂 Знайдено {len(files)} файлів. Перевірка бази даних...\n")
+
+        # 3. Відбір ще не оброблених файлів (один запит до бази на весь список)
+        unprocessed = await db.filter_unprocessed([f['id'] for f in files])
+        pending = [f for f in files if f['id'] in unprocessed]
+        logger.info(f"⏭️  Пропущено {len(files) - len(pending)} файлів (вже є в базі)")
+
+        await jobs.enqueue(pending, retry_failed=full_scan)
+    else:
+        logger.info("📭 Нових файлів не знайдено.")
+
+    # Файли вже збережені в черзі задач, тож токен змін можна зсувати
+    await db.set_state(DRIVE_TOKEN_KEY, next_token)
+
+    # 4. Паралельна обробка через конвеєр (скачування -> аналіз -> звіт)
+    #    або пакетними задачами для великого архіву.
+    #    Задачі забираються пачками, тож кілька екземплярів ділять роботу між собою.
+    cache = AnalysisCache(db, ai.prompt_version)
+    preprocessor = AudioPreprocessor() if Config.PREPROCESS_AUDIO else None
+    if backlog:
+        processor = BacklogProcessor(drive, ai, sheets, db, cache=cache, preprocessor=preprocessor)
+    else:
+        processor = Pipeline(drive, ai, sheets, db, cache=cache, preprocessor=preprocessor,
+                             stop_event=stop_event)
+
+    claimed_total = 0
+    try:
+        while stop_event is None or not stop_event.is_set():
+            claimed = await jobs.claim(Config.BACKLOG_BATCH_SIZE if backlog else None)
+            if not claimed:
+                break
+            claimed_total += len(claimed)
+            logger.info(f"🔄 {jobs.worker_id}: взято в роботу {len(claimed)} файлів.\n")
+            async with jobs.lease(claimed, processor.failed):
+                await processor.run(claimed)
+    finally:
+        if preprocessor is not None:
+            preprocessor.close()
+            logger.info(f"🎚️  Попередня обробка зекономила {preprocessor.bytes_saved / 1e6:.1f} МБ")
+
+    if claimed_total:
+        logger.info(f"♻️  {cache.summary()}")
+        await cache.evict()
+        log_metrics_summary()
+    return claimed_total
+
+
+def log_metrics_summary():
+    """Пише в лог підсумок метрик: тривалості етапів, токени, вартість, повтори."""
+    lines = metrics.summary()
+    if lines:
+        logger.info("📊 Метрики (накопичено з моменту запуску):\n" + "\n".join(lines))
+
+
+async def run_daemon(drive, ai, sheets, db, full_scan: bool = False):
+    """
+    Режим служби (--daemon): клієнти створюються один раз і лишаються "теплими",
+    Drive опитується кожні POLL_INTERVAL секунд, а без нових файлів інтервал
+    подвоюється до POLL_MAX_INTERVAL. SIGTERM/SIGINT зупиняють подачу нових
+    файлів, дають доробити розпочаті та скинути всі буфери.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, AttributeError, ValueError):
+            # Windows: обробники сигналів для циклу подій недоступні
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(stop_event.set))
+
+    logger.info(f"🕒 Режим служби: опитування кожні {Config.POLL_INTERVAL:.0f} с")
+    interval = Config.POLL_INTERVAL
+    while not stop_event.is_set():
+        processed = await process_new_files(drive, ai, sheets, db, full_scan, stop_event=stop_event)
+        full_scan = False
+
+        # Адаптивний інтервал: після роботи — швидко, у простої — рідше
+        if processed:
+            interval = Config.POLL_INTERVAL
+        else:
+            interval = min(interval * 2, Config.POLL_MAX_INTERVAL)
+
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+    logger.info("🛑 Отримано сигнал зупинки. Роботу завершено коректно.")
+
+
+async def main(full_scan: bool = False, backlog: bool = False, daemon: bool = False):
     """
     Головна функція запуску бота.
-    Працює ПОСЛІДОВНО, але використовує асинхронну базу даних
-    для пропуску вже оброблених файлів.
+    Обробляє файли паралельно через асинхронний конвеєр (src/pipeline.py)
+    та використовує базу даних для пропуску вже оброблених файлів.
     Веде запис подій у файл bot.log та консоль.
     """
     logger.info("🤖 --- ЗАПУСК БОТА --- 🤖")
@@ -29,75 +171,150 @@ async def main():
         db = Database()
         await db.init()
 
-        logger.info("✅ Сервіси успішно підключено.\n")
-    except Exception as e:
-        logger.error(f"❌ Критична помилка при запуску: {e}")
-        return
+        logger.info("✅ Сервіси успішно підключено.")
+        logger.info(f"📋 Порядок обробки черги: {Scheduler().describe()}\n")
 
-    # 2. Отримання списку файлів
-    try:
-        files = drive.list_audio_files(Config.SOURCE_FOLDER_ID)
+        if Config.METRICS_PORT:
+            start_metrics_server(Config.METRICS_PORT)
     except Exception as e:
-        logger.error(f"❌ Помилка доступу до Google Drive: {e}")
+        logger.error(f"❌ Критична помилка при запуску: {e}")
         return
 
-    if not files:
-        logger.info("📭 Файлів не знайдено.")
-        return
+    # Окремий відправник рядків у Google Sheets з локальної черги (outbox):
+    # спершу відправляє те, що лишилось з попереднього запуску
+    outbox = SheetsOutbox(sheets, db)
+    outbox.start()
 
-    logger.info(f"📂 Знайдено {len(files)} файлів. Перевірка бази даних...\n")
+    try:
+        if daemon:
+            await run_daemon(drive, ai, sheets, db, full_scan)
+        else:
+            await process_new_files(drive, ai, sheets, db, full_scan, backlog)
+    finally:
+        await outbox.stop()
+        await asyncio.to_thread(ai.close)
+        await db.close()
 
-    # 3. Основний цикл обробки (ПО ЧЕРЗІ)
-    for i, file_info in enumerate(files, 1):
-        file_name = file_info['name']
-        file_id = file_info['id']
+    logger.info("\n🎉 ВСІ ЗАВДАННЯ ВИКОНАНО!")
 
-        # Перевірка в базі даних (чи обробляли ми цей файл раніше?)
-        if await db.file_exists(file_id):
-            logger.info(f"[{i}/{len(files)}] ⏭️  Пропуск: {file_name} (вже є в базі)")
-            continue
 
-        logger.info(f"[{i}/{len(files)}] 🔄 Обробка: {file_name}...")
+async def run_report(by: str, since_week: str = None, until_week: str = None, output: str = None):
+    """
+    Звіт із локальної бази без звернень до Google (--report).
+    Виводить таблицю в консоль і, за потреби, зберігає її в .csv або .xlsx.
+    """
+    # pandas потрібен лише для звітів, тож імпортується тут, а не при кожному запуску
+    from src.analytics import Analytics
 
-        try:
-            # Скачування
-            local_path = drive.download_file(file_id, file_name)
+    db = Database()
+    await db.init()
+    try:
+        report = await Analytics(db).report(by, since_week, until_week)
+    finally:
+        await db.close()
 
-            # Аналіз AI
-            result = ai.analyze_call(local_path)
+    if report.empty:
+        logger.info("📭 У базі ще немає результатів для звіту.")
+        return
 
-            # Логіка корекції оцінки
-            if result.get('manager_score', 0) > 6:
-                result['is_critical_fail'] = False
-                result['critical_comment'] = ""
+    print(report.to_string())
+    if output:
+        if output.endswith(".xlsx"):
+            report.to_excel(output)
+        else:
+            report.to_csv(output, encoding="utf-8-sig")
+        logger.info(f"💾 Звіт збережено у {output}")
 
-            # Запис у Таблицю
-            sheets.append_analysis(file_name, result)
 
-            # Запис успіху в Базу Даних
-            await db.add_file(file_id, file_name, result.get('manager_score', 0))
+async def run_search(query: str, limit: int = 20):
+    """Пошук по повних транскрибаціях у локальній базі (--search)."""
+    db = Database()
+    await db.init()
+    try:
+        results = await TranscriptSearch(db).search(query, limit)
+    except Exception as e:
+        logger.error(f"❌ Некоректний пошуковий запит: {e}")
+        return
+    finally:
+        await db.close()
 
-            # Видалення локального файлу
-            if os.path.exists(local_path):
-                os.remove(local_path)
+    if not results:
+        logger.info("📭 Нічого не знайдено.")
+        return
+    for item in results:
+        print(f"[{item['rank']:>6}] {item['call_date']}  {item['manager']}  "
+              f"оцінка {item['manager_score']}  {item['file_name']}")
+        print(f"         {item['snippet']}\n")
 
-            logger.info(f"   ✅ Готово. Оцінка: {result.get('manager_score')}")
 
-        except Exception as e:
-            logger.error(f"   ❌ Помилка під час обробки {file_name}: {e}")
-            # Видаляємо файл, якщо він залишився пошкодженим
-            local_path = os.path.join(Config.TEMP_FOLDER, file_name)
-            if os.path.exists(local_path):
-                try:
-                    os.remove(local_path)
-                except:
-                    pass
+async def run_replay():
+    """
+    Повторне застосування правил корекції до збережених відповідей моделі (--replay):
+    перезаписує базу та таблицю без звернень до Gemini.
+    """
+    try:
+        sheets = SheetsService()
+        db = Database()
+        await db.init()
+    except Exception as e:
+        logger.error(f"❌ Критична помилка при запуску: {e}")
+        return
+    try:
+        await Replay(db, sheets).run()
+    finally:
+        await db.close()
 
-        # Пауза для стабільності API
-        time.sleep(1)
 
-    logger.info("\n🎉 ВСІ ЗАВДАННЯ ВИКОНАНО!")
+async def run_rebuild_sheet(sheet_name: str = None):
+    """
+    Перебудова аркуша з локальної бази (--rebuild-sheet): аркуш очищається
+    й заповнюється заново кількома великими запитами, без звернень до Gemini.
+    """
+    try:
+        sheets = SheetsService()
+        if sheet_name:
+            sheets.sheet_name = sheet_name
+        db = Database()
+        await db.init()
+    except Exception as e:
+        logger.error(f"❌ Критична помилка при запуску: {e}")
+        return
+    try:
+        await SheetRebuild(db, sheets).run()
+    finally:
+        await db.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="AI Call Analyzer Bot")
+    parser.add_argument("--full-scan", action="store_true",
+                        help="Повне сканування папки замість стрічки змін Drive")
+    parser.add_argument("--backlog", action="store_true",
+                        help="Обробити архів пакетними задачами Gemini Batch API")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Працювати як служба з постійним опитуванням Drive")
+    parser.add_argument("--report", choices=["branch", "manager", "service", "week", "model"],
+                        help="Звіт з локальної бази: manager, branch, service, week або model (вартість і швидкість моделей)")
+    parser.add_argument("--since", help="Початковий тиждень звіту (напр. 2025-W01)")
+    parser.add_argument("--until", help="Кінцевий тиждень звіту (напр. 2025-W52)")
+    parser.add_argument("--output", help="Зберегти звіт у .csv або .xlsx")
+    parser.add_argument("--search", metavar="QUERY",
+                        help='Пошук по транскрибаціях (FTS5: слова, "фрази", префікс*, AND/OR/NOT)')
+    parser.add_argument("--limit", type=int, default=20, help="Кількість результатів пошуку")
+    parser.add_argument("--replay", action="store_true",
+                        help="Застосувати поточні правила до збережених відповідей моделі (без AI)")
+    parser.add_argument("--rebuild-sheet", action="store_true",
+                        help="Перебудувати аркуш таблиці з локальної бази (кількома великими запитами)")
+    parser.add_argument("--sheet", help="Аркуш для --rebuild-sheet (типово SHEET_NAME)")
+    args = parser.parse_args()
+
+    if args.rebuild_sheet:
+        asyncio.run(run_rebuild_sheet(args.sheet))
+    elif args.replay:
+        asyncio.run(run_replay())
+    elif args.search:
+        asyncio.run(run_search(args.search, args.limit))
+    elif args.report:
+        asyncio.run(run_report(args.report, args.since, args.until, args.output))
+    else:
+        asyncio.run(main(full_scan=args.full_scan, backlog=args.backlog, daemon=args.daemon))
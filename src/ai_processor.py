@@ -1,9 +1,18 @@
+import os
 import json
 import time
-from google import genai
-from google.genai import types
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import ValidationError
 from src.config import Config
 from src.logger import logger
+from src.metrics import metrics
+from src.rate_limiter import get_limiter, is_transient
+from src.audio_preprocessor import detect_format, probe_duration
+from src.call_analysis import CallAnalysis
+from src.segmented_analysis import SegmentedAnalyzer
+from src.model_router import ModelRouter
 
 class AIProcessor:
     """
@@ -11,118 +20,393 @@ class AIProcessor:
     Відповідає за завантаження аудіо, генерацію промптів та парсинг відповідей.
     """
 
-    def __init__(self):
+    # Коротке повідомлення до аудіо; основні інструкції йдуть окремо (кеш/system_instruction)
+    USER_INSTRUCTION = "Проаналізуй цей дзвінок згідно з інструкціями."
+
+    # Інструкція для транскрибації сегментів довгих записів
+    TRANSCRIBE_PROMPT = (
+        "Ти — стенографіст. Дослівно транскрибуй фрагмент телефонної розмови "
+        "автосервісу українською. Позначай репліки як \"Менеджер:\" та \"Клієнт:\". "
+        "Поверни лише текст транскрибації."
+    )
+
+    def __init__(self, client=None):
+        """client — готовий клієнт genai (наприклад, локальна заміна для бенчмарків)."""
         # Перевірка наявності ключа API у конфігурації
-        if not Config.GEMINI_API_KEY:
+        if client is None and not Config.GEMINI_API_KEY:
             logger.error("❌ Відсутній API ключ Gemini у конфігурації!")
             raise ValueError("Відсутній API ключ Gemini у конфігурації!")
 
-        self.client = genai.Client(api_key=Config.GEMINI_API_KEY)
-        self.model_name = "gemini-2.0-flash"
+        # SDK google-genai імпортується та клієнт створюється лише при першому запиті
+        self._client = client
+        self.model_name = Config.GEMINI_MODEL
+
+        # Короткі дзвінки — дешевшій моделі, сумнівні відповіді — повтор сильнішою
+        self.router = ModelRouter()
+
+        # Спільний адаптивний обмежувач запитів до Gemini (429 обробляються всередині)
+        self.limiter = get_limiter('gemini')
+
+        # Статичні інструкції, каталог послуг та схема відповіді формуються один раз
+        self.prompt = self._build_prompt()
+        self.response_schema = CallAnalysis.response_schema()
+
+        # Відбиток моделей, промпту та схеми: змінюється, якщо змінились інструкції чи моделі.
+        # Використовується як частина ключа кешу результатів аналізу.
+        schema_str = json.dumps(self.response_schema, ensure_ascii=False, sort_keys=True)
+        models = ",".join(sorted(set(self.router.models.values())))
+        self.prompt_version = hashlib.sha256(
+            f"{models}\n{self.prompt}\n{schema_str}".encode("utf-8")
+        ).hexdigest()[:16]
+
+        # Кешований контекст Gemini з інструкціями (якщо модель підтримує)
+        self._context_enabled = Config.GEMINI_CONTEXT_CACHE
+        self._context_name = None
+        self._context_expires = 0.0
+        self._context_lock = threading.Lock()
+
+        # Видалення файлів із Gemini у фоні, щоб не затримувати конвеєр
+        self._cleanup_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-cleanup")
+
+        # Довгі записи аналізуються сегментами (паралельна транскрибація + одна оцінка)
+        self.segmented = SegmentedAnalyzer(self)
 
-    def _clean_json_string(self, text_response: str) -> str:
+    @property
+    def client(self):
+        """Клієнт genai (ліниво: запуск без нових файлів не завантажує SDK)."""
+        if self._client is None:
+            from google import genai
+            self._client = genai.Client(api_key=Config.GEMINI_API_KEY)
+        return self._client
+
+    def _build_prompt(self) -> str:
+        """Формує інструкцію для моделі зі списком послуг із конфігурації."""
+        services_str = ", ".join(Config.SERVICES_LIST)
+
+        prompt = f"""
+        Ти — QA в автосервісі. Проаналізуй дзвінок українською.
+
+        1. Транскрибація (дослівна).
+        2. Тип послуги: ТІЛЬКИ ОДИН з [{services_str}].
+        3. KPI (1 - так, 0 - ні):
+           - Привітання?
+           - КУЗОВ?
+           - РІК?
+           - ПРОБІГ?
+           - Запропонував діагностику (Upsell)?
+           - Історія авто?
+           - Прощання?
+        4. Оцінка (1-10).
+        5. Результат (Записався/Думає/Відмова).
+        6. Критичні помилки.
+
+        Output format: Pure JSON object.
+        Keys: transcription, service_type, manager_score, result, is_critical_fail, critical_comment, kpi_greeting, kpi_body, kpi_year, kpi_mileage, kpi_upsell, kpi_history, kpi_closing.
         """
-        Очищує рядок відповіді від маркерів форматування Markdown (```json ... ```),
-        щоб підготувати його для парсингу через json.loads.
+        return prompt
+
+    def _cached_context(self) -> str:
+        """
+        Повертає назву кешованого контексту з інструкціями, створюючи або
+        оновлюючи його за потреби. Якщо модель не підтримує кешування
+        (наприклад, промпт коротший за мінімальний розмір кешу) — повертає None.
         """
-        if text_response.startswith("```json"):
-            text_response = text_response[7:-3]
-        elif text_response.startswith("```"):
-            text_response = text_response[3:-3]
+        if not self._context_enabled:
+            return None
 
-        return text_response.strip()
+        with self._context_lock:
+            if self._context_name and time.monotonic() < self._context_expires:
+                return self._context_name
 
-    def analyze_call(self, audio_path: str) -> dict:
+            from google.genai import types
+            ttl = Config.GEMINI_CONTEXT_TTL
+            try:
+                cache = self.limiter.call(
+                    self.client.caches.create,
+                    model=self.model_name,
+                    config=types.CreateCachedContentConfig(
+                        display_name="call-analyzer-instructions",
+                        system_instruction=self.prompt,
+                        ttl=f"{ttl}s",
+                    )
+                )
+            except Exception as e:
+                if not is_transient(e):
+                    logger.info(f"ℹ️ Кешування контексту недоступне для {self.model_name}: {e}. "
+                                f"Інструкції передаються як system_instruction.")
+                    self._context_enabled = False
+                return None
+
+            self._context_name = cache.name
+            # Оновлюємо кеш трохи раніше, ніж він сплине на стороні Google
+            self._context_expires = time.monotonic() + ttl - 60
+            return self._context_name
+
+    def upload_audio(self, audio_path: str, mime_type: str = None):
         """
-        Основний метод аналізу дзвінка.
-        Завантажує файл, відправляє запит до AI та повертає структуровані дані.
+        Завантажує аудіофайл на сервери Google та повертає посилання на нього.
+        MIME-тип визначається за вмістом файлу, якщо не переданий явно.
+        Видалення з Gemini — discard_remote_file, коли файл більше не потрібен.
         """
-        logger.info(f"DEBUG: Завантаження {audio_path} у Gemini...")
+        # Передаємо шлях, щоб повтор після 429 читав файл з початку
+        with metrics.timer("upload"):
+            file_ref = self.limiter.call(
+                self.client.files.upload,
+                file=audio_path,
+                config={'mime_type': mime_type or detect_format(audio_path)[1]}
+            )
+        return file_ref
 
-        try:
-            # 1. Завантаження аудіофайлу на сервери Google
-            with open(audio_path, "rb") as f:
-                file_ref = self.client.files.upload(
-                    file=f,
-                    config={'mime_type': 'audio/mp3'}
-                )
+    def discard_remote_file(self, file_ref):
+        """Ставить видалення файлу з Gemini у фонову чергу."""
+        self._cleanup_pool.submit(self._delete_remote_file, file_ref.name)
 
-            services_str = ", ".join(Config.SERVICES_LIST)
-
-            # 2. Формування системного промпту
-            prompt = f"""
-            Ти — QA в автосервісі. Проаналізуй дзвінок українською.
-
-            1. Транскрибація (дослівна).
-            2. Тип послуги: ТІЛЬКИ ОДИН з [{services_str}].
-            3. KPI (1 - так, 0 - ні):
-               - Привітання?
-               - КУЗОВ?
-               - РІК?
-               - ПРОБІГ?
-               - Запропонував діагностику (Upsell)?
-               - Історія авто?
-               - Прощання?
-            4. Оцінка (1-10).
-            5. Результат (Записався/Думає/Відмова).
-            6. Критичні помилки.
-
-            Output format: Pure JSON object.
-            Keys: transcription, service_type, manager_score, result, is_critical_fail, critical_comment, kpi_greeting, kpi_body, kpi_year, kpi_mileage, kpi_upsell, kpi_history, kpi_closing.
-            """
-
-            # 3. Генерація відповіді з механізмом повторних спроб (Retry)
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    response = self.client.models.generate_content(
-                        model=self.model_name,
-                        contents=[file_ref, prompt],
-                        config=types.GenerateContentConfig(
-                            response_mime_type="application/json"
-                        )
-                    )
+    def _delete_remote_file(self, name: str):
+        try:
+            self.limiter.call(self.client.files.delete, name=name)
+        except Exception as e:
+            logger.warning(f"⚠️ Не вдалося видалити файл {name} з Gemini: {e}")
 
-                    # Очищення та парсинг JSON
-                    clean_text = self._clean_json_string(response.text)
+    def close(self):
+        """Дочікується фонового прибирання файлів та видаляє кешований контекст."""
+        self.segmented.close()
+        self._cleanup_pool.shutdown(wait=True)
+        if self._context_name:
+            try:
+                self.client.caches.delete(name=self._context_name)
+            except Exception as e:
+                logger.warning(f"⚠️ Не вдалося видалити кешований контекст: {e}")
+            self._context_name = None
 
-                    # strict=False дозволяє коректно обробляти спецсимволи (наприклад, переноси рядків)
-                    parsed_data = json.loads(clean_text, strict=False)
+    def generation_config(self, response_schema: dict = None, model: str = None):
+        """
+        Налаштування генерації (JSON за схемою CallAnalysis).
+        Інструкції йдуть через кешований контекст або system_instruction,
+        тож у кожному запиті (і повторі) не передається весь текст промпту.
+        Кешований контекст прив'язаний до основної моделі, тож для інших — лише system_instruction.
+        """
+        from google.genai import types
+        schema = response_schema or self.response_schema
+        context = self._cached_context() if model in (None, self.model_name) else None
+        if context:
+            return types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=schema,
+                cached_content=context,
+            )
+        return types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=schema,
+            system_instruction=self.prompt,
+        )
 
-                    # Обробка випадку, коли AI повертає список замість словника
-                    if isinstance(parsed_data, list):
-                        if len(parsed_data) > 0:
-                            parsed_data = parsed_data[0]
-                        else:
-                            return self._get_error_object("AI повернув порожній список")
+    def build_batch_request(self, file_ref) -> dict:
+        """Формує запит для пакетної задачі (Batch API) з посиланням на завантажений файл."""
+        return {
+            'contents': [{
+                'role': 'user',
+                'parts': [
+                    {'file_data': {'file_uri': file_ref.uri, 'mime_type': file_ref.mime_type}},
+                    {'text': self.USER_INSTRUCTION},
+                ],
+            }],
+            'config': {
+                'response_mime_type': 'application/json',
+                'response_schema': self.response_schema,
+                'system_instruction': self.prompt,
+            },
+        }
 
-                    return parsed_data
+    def parse_response(self, text_response: str, model: str = None) -> CallAnalysis:
+        """
+        Перетворює текстову відповідь моделі на перевірений CallAnalysis
+        і зберігає в ньому сиру відповідь, модель та версію промпту.
+        Кидає json.JSONDecodeError або pydantic.ValidationError, якщо відповідь некоректна.
+        """
+        result = CallAnalysis.parse(text_response)
+        if not result.is_error:
+            result.raw_response = text_response
+            result.ai_model = model or self.model_name
+            result.prompt_version = self.prompt_version
+        return result
 
-                except Exception as e:
-                    # Обробка лімітів API (429 Too Many Requests)
-                    if "429" in str(e) or "quota" in str(e).lower():
-                        wait_time = 40
-                        logger.warning(f"⚠️ Вичерпано квоту API. Очікування {wait_time} с...")
-                        time.sleep(wait_time)
+    def analyze_call(self, audio_path: str, mime_type: str = None) -> CallAnalysis:
+        """
+        Основний метод аналізу дзвінка.
+        Завантажує файл, відправляє запит до AI та повертає структуровані дані
+        (разом з моделлю, вартістю запитів і тривалістю аналізу).
+        Файл завантажується один раз: повтори при відповіді поза схемою та повторний
+        аналіз сильнішою моделлю використовують те саме посилання, після чого
+        файл видаляється з Gemini у фоні.
+        """
+        started = time.perf_counter()
+        file_ref = None
+        try:
+            # Довгий запис — сегментами, щоб один запит не тримав усі 40 хвилин аудіо
+            duration, segments = self.segmented.plan(audio_path)
+            if segments:
+                result = self.segmented.analyze(audio_path, duration, segments)
+            else:
+                logger.info(f"DEBUG: Завантаження {audio_path} у Gemini...")
 
-                    # Обробка помилок структури JSON (спробуємо ще раз)
-                    elif isinstance(e, json.JSONDecodeError):
-                        logger.warning(f"⚠️ Помилка парсингу JSON (спроба {attempt + 1}): {e}")
-                        continue
-                    else:
-                        raise e
+                # 1. Завантаження аудіофайлу на сервери Google
+                file_ref = self.upload_audio(audio_path, mime_type=mime_type)
 
-            return self._get_error_object("Не вдалося проаналізувати файл після всіх спроб")
+                # 2. Генерація відповіді (модель обирає маршрутизатор)
+                result = self._routed_analysis([file_ref, self.USER_INSTRUCTION],
+                                               self._duration(audio_path, duration))
 
         except Exception as e:
             logger.error(f"❌ Критична помилка AI: {e}")
             return self._get_error_object(str(e))
 
-    def _get_error_object(self, msg):
-        """Повертає структуру даних за замовчуванням (заглушку) у разі помилки."""
-        return {
-            "transcription": f"Error: {msg}", "service_type": "Error",
-            "manager_score": 0, "is_critical_fail": True, "critical_comment": "System Error",
-            "kpi_greeting": 0, "kpi_body": 0, "kpi_year": 0, "kpi_mileage": 0,
-            "kpi_upsell": 0, "kpi_history": 0, "kpi_closing": 0, "result": "Error"
-        }
+        finally:
+            # Файл у Gemini більше не потрібен — прибираємо у фоні
+            if file_ref is not None:
+                self.discard_remote_file(file_ref)
+
+        result.ai_latency = time.perf_counter() - started
+        return result
+
+    @staticmethod
+    def _duration(audio_path: str, duration: float = None) -> float:
+        """Тривалість запису для маршрутизації: відома, з ffprobe/WAV або оцінена за розміром."""
+        if duration is None:
+            duration = probe_duration(audio_path)
+        if duration is None:
+            duration = os.path.getsize(audio_path) / Config.SCHEDULE_BYTES_PER_SECOND
+        return duration
+
+    def _routed_analysis(self, contents: list, duration: float) -> CallAnalysis:
+        """
+        Аналіз із маршрутизацією: короткий запис спершу аналізує швидша модель,
+        а сумнівну відповідь — повторно основна (той самий завантажений файл).
+        Вартість обох проходів підсумовується, причина повтору зберігається в результаті.
+        """
+        tier = self.router.choose(duration)
+        result = self._generate_analysis(contents, model=self.router.models[tier])
+        if tier != ModelRouter.FAST:
+            return result
+
+        reason = self.router.escalation_reason(result)
+        if reason is None:
+            return result
+
+        metrics.inc("model_escalations_total", reason=reason)
+        logger.info(f"⤴️  Повторний аналіз моделлю {self.model_name} ({reason})")
+        first_pass_cost = result.ai_cost_usd
+        result = self._generate_analysis(contents, model=self.model_name)
+        result.ai_cost_usd += first_pass_cost
+        result.escalation = reason
+        return result
+
+    def _generate_analysis(self, contents: list, response_schema: dict = None, model: str = None) -> CallAnalysis:
+        """
+        Запит аналізу з повторними спробами при відповіді поза схемою.
+        Ліміти API (429) обробляє обмежувач і вони не витрачають ці спроби.
+        У результаті зберігається вартість усіх спроб.
+        """
+        model = model or self.model_name
+        cost = 0.0
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                with metrics.timer(f"generate_{self.router.tier_of(model)}"):
+                    response = self.limiter.call(
+                        self.client.models.generate_content,
+                        model=model,
+                        contents=contents,
+                        config=self.generation_config(response_schema, model)
+                    )
+                cost += self.record_usage(getattr(response, 'usage_metadata', None), model=model)
+                result = self.parse_response(response.text, model)
+                result.ai_cost_usd = cost
+                return result
+
+            except (json.JSONDecodeError, ValidationError) as e:
+                # Відповідь не відповідає схемі (рідко, бо схему передано моделі) — ще одна спроба
+                metrics.inc("malformed_json_retries_total")
+                logger.warning(f"⚠️ Некоректна відповідь моделі (спроба {attempt + 1}): {e}")
+                continue
+
+        result = self._get_error_object("Не вдалося проаналізувати файл після всіх спроб")
+        result.ai_cost_usd = cost
+        return result
+
+    def transcribe_segment(self, audio_path: str, mime_type: str = None) -> tuple:
+        """Дослівна транскрибація одного сегмента довгого запису. Повертає (текст, вартість запиту)."""
+        from google.genai import types
+        file_ref = self.upload_audio(audio_path, mime_type=mime_type)
+        try:
+            with metrics.timer("transcribe_segment"):
+                response = self.limiter.call(
+                    self.client.models.generate_content,
+                    model=self.model_name,
+                    contents=[file_ref],
+                    config=types.GenerateContentConfig(
+                        response_mime_type="text/plain",
+                        system_instruction=self.TRANSCRIBE_PROMPT,
+                    )
+                )
+            cost = self.record_usage(getattr(response, 'usage_metadata', None))
+            if not response.text:
+                raise ValueError("порожня транскрибація")
+            return response.text, cost
+        finally:
+            self.discard_remote_file(file_ref)
+
+    def score_transcript(self, transcript: str) -> CallAnalysis:
+        """
+        Оцінка дзвінка за готовою транскрибацією (текстовий запит, без аудіо).
+        Модель не повторює текст у відповіді: схема без поля transcription.
+        """
+        contents = [f"Транскрибація дзвінка:\n{transcript}\n\n{self.USER_INSTRUCTION}"]
+        return self._generate_analysis(contents, CallAnalysis.response_schema(with_transcription=False))
+
+    @staticmethod
+    def _field(obj, name: str):
+        """Читає поле usage_metadata як з об'єкта SDK, так і зі словника (Batch API)."""
+        if isinstance(obj, dict):
+            return obj.get(name)
+        return getattr(obj, name, None)
+
+    def record_usage(self, usage, batch: bool = False, model: str = None) -> float:
+        """
+        Враховує токени та оцінену вартість одного запиту за usage_metadata.
+        Аудіо- та текстові токени промпту тарифікуються окремо (за цінами рівня моделі),
+        кешовані — за ціною кешу, пакетні запити — зі знижкою Batch API.
+        Повертає оцінену вартість запиту в доларах.
+        """
+        if not usage:
+            return 0.0
+        prompt_tokens = self._field(usage, 'prompt_token_count') or 0
+        output_tokens = self._field(usage, 'candidates_token_count') or 0
+        cached_tokens = self._field(usage, 'cached_content_token_count') or 0
+
+        audio_tokens = 0
+        for detail in self._field(usage, 'prompt_tokens_details') or []:
+            modality = str(self._field(detail, 'modality') or "")
+            if modality.upper().endswith("AUDIO"):
+                audio_tokens += self._field(detail, 'token_count') or 0
+        text_tokens = max(0, prompt_tokens - audio_tokens - cached_tokens)
+
+        tier = self.router.tier_of(model or self.model_name)
+        text_price, audio_price, cached_price, output_price = self.router.prices[tier]
+        cost = (text_tokens * text_price + audio_tokens * audio_price
+                + cached_tokens * cached_price + output_tokens * output_price) / 1_000_000
+        if batch:
+            cost *= Config.GEMINI_BATCH_DISCOUNT
+
+        mode = "batch" if batch else "online"
+        metrics.inc("gemini_requests_total", mode=mode)
+        metrics.inc("gemini_tokens_total", prompt_tokens - cached_tokens, kind="prompt")
+        metrics.inc("gemini_tokens_total", cached_tokens, kind="cached")
+        metrics.inc("gemini_tokens_total", output_tokens, kind="output")
+        metrics.inc("gemini_cost_usd_total", cost, mode=mode)
+        metrics.inc("gemini_tier_requests_total", tier=tier)
+        metrics.inc("gemini_tier_cost_usd_total", cost, tier=tier)
+        return cost
+
+    def _get_error_object(self, msg) -> CallAnalysis:
+        """Повертає результат-заглушку у разі помилки."""
+        return CallAnalysis.error(msg)
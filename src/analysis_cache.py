@@ -0,0 +1,77 @@
+import json
+import hashlib
+from src.config import Config
+from src.logger import logger
+from src.call_analysis import CallAnalysis
+
+
+class AnalysisCache:
+    """
+    Кеш результатів аналізу, адресований вмістом аудіо.
+    Ключ складається з MD5 файлу (md5Checksum з Drive або локальний хеш)
+    та відбитка моделі й промпту, тож копії одного запису під різними ID
+    чи назвами не відправляються в Gemini повторно.
+    """
+
+    def __init__(self, db, prompt_version: str):
+        self.db = db
+        self.prompt_version = prompt_version
+        self.enabled = Config.ANALYSIS_CACHE_ENABLED
+
+        # Лічильники ефективності кешу
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, content_hash: str) -> str:
+        """Формує ключ кешу з хешу вмісту та версії промпту/моделі."""
+        return f"{content_hash}:{self.prompt_version}"
+
+    @staticmethod
+    def local_md5(path: str, chunk_size: int = 1024 * 1024) -> str:
+        """Рахує MD5 локального файлу частинами (для файлів без md5Checksum у Drive)."""
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    async def get(self, content_hash: str) -> CallAnalysis:
+        """Повертає збережений результат або None; оновлює лічильники."""
+        if not self.enabled or not content_hash:
+            return None
+        result = await self.db.get_cached_analysis(self._key(content_hash))
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        analysis = CallAnalysis.from_dict(result)
+        # Записи, збережені до появи сирих відповідей: відповіддю вважається сам результат
+        if analysis.raw_response is None:
+            analysis.raw_response = json.dumps(analysis.to_dict(), ensure_ascii=False)
+            analysis.prompt_version = self.prompt_version
+        # Повторний аналіз нічого не коштував і не займав часу моделі
+        analysis.ai_cost_usd = 0.0
+        analysis.ai_latency = 0.0
+        analysis.escalation = ""
+        return analysis
+
+    async def put(self, content_hash: str, result: CallAnalysis):
+        """Зберігає результат аналізу. Заглушки помилок не кешуються."""
+        if not self.enabled or not content_hash or result.is_error:
+            return
+        await self.db.put_cached_analysis(self._key(content_hash), result.to_dict(meta=True))
+
+    async def evict(self):
+        """Прибирає кеш за віком та розміром згідно з конфігурацією."""
+        if not self.enabled:
+            return
+        removed = await self.db.evict_analysis_cache(
+            Config.ANALYSIS_CACHE_MAX_ENTRIES, Config.ANALYSIS_CACHE_MAX_AGE_DAYS)
+        if removed:
+            logger.info(f"🧹 Видалено з кешу аналізів {removed} записів.")
+
+    def summary(self) -> str:
+        """Короткий підсумок роботи кешу для логу."""
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"Кеш аналізів: {self.hits} влучань, {self.misses} промахів ({rate:.0f}%)"
@@ -0,0 +1,123 @@
+import pandas as pd
+from src.config import Config
+from src.call_analysis import KPI_FIELDS
+from src.logger import logger
+
+
+class Analytics:
+    """
+    Локальна аналітика дзвінків (команда --report).
+    Повні результати зберігаються в call_results, а підсумки по тижнях
+    (тиждень x філія x менеджер x тип послуги) матеріалізуються в call_rollups.
+    Оновлюються лише тижні з новими записами, тож звіт за рік читає кілька
+    тисяч готових рядків підсумків замість усіх дзвінків.
+    """
+
+    WATERMARK_KEY = "analytics_rollup_seq"
+    GROUP_COLUMNS = ["week", "branch", "manager", "service_type"]
+    SCORE_COLUMNS = [f"score_{i}" for i in range(1, 11)]
+
+    # Розрізи звіту -> колонки групування
+    DIMENSIONS = {
+        "manager": ["branch", "manager"],
+        "branch": ["branch"],
+        "service": ["service_type"],
+        "week": ["week"],
+    }
+
+    def __init__(self, db):
+        self.db = db
+
+    async def refresh(self) -> int:
+        """Перераховує підсумки для тижнів із новими результатами. Повертає кількість тижнів."""
+        watermark = int(await self.db.get_state(self.WATERMARK_KEY, "0"))
+        weeks, new_watermark = await self.db.changed_weeks(watermark)
+        if not weeks:
+            return 0
+
+        columns, rows = await self.db.fetch_call_results(weeks)
+        rollups = self._rollup(pd.DataFrame.from_records(rows, columns=columns))
+        await self.db.replace_rollups(
+            weeks, list(rollups.columns), list(rollups.itertuples(index=False, name=None)),
+            self.WATERMARK_KEY, new_watermark
+        )
+        logger.info(f"📊 Оновлено підсумки за {len(weeks)} тижн.")
+        return len(weeks)
+
+    def _rollup(self, calls: pd.DataFrame) -> pd.DataFrame:
+        """Векторизоване згортання дзвінків у тижневі підсумки."""
+        # Розподіл оцінок: по колонці на кожен бал 1..10
+        scores = pd.get_dummies(calls["manager_score"].clip(1, 10)).reindex(columns=range(1, 11), fill_value=0)
+        scores.columns = self.SCORE_COLUMNS
+
+        frame = pd.concat([calls[self.GROUP_COLUMNS + ["manager_score", "is_critical_fail", *KPI_FIELDS]],
+                           scores.astype("int64")], axis=1)
+        grouped = frame.groupby(self.GROUP_COLUMNS, sort=False)
+
+        rollups = grouped[["manager_score", "is_critical_fail", *KPI_FIELDS, *self.SCORE_COLUMNS]].sum()
+        rollups = rollups.rename(columns={"manager_score": "score_sum", "is_critical_fail": "critical_fails"})
+        rollups.insert(0, "calls", grouped.size())
+        return rollups.reset_index().astype({c: "int64" for c in rollups.columns})
+
+    async def report(self, by: str = "manager", since_week: str = None, until_week: str = None) -> pd.DataFrame:
+        """
+        Звіт за розрізом by (manager, branch, service, week): кількість дзвінків,
+        середня оцінка, частка критичних помилок, частка виконання кожного KPI
+        та розподіл оцінок (у відсотках). by="model" — порівняння моделей (model_report).
+        """
+        if by == "model":
+            return await self.model_report(since_week, until_week)
+        await self.refresh()
+        columns, rows = await self.db.fetch_rollups(since_week, until_week)
+        rollups = pd.DataFrame.from_records(rows, columns=columns)
+        if rollups.empty:
+            return rollups
+
+        keys = self.DIMENSIONS[by]
+        totals = rollups.groupby(keys).sum(numeric_only=True)
+        calls = totals["calls"]
+
+        report = pd.DataFrame(index=totals.index)
+        report["calls"] = calls
+        report["avg_score"] = (totals["score_sum"] / calls).round(2)
+        report["critical_rate"] = (totals["critical_fails"] / calls * 100).round(1)
+        for name in KPI_FIELDS:
+            report[name] = (totals[name] / calls * 100).round(1)
+        for column in self.SCORE_COLUMNS:
+            report[column] = (totals[column] / calls * 100).round(1)
+
+        if by == "week":
+            return report.sort_index()
+        return report.sort_values("calls", ascending=False)
+
+    async def model_report(self, since_week: str = None, until_week: str = None) -> pd.DataFrame:
+        """
+        Порівняння маршрутів моделей: модель першого проходу, модель після повтору
+        ("fast -> strong"), основна та пакетні задачі ("модель (batch)", вартість зі знижкою).
+        Вартість на дзвінок — лише для дзвінків, що реально аналізувались (без влучань у кеш);
+        тривалість — без пакетних задач, для яких вона невідома.
+        """
+        columns, rows = await self.db.fetch_model_usage(since_week, until_week)
+        calls = pd.DataFrame.from_records(rows, columns=columns)
+        if calls.empty:
+            return calls
+
+        fast_model = Config.GEMINI_FAST_MODEL or Config.GEMINI_MODEL
+        calls["route"] = calls["ai_model"].where(calls["escalation"].isna(), f"{fast_model} -> " + calls["ai_model"])
+        calls["route"] = calls["route"].where(calls["ai_batch"] == 0, calls["route"] + " (batch)")
+        calls["ai_latency"] = calls["ai_latency"].where(calls["ai_latency"] > 0)
+        calls["analyzed"] = calls["ai_latency"].notna() | (calls["ai_batch"] == 1)
+        grouped = calls.groupby("route")
+
+        report = pd.DataFrame(index=grouped.size().index)
+        report["calls"] = grouped.size()
+        report["analyzed"] = grouped["analyzed"].sum()
+        report["avg_latency_s"] = grouped["ai_latency"].mean().round(2)
+        report["p95_latency_s"] = grouped["ai_latency"].quantile(0.95).round(2)
+        report["cost_usd"] = grouped["ai_cost_usd"].sum().round(4)
+        report["cost_per_call_usd"] = (report["cost_usd"] / report["analyzed"].where(report["analyzed"] > 0)).round(5)
+        report["avg_score"] = grouped["manager_score"].mean().round(2)
+        for reason, count in calls.groupby(["route", "escalation"]).size().items():
+            report.loc[reason[0], f"escalated_{reason[1]}"] = count
+        return report.fillna({c: 0 for c in report.columns if c.startswith("escalated_")}) \
+            .sort_values("calls", ascending=False)
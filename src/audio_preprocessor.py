@@ -0,0 +1,229 @@
+import os
+import wave
+import shutil
+import asyncio
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from src.config import Config
+from src.logger import logger
+
+
+# Сигнатури форматів: (зсув, байти, розширення, MIME-тип для Gemini)
+_SIGNATURES = [
+    (0, b"RIFF", ".wav", "audio/wav"),
+    (0, b"ID3", ".mp3", "audio/mp3"),
+    (0, b"OggS", ".ogg", "audio/ogg"),
+    (0, b"fLaC", ".flac", "audio/flac"),
+    (0, b"FORM", ".aiff", "audio/aiff"),
+    (4, b"ftyp", ".m4a", "audio/mp4"),  # контейнер MP4; audio/aac — лише для сирого ADTS
+]
+
+
+def detect_format(path: str) -> tuple:
+    """
+    Визначає справжній формат аудіо за вмістом файлу (а не за назвою).
+    Повертає (розширення, MIME-тип). Невідомі формати вважаються MP3.
+    """
+    with open(path, "rb") as f:
+        head = f.read(12)
+
+    for offset, magic, ext, mime in _SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return ext, mime
+
+    # MP3 без ID3-тегу починається з кадру синхронізації 0xFFE*
+    if len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0:
+        if (head[1] & 0x06) == 0:  # layer = 0 — це ADTS (AAC), а не MPEG audio
+            return ".aac", "audio/aac"
+        return ".mp3", "audio/mp3"
+
+    return ".mp3", "audio/mp3"
+
+
+def _process_with_ffmpeg(src: str, dst: str) -> bool:
+    """Моно, частота для мовлення, обрізка тиші на початку та в кінці, стиснення в MP3."""
+    threshold = f"{Config.PREPROCESS_SILENCE_DB}dB"
+    trim = f"silenceremove=start_periods=1:start_threshold={threshold}"
+    audio_filter = (
+        f"aformat=sample_fmts=s16:channel_layouts=mono:sample_rates={Config.PREPROCESS_SAMPLE_RATE},"
+        f"{trim},areverse,{trim},areverse"
+    )
+    result = subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-i", src, "-af", audio_filter,
+         "-c:a", "libmp3lame", "-b:a", Config.PREPROCESS_BITRATE, dst],
+        capture_output=True, timeout=600
+    )
+    return result.returncode == 0 and os.path.exists(dst)
+
+
+def _process_wav(src: str, dst: str) -> bool:
+    """
+    Запасний варіант без ffmpeg (лише 16-бітний PCM WAV): зведення в моно,
+    передискретизація та обрізка тиші засобами numpy.
+    """
+    import numpy as np
+
+    with wave.open(src, "rb") as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        if width != 2:
+            return False
+        frames = w.readframes(w.getnframes())
+
+    data = np.frombuffer(frames, dtype="<i2").reshape(-1, channels).astype(np.float32).mean(axis=1)
+
+    # Передискретизація (з простим згладжуванням перед проріджуванням)
+    target_rate = Config.PREPROCESS_SAMPLE_RATE
+    if rate > target_rate and len(data):
+        window = int(round(rate / target_rate))
+        if window > 1:
+            data = np.convolve(data, np.ones(window) / window, mode="same")
+        new_len = int(len(data) * target_rate / rate)
+        data = np.interp(np.linspace(0, len(data) - 1, new_len), np.arange(len(data)), data)
+    else:
+        target_rate = rate
+
+    # Обрізка тиші на початку та в кінці
+    threshold = 32768 * 10 ** (Config.PREPROCESS_SILENCE_DB / 20)
+    loud = np.flatnonzero(np.abs(data) > threshold)
+    if loud.size:
+        data = data[loud[0]:loud[-1] + 1]
+
+    with wave.open(dst, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(target_rate)
+        w.writeframes(np.clip(data, -32768, 32767).astype("<i2").tobytes())
+    return True
+
+
+def probe_duration(path: str) -> float:
+    """Тривалість запису в секундах (ffprobe або заголовок WAV); None, якщо визначити неможливо."""
+    if shutil.which("ffprobe"):
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", path],
+            capture_output=True, text=True, timeout=60
+        )
+        try:
+            return float(result.stdout.strip())
+        except ValueError:
+            return None
+    if detect_format(path)[0] == ".wav":
+        try:
+            with wave.open(path, "rb") as w:
+                return w.getnframes() / float(w.getframerate())
+        except (wave.Error, EOFError):
+            return None
+    return None
+
+
+def split_audio(path: str, segment_seconds: float, overlap_seconds: float, duration: float) -> list:
+    """
+    Ділить запис на сегменти по segment_seconds з перекриттям overlap_seconds
+    (щоб слова на межі не губились). Повертає [(шлях, MIME-тип)] або [],
+    якщо поділ неможливий (немає ffmpeg і файл не WAV).
+    """
+    step = max(1.0, segment_seconds - overlap_seconds)
+    starts = []
+    start = 0.0
+    while start < duration:
+        starts.append(start)
+        if start + segment_seconds >= duration:
+            break
+        start += step
+
+    base = os.path.splitext(path)[0]
+    segments = []
+    try:
+        if shutil.which("ffmpeg"):
+            for i, start in enumerate(starts):
+                dst = f"{base}.seg{i:02d}.mp3"
+                result = subprocess.run(
+                    ["ffmpeg", "-y", "-v", "error", "-ss", f"{start:.2f}", "-t", f"{segment_seconds:.2f}",
+                     "-i", path, "-ac", "1", "-c:a", "libmp3lame", "-b:a", Config.PREPROCESS_BITRATE, dst],
+                    capture_output=True, timeout=600
+                )
+                if result.returncode != 0:
+                    raise RuntimeError(result.stderr.decode("utf-8", "replace").strip())
+                segments.append((dst, "audio/mp3"))
+        elif detect_format(path)[0] == ".wav":
+            with wave.open(path, "rb") as src:
+                params, rate = src.getparams(), src.getframerate()
+                for i, start in enumerate(starts):
+                    dst = f"{base}.seg{i:02d}.wav"
+                    src.setpos(int(start * rate))
+                    with wave.open(dst, "wb") as out:
+                        out.setparams(params)
+                        out.writeframes(src.readframes(int(segment_seconds * rate)))
+                    segments.append((dst, "audio/wav"))
+    except Exception:
+        for seg_path, _ in segments:
+            if os.path.exists(seg_path):
+                os.remove(seg_path)
+        raise
+    return segments
+
+
+def preprocess_audio(path: str) -> dict:
+    """
+    Стискає запис для аналізу мовлення. Виконується в окремому процесі.
+    Повертає {'path', 'mime_type', 'original_bytes', 'processed_bytes'}.
+    Якщо обробка неможлива або не зменшує файл — залишає оригінал.
+    """
+    ext, mime_type = detect_format(path)
+    original_bytes = os.path.getsize(path)
+    result = {'path': path, 'mime_type': mime_type,
+              'original_bytes': original_bytes, 'processed_bytes': original_bytes}
+
+    base = os.path.splitext(path)[0]
+    if shutil.which("ffmpeg"):
+        dst, dst_mime = f"{base}.prep.mp3", "audio/mp3"
+        ok = _process_with_ffmpeg(path, dst)
+    elif ext == ".wav":
+        dst, dst_mime = f"{base}.prep.wav", "audio/wav"
+        ok = _process_wav(path, dst)
+    else:
+        return result
+
+    if not ok or os.path.getsize(dst) >= original_bytes:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return result
+
+    os.remove(path)
+    result.update(path=dst, mime_type=dst_mime, processed_bytes=os.path.getsize(dst))
+    return result
+
+
+class AudioPreprocessor:
+    """
+    Необов'язковий етап між скачуванням і аналізом (PREPROCESS_AUDIO=1).
+    Обробка аудіо навантажує CPU, тому виконується в пулі процесів.
+    """
+
+    def __init__(self, workers: int = None):
+        self.pool = ProcessPoolExecutor(max_workers=workers or Config.PREPROCESS_WORKERS)
+        self.bytes_saved = 0
+        if not shutil.which("ffmpeg"):
+            logger.warning("⚠️ ffmpeg не знайдено: попередня обробка доступна лише для WAV.")
+
+    async def process(self, path: str) -> dict:
+        """Обробляє файл у пулі процесів; при помилці повертає оригінал."""
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self.pool, preprocess_audio, path)
+        except Exception as e:
+            logger.warning(f"⚠️ Попередня обробка {path} не вдалася: {e}")
+            _, mime_type = detect_format(path)
+            size = os.path.getsize(path)
+            return {'path': path, 'mime_type': mime_type, 'original_bytes': size, 'processed_bytes': size}
+
+        saved = result['original_bytes'] - result['processed_bytes']
+        self.bytes_saved += saved
+        if saved:
+            logger.info(f"🎚️  {os.path.basename(path)}: {result['original_bytes'] / 1e6:.1f} МБ -> "
+                        f"{result['processed_bytes'] / 1e6:.1f} МБ (зекономлено {saved / 1e6:.1f} МБ)")
+        return result
+
+    def close(self):
+        self.pool.shutdown(wait=True)
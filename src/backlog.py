@@ -0,0 +1,204 @@
+import os
+import json
+import asyncio
+from pydantic import ValidationError
+from src.config import Config
+from src.logger import logger
+from src.call_analysis import CallAnalysis
+from src.pipeline import apply_score_rules
+
+
+class GeminiBatchBackend:
+    """
+    Бекенд пакетних задач через Gemini Batch API.
+    Задачі обробляються асинхронно на стороні Google за зниженою ціною.
+    """
+
+    SUCCESS_STATES = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED'}
+    FAILED_STATES = {'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'}
+
+    def __init__(self, ai):
+        self.ai = ai
+
+    def submit(self, requests: list, display_name: str) -> str:
+        """Створює пакетну задачу з inline-запитів та повертає її назву."""
+        job = self.ai.limiter.call(
+            self.ai.client.batches.create,
+            model=self.ai.model_name,
+            src=requests,
+            config={'display_name': display_name},
+        )
+        return job.name
+
+    def poll(self, job_name: str) -> tuple:
+        """
+        Перевіряє стан задачі. Повертає (стан, відповіді або None).
+        Відповіді — список {'text': ..., 'error': ..., 'cost': ...} у порядку запитів
+        (cost — оцінена вартість запиту з урахуванням знижки Batch API).
+        """
+        job = self.ai.limiter.call(self.ai.client.batches.get, name=job_name)
+        state = job.state.name if job.state else 'JOB_STATE_UNSPECIFIED'
+
+        if state not in self.SUCCESS_STATES:
+            return state, None
+
+        responses = []
+        for item in job.dest.inlined_responses or []:
+            if item.error:
+                responses.append({'text': None, 'error': str(item.error), 'cost': 0.0})
+            else:
+                cost = self.ai.record_usage(getattr(item.response, 'usage_metadata', None), batch=True)
+                responses.append({'text': item.response.text, 'error': None, 'cost': cost})
+        return state, responses
+
+
+class LocalBatchBackend:
+    """
+    Локальна заміна Batch API для розробки та перевірок без Google.
+    handler(request) -> текст відповіді моделі; задача "виконується" при першому опитуванні.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self._jobs = {}
+
+    def submit(self, requests: list, display_name: str) -> str:
+        job_name = f"local/{display_name}/{len(self._jobs)}"
+        self._jobs[job_name] = requests
+        return job_name
+
+    def poll(self, job_name: str) -> tuple:
+        responses = []
+        for request in self._jobs.pop(job_name):
+            try:
+                responses.append({'text': self.handler(request), 'error': None, 'cost': 0.0})
+            except Exception as e:
+                responses.append({'text': None, 'error': str(e), 'cost': 0.0})
+        return 'JOB_STATE_SUCCEEDED', responses
+
+
+class BacklogProcessor:
+    """
+    Обробка великого архіву дзвінків через пакетні задачі Gemini.
+    Файли скачуються й завантажуються в Gemini, відправляються однією задачею
+    на BACKLOG_BATCH_SIZE записів, а готові результати записуються тими самими
+    SheetsService та Database, що й у звичайному режимі.
+    """
+
+    def __init__(self, drive, ai, sheets, db, cache=None, backend=None, preprocessor=None):
+        self.drive = drive
+        self.ai = ai
+        self.sheets = sheets
+        self.db = db
+        self.cache = cache
+        self.preprocessor = preprocessor
+        self.backend = backend or GeminiBatchBackend(ai)
+        # ID файлів, обробка яких завершилась помилкою (для лічильника спроб у JobQueue.lease)
+        self.failed = set()
+
+    async def run(self, files: list):
+        """Обробляє список файлів пачками по BACKLOG_BATCH_SIZE."""
+        batch_size = Config.BACKLOG_BATCH_SIZE
+        for start in range(0, len(files), batch_size):
+            chunk = files[start:start + batch_size]
+            logger.info(f"📦 Пачка {start // batch_size + 1}: {len(chunk)} файлів")
+            await self._run_batch(chunk, display_name=f"call-analyzer-{start // batch_size + 1}")
+
+    async def _run_batch(self, files: list, display_name: str):
+        # 1. Підготовка: результати з кешу або завантаження аудіо в Gemini
+        semaphore = asyncio.Semaphore(Config.DOWNLOAD_WORKERS)
+        prepared = await asyncio.gather(*(self._prepare(f, semaphore) for f in files))
+
+        records = []
+        submitted = []
+        for file_info, cached, file_ref in prepared:
+            if cached is not None:
+                await self._report(file_info, cached, records)
+            elif file_ref is not None:
+                submitted.append((file_info, file_ref))
+
+        # 2. Відправка пакетної задачі та очікування результату
+        if submitted:
+            requests = [self.ai.build_batch_request(file_ref) for _, file_ref in submitted]
+            job_name = await asyncio.to_thread(self.backend.submit, requests, display_name)
+            logger.info(f"🚀 Створено пакетну задачу {job_name} ({len(requests)} запитів)")
+
+            responses = await self._wait(job_name)
+            if responses is None:
+                self.failed.update(file_info['id'] for file_info, _ in submitted)
+
+            # Аудіо в Gemini більше не потрібне — прибираємо у фоні
+            for _, file_ref in submitted:
+                self.ai.discard_remote_file(file_ref)
+
+            # 3. Розбір відповідей та запис результатів
+            for (file_info, _), response in zip(submitted, responses or []):
+                result = self._parse(file_info, response)
+                if result is None:
+                    continue
+                # Вартість зі знижкою Batch API потрапляє в звіт --report model окремим маршрутом
+                result.ai_batch = True
+                result.ai_cost_usd = response['cost']
+                if self.cache is not None:
+                    await self.cache.put(file_info.get('md5Checksum'), result)
+                await self._report(file_info, apply_score_rules(result), records)
+
+        await self.db.add_files(records)
+        logger.info(f"✅ Пачку оброблено: {len(records)} з {len(files)} файлів")
+
+    async def _prepare(self, file_info: dict, semaphore: asyncio.Semaphore) -> tuple:
+        """Повертає (file_info, результат з кешу або None, посилання на файл у Gemini або None)."""
+        if self.cache is not None:
+            cached = await self.cache.get(file_info.get('md5Checksum'))
+            if cached is not None:
+                return file_info, apply_score_rules(cached), None
+
+        local_path = None
+        async with semaphore:
+            try:
+                local_path = await asyncio.to_thread(
+                    self.drive.download_file, file_info['id'], file_info['name'],
+                    file_info.get('md5Checksum'))
+                mime_type = None
+                if self.preprocessor is not None:
+                    prepared = await self.preprocessor.process(local_path)
+                    local_path, mime_type = prepared['path'], prepared['mime_type']
+                file_ref = await asyncio.to_thread(self.ai.upload_audio, local_path, mime_type)
+                return file_info, None, file_ref
+            except Exception as e:
+                logger.error(f"❌ Помилка підготовки {file_info['name']}: {e}")
+                self.failed.add(file_info['id'])
+                return file_info, None, None
+            finally:
+                if local_path and os.path.exists(local_path):
+                    os.remove(local_path)
+
+    async def _wait(self, job_name: str) -> list:
+        """Опитує пакетну задачу до завершення. Повертає відповіді або None при збої."""
+        while True:
+            state, responses = await asyncio.to_thread(self.backend.poll, job_name)
+            if responses is not None:
+                return responses
+            if state in GeminiBatchBackend.FAILED_STATES:
+                logger.error(f"❌ Пакетна задача {job_name} завершилась зі станом {state}")
+                return None
+            logger.info(f"⏳ Задача {job_name}: {state}. Наступна перевірка через {Config.BACKLOG_POLL_INTERVAL:.0f} с")
+            await asyncio.sleep(Config.BACKLOG_POLL_INTERVAL)
+
+    def _parse(self, file_info: dict, response: dict) -> CallAnalysis:
+        """Розбирає відповідь моделі; при помилці файл лишається необробленим для наступного запуску."""
+        if response['error'] or not response['text']:
+            logger.error(f"❌ {file_info['name']}: помилка в пакетній задачі: {response['error']}")
+            self.failed.add(file_info['id'])
+            return None
+        try:
+            return self.ai.parse_response(response['text'])
+        except (json.JSONDecodeError, ValidationError) as e:
+            logger.error(f"❌ {file_info['name']}: відповідь не відповідає схемі: {e}")
+            self.failed.add(file_info['id'])
+            return None
+
+    async def _report(self, file_info: dict, result: CallAnalysis, records: list):
+        """Додає запис для бази разом із рядком для черги таблиці (outbox)."""
+        records.append((file_info, result, self.sheets.build_entry(file_info['name'], result, file_id=file_info['id'])))
+        logger.info(f"   ✅ {file_info['name']}. Оцінка: {result.manager_score}")
@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import math
+from typing import Optional
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+from src.config import Config
+
+
+KPI_FIELDS = ("kpi_greeting", "kpi_body", "kpi_year", "kpi_mileage",
+              "kpi_upsell", "kpi_history", "kpi_closing")
+
+RESULT_VALUES = ("Записався", "Думає", "Відмова")
+
+_TRUE_WORDS = {"1", "true", "yes", "так", "+"}
+
+# Службові поля результату, яких немає у відповіді моделі
+META_FIELDS = ("raw_response", "ai_model", "prompt_version", "ai_cost_usd", "ai_latency", "escalation", "ai_batch")
+
+
+def _strip_fences(text: str) -> str:
+    """Прибирає Markdown-обгортку (```json ... ```) навколо JSON-відповіді."""
+    if text.startswith("```json"):
+        text = text[7:-3]
+    elif text.startswith("```"):
+        text = text[3:-3]
+    return text.strip()
+
+
+def parse_call_name(file_name: str) -> dict:
+    """
+    Дістає телефон, філію та менеджера з назви файлу запису за шаблоном
+    CALL_NAME_PATTERN (іменовані групи phone, branch, manager).
+    Невідомі значення повертаються як "-".
+    """
+    info = {"phone": "-", "branch": "-", "manager": "-"}
+    if Config.CALL_NAME_PATTERN:
+        match = re.search(Config.CALL_NAME_PATTERN, os.path.splitext(file_name)[0])
+        if match:
+            info.update({k: v for k, v in match.groupdict().items() if k in info and v})
+    return info
+
+
+class CallAnalysis(BaseModel):
+    """
+    Типізований результат аналізу дзвінка.
+    Відповідь моделі декодується й перевіряється одразу (pydantic-core),
+    значення приводяться до потрібних типів: KPI — 0/1, оцінка — ціле 1..10.
+    Зайві ключі відкидаються, відсутні необов'язкові — беруть типові значення.
+    """
+
+    model_config = ConfigDict(extra="ignore", str_strip_whitespace=True)
+
+    transcription: str = ""
+    service_type: str = "-"
+    manager_score: int
+    result: str = "-"
+    is_critical_fail: bool = False
+    critical_comment: str = ""
+
+    kpi_greeting: int = 0
+    kpi_body: int = 0
+    kpi_year: int = 0
+    kpi_mileage: int = 0
+    kpi_upsell: int = 0
+    kpi_history: int = 0
+    kpi_closing: int = 0
+
+    # Сира відповідь моделі, модель і версія промпту: зберігаються в базі,
+    # щоб --replay міг застосувати нові правила без повторного аналізу
+    raw_response: Optional[str] = None
+    ai_model: str = ""
+    prompt_version: str = ""
+    # Оцінена вартість запитів ($), тривалість аналізу (с) і причина повтору сильнішою моделлю
+    ai_cost_usd: float = 0.0
+    ai_latency: float = 0.0
+    escalation: str = ""
+    # Проаналізовано пакетною задачею (--backlog): вартість зі знижкою Batch API, тривалості немає
+    ai_batch: bool = False
+
+    @field_validator("manager_score", mode="before")
+    @classmethod
+    def _clamp_score(cls, value):
+        """
+        Оцінка як ціле число в межах 1..10 ("7/10", 7.6, "8" теж приймаються).
+        Відсутня (null) чи нечислова оцінка — ValueError, який pydantic перетворює на ValidationError.
+        """
+        if isinstance(value, str):
+            match = re.search(r"-?\d+(?:[.,]\d+)?", value)
+            if not match:
+                raise ValueError(f"оцінка не є числом: {value!r}")
+            value = float(match.group(0).replace(",", "."))
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"оцінка не є числом: {value!r}")
+        return min(10, max(1, int(round(value))))
+
+    @field_validator(*KPI_FIELDS, mode="before")
+    @classmethod
+    def _kpi_flag(cls, value):
+        """KPI як 0/1 (модель іноді повертає true/"так"/"1")."""
+        if isinstance(value, str):
+            return int(value.strip().lower() in _TRUE_WORDS)
+        return int(bool(value))
+
+    @field_validator("is_critical_fail", mode="before")
+    @classmethod
+    def _critical_flag(cls, value):
+        if isinstance(value, str):
+            return value.strip().lower() in _TRUE_WORDS
+        return bool(value)
+
+    @field_validator("transcription", "service_type", "result", "critical_comment", mode="before")
+    @classmethod
+    def _text(cls, value):
+        return "" if value is None else str(value)
+
+    @classmethod
+    def from_json(cls, text: str) -> "CallAnalysis":
+        """Швидкий розбір JSON-відповіді моделі. Кидає pydantic.ValidationError."""
+        return cls.model_validate_json(text)
+
+    @classmethod
+    def parse(cls, text: str) -> "CallAnalysis":
+        """
+        Розбір відповіді моделі: спершу строго за схемою, інакше — після очищення
+        Markdown-обгортки (і першого елемента, якщо модель повернула список).
+        Кидає json.JSONDecodeError або pydantic.ValidationError, якщо відповідь некоректна.
+        """
+        try:
+            return cls.from_json(text)
+        except ValidationError:
+            pass
+
+        # strict=False дозволяє коректно обробляти спецсимволи (наприклад, переноси рядків)
+        data = json.loads(_strip_fences(text), strict=False)
+        if isinstance(data, list):
+            if not data:
+                return cls.error("AI повернув порожній список")
+            data = data[0]
+        return cls.from_dict(data)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CallAnalysis":
+        """
+        Результат зі словника (кеш, старі записи). Заглушки помилок не валідуються.
+        Не словник (рядок, число, null у JSON) — pydantic.ValidationError.
+        """
+        if isinstance(data, dict) and data.get("service_type") == "Error":
+            return cls.model_construct(**{**cls.error("").to_dict(), **data})
+        return cls.model_validate(data)
+
+    @classmethod
+    def error(cls, msg: str) -> "CallAnalysis":
+        """Заглушка результату у разі помилки (оцінка 0 — поза межами звичайних оцінок)."""
+        return cls.model_construct(
+            transcription=f"Error: {msg}", service_type="Error",
+            manager_score=0, result="Error", is_critical_fail=True, critical_comment="System Error",
+            **{name: 0 for name in KPI_FIELDS}
+        )
+
+    @property
+    def is_error(self) -> bool:
+        return self.service_type == "Error"
+
+    def to_dict(self, meta: bool = False) -> dict:
+        """Поля результату; meta=True — разом зі службовими (сира відповідь, модель, версія промпту)."""
+        return self.model_dump(exclude=None if meta else set(META_FIELDS))
+
+    @staticmethod
+    def response_schema(with_transcription: bool = True) -> dict:
+        """
+        Схема відповіді для Gemini (response_schema): модель генерує лише
+        коректний JSON з потрібними ключами, типами та допустимими значеннями.
+        with_transcription=False — для оцінки вже готового тексту (без його повторення).
+        """
+        kpi = {"type": "INTEGER", "minimum": 0, "maximum": 1}
+        properties = {
+            "transcription": {"type": "STRING"},
+            "service_type": {"type": "STRING", "enum": list(Config.SERVICES_LIST)},
+            "manager_score": {"type": "INTEGER", "minimum": 1, "maximum": 10},
+            "result": {"type": "STRING", "enum": list(RESULT_VALUES)},
+            "is_critical_fail": {"type": "BOOLEAN"},
+            "critical_comment": {"type": "STRING"},
+            **{name: dict(kpi) for name in KPI_FIELDS},
+        }
+        if not with_transcription:
+            del properties["transcription"]
+        return {
+            "type": "OBJECT",
+            "properties": properties,
+            "required": list(properties),
+            "property_ordering": list(properties),
+        }
@@ -18,9 +18,152 @@ class Config:
     SOURCE_FOLDER_ID = os.getenv("SOURCE_FOLDER_ID")
     WORK_FOLDER_ID = os.getenv("WORK_FOLDER_ID")
     SHEET_ID = os.getenv("SHEET_ID")
+    # Аркуш для результатів (напр. окремий аркуш на кожен місяць)
+    SHEET_NAME = os.getenv("SHEET_NAME", "Test_Run")
+
+    # --- РОЗПОДІЛ РОБОТИ МІЖ ЕКЗЕМПЛЯРАМИ (таблиця jobs) ---
+    # Екземпляри ділять один файл DB_PATH, тому мають працювати на одному хості
+    # (база в режимі WAL не підтримує мережеві диски NFS/SMB)
+    WORKER_ID = os.getenv("WORKER_ID")
+    JOB_CLAIM_BATCH = int(os.getenv("JOB_CLAIM_BATCH", "50"))
+    JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    # Пауза перед повтором задачі після помилки (подвоюється з кожною спробою)
+    JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "60"))
+
+    # --- ПЛАНУВАННЯ ЧЕРГИ ---
+    # Порядок обробки: fifo — як знайдено, newest — спершу свіжі дзвінки, sjf — спершу короткі записи
+    SCHEDULE_POLICY = os.getenv("SCHEDULE_POLICY", "newest")
+    # Чергувати задачі різних філій (філія — з назви файлу за CALL_NAME_PATTERN)
+    SCHEDULE_FAIR_SHARE = os.getenv("SCHEDULE_FAIR_SHARE", "0") == "1"
+    # Старіння: "вартість" задачі ділиться на (1 + очікування / SCHEDULE_AGING_SECONDS)
+    SCHEDULE_AGING_SECONDS = float(os.getenv("SCHEDULE_AGING_SECONDS", "900"))
+    # Задачі, що чекають довше (секунди), обробляються першими за будь-якої політики
+    SCHEDULE_MAX_WAIT = float(os.getenv("SCHEDULE_MAX_WAIT", "14400"))
+    # Оцінка тривалості за розміром, якщо Drive її не надав (16000 Б/с ≈ MP3 128 кбіт/с)
+    SCHEDULE_BYTES_PER_SECOND = float(os.getenv("SCHEDULE_BYTES_PER_SECOND", "16000"))
+
+    # --- ПОШУК НОВИХ ФАЙЛІВ ---
+    # "changes" — інкрементально через стрічку змін Drive, "full" — повне сканування папки
+    DISCOVERY_MODE = os.getenv("DISCOVERY_MODE", "changes")
+
+    # --- РЕЖИМ СЛУЖБИ (--daemon) ---
+    POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "15"))
+    POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "300"))
 
     # --- ЛОКАЛЬНІ НАЛАШТУВАННЯ ---
     TEMP_FOLDER = "temp_audio"
+    DB_PATH = os.getenv("DB_PATH", "bot_db.db")
+
+    # --- ЛОГУВАННЯ ---
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+    # Ротація: "size" — за розміром (LOG_MAX_BYTES), "time" — за часом (LOG_ROTATE_WHEN, напр. midnight)
+    LOG_ROTATE = os.getenv("LOG_ROTATE", "size")
+    LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+    LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+    LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "10"))
+    LOG_COMPRESS = os.getenv("LOG_COMPRESS", "1") == "1"
+    # Структурований лог (JSON на рядок з file_id, stage, duration_ms) для аналізу затримок
+    LOG_JSON = os.getenv("LOG_JSON", "0") == "1"
+    LOG_JSON_FILE = os.getenv("LOG_JSON_FILE", "bot.jsonl")
+
+    # --- ПОТОКОВЕ ЗАВАНТАЖЕННЯ З DRIVE ---
+    DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+    DOWNLOAD_MAX_RETRIES = int(os.getenv("DOWNLOAD_MAX_RETRIES", "5"))
+
+    # --- НАЛАШТУВАННЯ КОНВЕЄРА ОБРОБКИ (PIPELINE) ---
+    # Кількість паралельних воркерів для кожного етапу та розмір черг між ними
+    DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))
+    ANALYZE_WORKERS = int(os.getenv("ANALYZE_WORKERS", "2"))
+    REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "1"))
+    QUEUE_SIZE = int(os.getenv("QUEUE_SIZE", "8"))
+
+    # --- ПОПЕРЕДНЯ ОБРОБКА АУДІО (моно, частота мовлення, обрізка тиші) ---
+    PREPROCESS_AUDIO = os.getenv("PREPROCESS_AUDIO", "0") == "1"
+    PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "2"))
+    PREPROCESS_SAMPLE_RATE = int(os.getenv("PREPROCESS_SAMPLE_RATE", "16000"))
+    PREPROCESS_SILENCE_DB = float(os.getenv("PREPROCESS_SILENCE_DB", "-50"))
+    PREPROCESS_BITRATE = os.getenv("PREPROCESS_BITRATE", "32k")
+
+    # --- СЕГМЕНТАЦІЯ ДОВГИХ ЗАПИСІВ (паралельна транскрибація + одна оцінка) ---
+    SEGMENT_LONG_CALLS = os.getenv("SEGMENT_LONG_CALLS", "1") == "1"
+    # Ділити записи, довші за N секунд або більші за N байт
+    SEGMENT_MIN_DURATION = float(os.getenv("SEGMENT_MIN_DURATION", "900"))
+    SEGMENT_MAX_BYTES = int(os.getenv("SEGMENT_MAX_BYTES", str(40 * 1024 * 1024)))
+    # Тривалість сегмента та перекриття між сусідніми сегментами (секунди)
+    SEGMENT_SECONDS = float(os.getenv("SEGMENT_SECONDS", "480"))
+    SEGMENT_OVERLAP = float(os.getenv("SEGMENT_OVERLAP", "10"))
+    SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", "4"))
+
+    # --- КЕШ РЕЗУЛЬТАТІВ АНАЛІЗУ (за вмістом файлу) ---
+    ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "1") == "1"
+    ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "50000"))
+    ANALYSIS_CACHE_MAX_AGE_DAYS = int(os.getenv("ANALYSIS_CACHE_MAX_AGE_DAYS", "180"))
+
+    # --- ЛІМІТИ ЗАПИТІВ ДО API (запитів на хвилину, спільні для всіх воркерів) ---
+    GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+    DRIVE_RPM = float(os.getenv("DRIVE_RPM", "600"))
+    SHEETS_RPM = float(os.getenv("SHEETS_RPM", "60"))
+    RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "6"))
+
+    # --- МОДЕЛІ GEMINI ТА МАРШРУТИЗАЦІЯ ---
+    GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+    # Дешевша модель для коротких дзвінків; порожнє значення — усі дзвінки аналізує GEMINI_MODEL
+    GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-2.0-flash-lite")
+    # Записи до N секунд спершу аналізує GEMINI_FAST_MODEL
+    ROUTE_FAST_MAX_SECONDS = float(os.getenv("ROUTE_FAST_MAX_SECONDS", "180"))
+    # Повтор сильнішою моделлю: оцінка в межах ±N від порогу CRITICAL_CLEAR_SCORE,
+    # критична помилка або транскрибація коротша за N символів
+    ROUTE_BORDERLINE_MARGIN = int(os.getenv("ROUTE_BORDERLINE_MARGIN", "1"))
+    ROUTE_MIN_TRANSCRIPT_CHARS = int(os.getenv("ROUTE_MIN_TRANSCRIPT_CHARS", "40"))
+
+    # --- КЕШУВАННЯ КОНТЕКСТУ GEMINI (статичні інструкції та каталог послуг) ---
+    GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+    GEMINI_CONTEXT_TTL = int(os.getenv("GEMINI_CONTEXT_TTL", "3600"))
+
+    # --- Метрики та облік вартості ---
+    # Порт локального ендпоінту /metrics (формат Prometheus); 0 — вимкнено
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    # Ціни Gemini, $ за 1 млн токенів (для оцінки вартості в метриках)
+    GEMINI_PRICE_INPUT_PER_M = float(os.getenv("GEMINI_PRICE_INPUT_PER_M", "0.10"))
+    GEMINI_PRICE_AUDIO_INPUT_PER_M = float(os.getenv("GEMINI_PRICE_AUDIO_INPUT_PER_M", "0.70"))
+    GEMINI_PRICE_CACHED_PER_M = float(os.getenv("GEMINI_PRICE_CACHED_PER_M", "0.025"))
+    GEMINI_PRICE_OUTPUT_PER_M = float(os.getenv("GEMINI_PRICE_OUTPUT_PER_M", "0.40"))
+    # Ціни GEMINI_FAST_MODEL
+    GEMINI_FAST_PRICE_INPUT_PER_M = float(os.getenv("GEMINI_FAST_PRICE_INPUT_PER_M", "0.075"))
+    GEMINI_FAST_PRICE_AUDIO_INPUT_PER_M = float(os.getenv("GEMINI_FAST_PRICE_AUDIO_INPUT_PER_M", "0.075"))
+    GEMINI_FAST_PRICE_CACHED_PER_M = float(os.getenv("GEMINI_FAST_PRICE_CACHED_PER_M", "0.01875"))
+    GEMINI_FAST_PRICE_OUTPUT_PER_M = float(os.getenv("GEMINI_FAST_PRICE_OUTPUT_PER_M", "0.30"))
+    # Множник вартості для Batch API (знижка 50%)
+    GEMINI_BATCH_DISCOUNT = float(os.getenv("GEMINI_BATCH_DISCOUNT", "0.5"))
+
+    # --- РЕЖИМ АРХІВУ (--backlog, Gemini Batch API) ---
+    BACKLOG_BATCH_SIZE = int(os.getenv("BACKLOG_BATCH_SIZE", "500"))
+    BACKLOG_POLL_INTERVAL = float(os.getenv("BACKLOG_POLL_INTERVAL", "60"))
+
+    # --- ПАКЕТНИЙ ЗАПИС У GOOGLE SHEETS ---
+    # Рядки з черги (outbox) відправляються, коли набирається N рядків або минає N секунд
+    SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "20"))
+    SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", "10"))
+    # Оренда пачки відправником (після падіння процесу рядки знову стануть доступні)
+    SHEETS_OUTBOX_LEASE = float(os.getenv("SHEETS_OUTBOX_LEASE", "120"))
+    # Скільки секунд при завершенні намагатися відправити залишок черги
+    SHEETS_DRAIN_TIMEOUT = float(os.getenv("SHEETS_DRAIN_TIMEOUT", "60"))
+    # Розмір тіла одного запиту values().update при перебудові аркуша (--rebuild-sheet), байт;
+    # Google радить не більше ~2 МБ на запит, а довжина рядків залежить від коментарів
+    SHEETS_REBUILD_MAX_BYTES = int(os.getenv("SHEETS_REBUILD_MAX_BYTES", "2000000"))
+
+    # --- ПРАВИЛА КОРЕКЦІЇ ОЦІНКИ (застосовуються і при повторному прогоні --replay) ---
+    # Оцінка, вища за цей поріг, знімає критичну помилку
+    CRITICAL_CLEAR_SCORE = int(os.getenv("CRITICAL_CLEAR_SCORE", "6"))
+    # Оцінка, не вища за цей поріг, підсвічується в таблиці червоним
+    LOW_SCORE_THRESHOLD = int(os.getenv("LOW_SCORE_THRESHOLD", "6"))
+
+    # --- ЛОКАЛЬНА АНАЛІТИКА (--report) ---
+    # Регулярний вираз для назви файлу з групами phone, branch, manager,
+    # напр. "^(?P<branch>[^_]+)_(?P<manager>[^_]+)_(?P<phone>\+?\d+)"
+    CALL_NAME_PATTERN = os.getenv("CALL_NAME_PATTERN", "")
 
     # --- БІЗНЕС-ЛОГІКА (СПИСОК ПОСЛУГ) ---
     SERVICES_LIST = [
@@ -0,0 +1,45 @@
+import threading
+from src.config import Config
+
+
+# Одні облікові дані на обидва API: файл ключа читається один раз,
+# а токен доступу оновлюється один раз для Drive і Sheets разом
+SCOPES = [
+    'https://www.googleapis.com/auth/drive',
+    'https://www.googleapis.com/auth/spreadsheets',
+]
+
+_credentials = None
+_services = {}
+_lock = threading.Lock()
+
+
+def get_credentials():
+    """
+    Повертає спільні облікові дані Service Account.
+    Токен не оновлюється заздалегідь: google-auth зробить це під час першого запиту.
+    """
+    global _credentials
+    with _lock:
+        if _credentials is None:
+            from google.oauth2 import service_account
+            _credentials = service_account.Credentials.from_service_account_file(
+                Config.GOOGLE_CREDENTIALS_FILE, scopes=SCOPES
+            )
+        return _credentials
+
+
+def build_service(name: str, version: str):
+    """
+    Повертає клієнт Google API, створений один раз на процес.
+    Документ discovery береться з бібліотеки (static_discovery), без запиту в мережу.
+    """
+    with _lock:
+        service = _services.get((name, version))
+    if service is None:
+        from googleapiclient.discovery import build
+        service = build(name, version, credentials=get_credentials(),
+                        static_discovery=True, cache_discovery=False)
+        with _lock:
+            service = _services.setdefault((name, version), service)
+    return service
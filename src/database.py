@@ -1,43 +1,895 @@
+import json
+import time
+import asyncio
 import aiosqlite
-import os
-from datetime import datetime
+from datetime import datetime, timedelta
+from src.config import Config
+from src.metrics import timed
+from src.call_analysis import KPI_FIELDS, parse_call_name
+from src.transcript_search import compress_text, decompress_text
 
 
 class Database:
     """
     Асинхронний менеджер бази даних SQLite.
     Відповідає за зберігання історії оброблених файлів.
+    Тримає одне довготривале з'єднання в режимі WAL замість відкриття нового на кожен запит.
+    WAL працює через спільну пам'ять (файл -shm), тож кілька екземплярів можуть ділити
+    базу лише на одному хості: на NFS/SMB оренда задач не атомарна, а база може зіпсуватись.
     """
 
-    def __init__(self, db_name="bot_db.db"):
-        self.db_name = db_name
+    # Тижні, з яких видалено результати: Analytics перераховує їх підсумки (ключ у bot_state)
+    DIRTY_WEEKS_KEY = "analytics_dirty_weeks"
+
+    # Налаштування SQLite: WAL дозволяє читати під час запису,
+    # synchronous=NORMAL безпечний для WAL і не робить fsync на кожен commit
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-16000",
+        "PRAGMA busy_timeout=5000",
+    )
+
+    def __init__(self, db_name: str = None):
+        self.db_name = db_name or Config.DB_PATH
+        self.conn = None
+        self._write_lock = asyncio.Lock()
 
     async def init(self):
-        """Створює таблицю, якщо вона ще не існує."""
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS processed_files (
-                    file_id TEXT PRIMARY KEY,
-                    file_name TEXT,
-                    manager_score INTEGER,
-                    processed_at TIMESTAMP
-                )
-            """)
-            await db.commit()
+        """Відкриває з'єднання, застосовує PRAGMA та створює таблиці, якщо їх ще немає."""
+        self.conn = await aiosqlite.connect(self.db_name)
+        for pragma in self.PRAGMAS:
+            await self.conn.execute(pragma)
 
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed_files (
+                file_id TEXT PRIMARY KEY,
+                file_name TEXT,
+                manager_score INTEGER,
+                processed_at TIMESTAMP
+            )
+        """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS bot_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                cache_key TEXT PRIMARY KEY,
+                result TEXT,
+                created_at TIMESTAMP,
+                last_used_at TIMESTAMP
+            )
+        """)
+        await self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_analysis_cache_used ON analysis_cache (last_used_at)"
+        )
+        # Черга задач для кількох екземплярів бота (оренда з терміном дії)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                file_id TEXT PRIMARY KEY,
+                payload TEXT,
+                status TEXT DEFAULT 'pending',
+                worker_id TEXT,
+                lease_expires_at REAL,
+                attempts INTEGER DEFAULT 0,
+                created_at TIMESTAMP,
+                enqueued_at REAL,
+                call_created_at REAL,
+                duration REAL,
+                branch TEXT,
+                available_at REAL
+            )
+        """)
+        # Поля для планувальника черги та паузи після збою (бази, створені до їх появи, доповнюються)
+        await self._add_missing_columns("jobs", {
+            "enqueued_at": "REAL", "call_created_at": "REAL", "duration": "REAL", "branch": "TEXT",
+            "available_at": "REAL",
+        })
+        await self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, lease_expires_at)"
+        )
+        # Повні результати аналізу для локальної аналітики.
+        # seq зростає з кожним записом і служить водяним знаком для інкрементальних підсумків.
+        kpi_columns = ", ".join(f"{name} INTEGER" for name in KPI_FIELDS)
+        await self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS call_results (
+                file_id TEXT PRIMARY KEY,
+                file_name TEXT,
+                call_date TEXT,
+                week TEXT,
+                branch TEXT,
+                manager TEXT,
+                phone TEXT,
+                service_type TEXT,
+                result TEXT,
+                manager_score INTEGER,
+                is_critical_fail INTEGER,
+                {kpi_columns},
+                seq INTEGER
+            )
+        """)
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_call_results_seq ON call_results (seq)")
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_call_results_week ON call_results (week)")
+        # Матеріалізовані підсумки: тиждень x філія x менеджер x тип послуги
+        score_columns = ", ".join(f"score_{i} INTEGER" for i in range(1, 11))
+        kpi_sums = ", ".join(f"{name} INTEGER" for name in KPI_FIELDS)
+        await self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS call_rollups (
+                week TEXT,
+                branch TEXT,
+                manager TEXT,
+                service_type TEXT,
+                calls INTEGER,
+                score_sum INTEGER,
+                critical_fails INTEGER,
+                {kpi_sums},
+                {score_columns},
+                PRIMARY KEY (week, branch, manager, service_type)
+            )
+        """)
+        # Повні транскрибації (стиснуті) та повнотекстовий індекс без копії тексту
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS call_transcripts (
+                id INTEGER PRIMARY KEY,
+                file_id TEXT UNIQUE,
+                transcript BLOB
+            )
+        """)
+        await self.conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(
+                transcript, content='', tokenize='unicode61 remove_diacritics 0'
+            )
+        """)
+        # Сирі відповіді моделі з моделлю та версією промпту: --replay застосовує до них
+        # поточні правила корекції без повторного аналізу аудіо
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS call_raw_outputs (
+                file_id TEXT PRIMARY KEY,
+                file_info TEXT,
+                raw_response BLOB,
+                ai_model TEXT,
+                prompt_version TEXT,
+                stored_at REAL,
+                ai_cost_usd REAL,
+                ai_latency REAL,
+                escalation TEXT,
+                ai_batch INTEGER
+            )
+        """)
+        # Модель, вартість і тривалість аналізу кожного файлу (звіт --report model)
+        await self._add_missing_columns("call_raw_outputs", {
+            "ai_cost_usd": "REAL", "ai_latency": "REAL", "escalation": "TEXT", "ai_batch": "INTEGER",
+        })
+        # Черга рядків для Google Sheets (outbox): рядок потрапляє сюди в тій самій
+        # транзакції, що й позначка "оброблено", і видаляється лише після запису в таблицю.
+        # available_at — час, з якого рядок можна брати (оренда відправника або пауза після збою).
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS sheets_outbox (
+                id INTEGER PRIMARY KEY,
+                file_id TEXT,
+                entry TEXT,
+                attempts INTEGER DEFAULT 0,
+                available_at REAL,
+                created_at REAL
+            )
+        """)
+        await self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sheets_outbox_available ON sheets_outbox (available_at)"
+        )
+        # Один рядок у черзі на файл: повторний запис тієї ж пачки (напр. після скасування
+        # посеред коміту) замінює рядок, а не ставить його вдруге. Старі дублікати прибираються.
+        cursor = await self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_sheets_outbox_file'"
+        )
+        if await cursor.fetchone() is None:
+            await self.conn.execute(
+                "DELETE FROM sheets_outbox WHERE id NOT IN (SELECT MAX(id) FROM sheets_outbox GROUP BY file_id)"
+            )
+            await self.conn.execute("CREATE UNIQUE INDEX idx_sheets_outbox_file ON sheets_outbox (file_id)")
+        await self.conn.commit()
+
+    async def _add_missing_columns(self, table: str, columns: dict):
+        """Додає до існуючої таблиці колонки, яких у ній ще немає."""
+        cursor = await self.conn.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in await cursor.fetchall()}
+        for name, column_type in columns.items():
+            if name not in existing:
+                await self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+    async def close(self):
+        """Закриває з'єднання з базою."""
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
+
+    @timed("db_file_exists")
     async def file_exists(self, file_id: str) -> bool:
         """Перевіряє, чи файл вже був оброблений."""
-        async with aiosqlite.connect(self.db_name) as db:
-            cursor = await db.execute(
-                "SELECT 1 FROM processed_files WHERE file_id = ?", (file_id,)
-            )
-            return await cursor.fetchone() is not None
+        cursor = await self.conn.execute(
+            "SELECT 1 FROM processed_files WHERE file_id = ?", (file_id,)
+        )
+        return await cursor.fetchone() is not None
+
+    @timed("db_filter_unprocessed")
+    async def filter_unprocessed(self, file_ids: list) -> set:
+        """
+        Повертає ті ID зі списку, яких ще немає в базі — одним запитом.
+        Список передається як JSON-масив, тому ліміт кількості параметрів SQLite не заважає.
+        """
+        cursor = await self.conn.execute(
+            """
+            SELECT ids.value FROM json_each(?) AS ids
+            WHERE NOT EXISTS (SELECT 1 FROM processed_files p WHERE p.file_id = ids.value)
+            """,
+            (json.dumps(list(file_ids)),)
+        )
+        return {row[0] for row in await cursor.fetchall()}
 
-    async def add_file(self, file_id: str, file_name: str, score: int):
+    async def add_file(self, file_info: dict, result, sheet_entry: list = None):
         """Записує успішно оброблений файл у базу."""
-        async with aiosqlite.connect(self.db_name) as db:
-            await db.execute(
-                "INSERT OR REPLACE INTO processed_files (file_id, file_name, manager_score, processed_at) VALUES (?, ?, ?, ?)",
-                (file_id, file_name, score, datetime.now())
+        await self.add_files([(file_info, result, sheet_entry)])
+
+    @timed("db_add_files")
+    async def add_files(self, records: list):
+        """
+        Записує пачку оброблених файлів в одній транзакції.
+        records — список кортежів (file_info, CallAnalysis, запис для таблиці або None).
+        Повні результати (крім заглушок помилок) зберігаються для аналітики,
+        а рядки для таблиці — в outbox, звідки їх забирає SheetsOutbox.
+        """
+        if not records:
+            return
+        now = datetime.now()
+        # Стискаємо текст до захоплення блокування запису
+        transcripts = {
+            info['id']: (result.transcription, compress_text(result.transcription))
+            for info, result, _ in records if not result.is_error and result.transcription
+        }
+        raw_outputs = {
+            info['id']: compress_text(result.raw_response or json.dumps(result.to_dict(), ensure_ascii=False))
+            for info, result, _ in records if not result.is_error
+        }
+        async with self._write_lock:
+            # Збій чи скасування посеред транзакції (напр. SQLITE_BUSY) відкочує її повністю: пачку можна записати знову
+            try:
+                await self.conn.executemany(
+                    "INSERT OR REPLACE INTO processed_files (file_id, file_name, manager_score, processed_at) VALUES (?, ?, ?, ?)",
+                    [(info['id'], info['name'], result.manager_score, now) for info, result, _ in records]
+                )
+
+                # Повторна обробка, що завершилась помилкою, не лишає старого аналізу
+                # у звітах і пошуку; порожня транскрибація не лишає старої в індексі
+                await self._drop_stale_results([info['id'] for info, result, _ in records if result.is_error])
+                await self._drop_transcripts([info['id'] for info, result, _ in records
+                                              if not result.is_error and not result.transcription])
+
+                cursor = await self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM call_results")
+                seq = (await cursor.fetchone())[0]
+                rows = []
+                for info, result, _ in records:
+                    if result.is_error:
+                        continue
+                    seq += 1
+                    rows.append(self._call_result_row(info, result, now, seq))
+                if rows:
+                    placeholders = ", ".join("?" * len(rows[0]))
+                    await self.conn.executemany(
+                        f"INSERT OR REPLACE INTO call_results VALUES ({placeholders})", rows
+                    )
+                    await self._index_transcripts(transcripts)
+                    await self.conn.executemany(
+                        """
+                        INSERT OR REPLACE INTO call_raw_outputs
+                            (file_id, file_info, raw_response, ai_model, prompt_version, stored_at,
+                             ai_cost_usd, ai_latency, escalation, ai_batch)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """,
+                        [(info['id'], json.dumps(info, ensure_ascii=False), raw_outputs[info['id']],
+                          result.ai_model, result.prompt_version, time.time(),
+                          result.ai_cost_usd, result.ai_latency, result.escalation or None, int(result.ai_batch))
+                         for info, result, _ in records if not result.is_error]
+                    )
+
+                # Рядки для таблиці та завершені задачі — в тій самій транзакції
+                created = time.time()
+                await self.conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO sheets_outbox (file_id, entry, attempts, available_at, created_at)
+                    VALUES (?, ?, 0, ?, ?)
+                    """,
+                    [(info['id'], json.dumps(entry, ensure_ascii=False), created, created)
+                     for info, _, entry in records if entry is not None]
+                )
+                await self.conn.executemany(
+                    "UPDATE jobs SET status = 'done', lease_expires_at = NULL WHERE file_id = ?",
+                    [(info['id'],) for info, _, _ in records]
+                )
+                await self.conn.commit()
+            except BaseException:
+                # Зокрема CancelledError: транзакція не лишається відкритою для наступного запису
+                await self.conn.rollback()
+                raise
+
+    async def _drop_stale_results(self, file_ids: list):
+        """
+        Видаляє попередній аналіз файлів (call_results, сиру відповідь, транскрибацію) у поточній
+        транзакції. Тижні видалених результатів позначаються для перерахунку підсумків (changed_weeks).
+        """
+        if not file_ids:
+            return
+        ids = json.dumps(file_ids)
+        cursor = await self.conn.execute(
+            "DELETE FROM call_results WHERE file_id IN (SELECT value FROM json_each(?)) RETURNING week", (ids,)
+        )
+        weeks = {row[0] for row in await cursor.fetchall()}
+        if weeks:
+            cursor = await self.conn.execute("SELECT value FROM bot_state WHERE key = ?", (self.DIRTY_WEEKS_KEY,))
+            row = await cursor.fetchone()
+            weeks.update(json.loads(row[0]) if row else [])
+            await self.conn.execute(
+                "INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)",
+                (self.DIRTY_WEEKS_KEY, json.dumps(sorted(weeks)))
+            )
+        await self.conn.execute("DELETE FROM call_raw_outputs WHERE file_id IN (SELECT value FROM json_each(?))", (ids,))
+        await self._drop_transcripts(file_ids)
+
+    async def _drop_transcripts(self, file_ids: list):
+        """Видаляє транскрибації файлів разом із їх словами в індексі FTS5 (у поточній транзакції)."""
+        if not file_ids:
+            return
+        ids = json.dumps(file_ids)
+        cursor = await self.conn.execute(
+            "SELECT id, transcript FROM call_transcripts WHERE file_id IN (SELECT value FROM json_each(?))", (ids,)
+        )
+        await self.conn.executemany(
+            "INSERT INTO transcripts_fts (transcripts_fts, rowid, transcript) VALUES ('delete', ?, ?)",
+            [(row_id, decompress_text(blob)) for row_id, blob in await cursor.fetchall()]
+        )
+        await self.conn.execute("DELETE FROM call_transcripts WHERE file_id IN (SELECT value FROM json_each(?))", (ids,))
+
+    async def _index_transcripts(self, transcripts: dict):
+        """
+        Зберігає стиснуті транскрибації та оновлює індекс FTS5 (у поточній транзакції).
+        transcripts — {file_id: (текст, стиснутий текст)}. Індекс без вмісту
+        видаляє старі слова лише за попереднім текстом, тож він береться з бази.
+        """
+        if not transcripts:
+            return
+        file_ids = json.dumps(list(transcripts))
+        cursor = await self.conn.execute(
+            "SELECT id, transcript FROM call_transcripts WHERE file_id IN (SELECT value FROM json_each(?))",
+            (file_ids,)
+        )
+        await self.conn.executemany(
+            "INSERT INTO transcripts_fts (transcripts_fts, rowid, transcript) VALUES ('delete', ?, ?)",
+            [(row_id, decompress_text(blob)) for row_id, blob in await cursor.fetchall()]
+        )
+
+        await self.conn.executemany(
+            """
+            INSERT INTO call_transcripts (file_id, transcript) VALUES (?, ?)
+            ON CONFLICT (file_id) DO UPDATE SET transcript = excluded.transcript
+            """,
+            [(file_id, blob) for file_id, (_, blob) in transcripts.items()]
+        )
+        cursor = await self.conn.execute(
+            "SELECT id, file_id FROM call_transcripts WHERE file_id IN (SELECT value FROM json_each(?))",
+            (file_ids,)
+        )
+        await self.conn.executemany(
+            "INSERT INTO transcripts_fts (rowid, transcript) VALUES (?, ?)",
+            [(row_id, transcripts[file_id][0]) for row_id, file_id in await cursor.fetchall()]
+        )
+
+    @timed("db_search_transcripts")
+    async def search_transcripts(self, query: str, limit: int) -> list:
+        """
+        Повнотекстовий пошук (синтаксис FTS5), найкращі за bm25 першими.
+        Рядки: (file_id, file_name, call_date, manager, manager_score, rank, стиснутий текст).
+        """
+        cursor = await self.conn.execute(
+            """
+            SELECT t.file_id, r.file_name, r.call_date, r.manager, r.manager_score, hits.rank, t.transcript
+            FROM (
+                SELECT rowid, rank FROM transcripts_fts
+                WHERE transcripts_fts MATCH ? ORDER BY rank LIMIT ?
+            ) AS hits
+            JOIN call_transcripts t ON t.id = hits.rowid
+            LEFT JOIN call_results r ON r.file_id = t.file_id
+            ORDER BY hits.rank
+            """,
+            (query, limit)
+        )
+        return await cursor.fetchall()
+
+    @timed("db_fetch_raw_outputs")
+    async def fetch_raw_outputs(self, after: int, limit: int) -> list:
+        """
+        Наступна пачка збережених відповідей моделі (для --replay), у порядку збереження.
+        Рядки: (rowid, file_info, стиснута відповідь, стиснута транскрибація або None, processed_at).
+        """
+        cursor = await self.conn.execute(
+            """
+            SELECT r.rowid, r.file_info, r.raw_response, t.transcript, p.processed_at
+            FROM call_raw_outputs r
+            LEFT JOIN call_transcripts t ON t.file_id = r.file_id
+            LEFT JOIN processed_files p ON p.file_id = r.file_id
+            WHERE r.rowid > ?
+            ORDER BY r.rowid
+            LIMIT ?
+            """,
+            (after, limit)
+        )
+        return await cursor.fetchall()
+
+    @timed("db_fetch_model_usage")
+    async def fetch_model_usage(self, since_week: str = None, until_week: str = None) -> tuple:
+        """
+        Модель, причина повтору, вартість, тривалість, ознака пакетної задачі та оцінка
+        кожного дзвінка за період: (колонки, рядки).
+        """
+        cursor = await self.conn.execute(
+            """
+            SELECT r.ai_model, r.escalation, r.ai_cost_usd, r.ai_latency, COALESCE(r.ai_batch, 0) AS ai_batch,
+                   c.manager_score
+            FROM call_raw_outputs r
+            JOIN call_results c ON c.file_id = r.file_id
+            WHERE c.week >= ? AND c.week <= ?
+            """,
+            (since_week or "", until_week or "9999")
+        )
+        columns = [d[0] for d in cursor.description]
+        return columns, await cursor.fetchall()
+
+    # Рядки для --rebuild-sheet: у порядку обробки (для старих записів без processed_at — дата дзвінка)
+    _SHEET_ROWS = """
+        SELECT * FROM (
+            SELECT c.*, r.file_info, r.raw_response, t.transcript, p.processed_at,
+                   COALESCE(p.processed_at, c.call_date) AS sort_key
+            FROM call_results c
+            LEFT JOIN call_raw_outputs r ON r.file_id = c.file_id
+            LEFT JOIN call_transcripts t ON t.file_id = c.file_id
+            LEFT JOIN processed_files p ON p.file_id = c.file_id
+        )
+    """
+
+    async def sheet_rows_snapshot(self) -> tuple:
+        """
+        Межа перебудови таблиці: (кількість рядків, ключ останнього рядка (sort_key, file_id) або None).
+        Результати, що з'являться пізніше, у перебудову не потрапляють (їх запише outbox).
+        """
+        cursor = await self.conn.execute(
+            f"{self._SHEET_ROWS} ORDER BY sort_key DESC, file_id DESC LIMIT 1"
+        )
+        row = await cursor.fetchone()
+        if row is None:
+            return 0, None
+        until = (row[-1], row[0])
+        cursor = await self.conn.execute(
+            f"SELECT COUNT(*) FROM ({self._SHEET_ROWS} WHERE (sort_key, file_id) <= (?, ?))", until
+        )
+        return (await cursor.fetchone())[0], until
+
+    @timed("db_fetch_sheet_rows")
+    async def fetch_sheet_rows(self, after: tuple, until: tuple, limit: int) -> list:
+        """
+        Наступна пачка рядків для --rebuild-sheet після ключа after (None — з початку) до until
+        включно: словники з полями call_results, file_info і сирою відповіддю моделі (якщо збережені),
+        стиснутою транскрибацією (transcript), processed_at і ключем sort_key.
+        """
+        cursor = await self.conn.execute(
+            f"""
+            {self._SHEET_ROWS}
+            WHERE (sort_key, file_id) > (?, ?) AND (sort_key, file_id) <= (?, ?)
+            ORDER BY sort_key, file_id
+            LIMIT ?
+            """,
+            (*(after or ("", "")), *until, limit)
+        )
+        columns = [d[0] for d in cursor.description]
+        return [dict(zip(columns, row)) for row in await cursor.fetchall()]
+
+    async def discard_outbox(self, file_ids: list) -> int:
+        """
+        Видаляє з outbox рядки вказаних файлів (після --rebuild-sheet вони вже в таблиці).
+        Повертає кількість видалених рядків.
+        """
+        async with self._write_lock:
+            cursor = await self.conn.execute(
+                "DELETE FROM sheets_outbox WHERE file_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(file_ids)),)
+            )
+            await self.conn.commit()
+        return cursor.rowcount
+
+    async def count_unreplayable(self) -> int:
+        """Кількість результатів у call_results без збереженої відповіді моделі (оброблені раніше)."""
+        cursor = await self.conn.execute(
+            """
+            SELECT COUNT(*) FROM call_results c
+            WHERE NOT EXISTS (SELECT 1 FROM call_raw_outputs r WHERE r.file_id = c.file_id)
+            """
+        )
+        return (await cursor.fetchone())[0]
+
+    @timed("db_apply_replay")
+    async def apply_replay(self, records: list):
+        """
+        Перезаписує результати після повторного застосування правил (в одній транзакції):
+        call_results (з новим seq, тож підсумки для --report перераховуються),
+        оцінку в processed_files та ще не відправлені рядки в sheets_outbox.
+        records — список кортежів (file_info, CallAnalysis, запис для таблиці, processed_at).
+        """
+        if not records:
+            return
+        async with self._write_lock:
+            cursor = await self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM call_results")
+            seq = (await cursor.fetchone())[0]
+            rows = [self._call_result_row(info, result, processed_at, seq + i + 1)
+                    for i, (info, result, _, processed_at) in enumerate(records)]
+            placeholders = ", ".join("?" * len(rows[0]))
+            await self.conn.executemany(f"INSERT OR REPLACE INTO call_results VALUES ({placeholders})", rows)
+            await self.conn.executemany(
+                "UPDATE processed_files SET manager_score = ? WHERE file_id = ?",
+                [(result.manager_score, info['id']) for info, result, _, _ in records]
+            )
+            await self.conn.executemany(
+                "UPDATE sheets_outbox SET entry = ? WHERE file_id = ?",
+                [(json.dumps(entry, ensure_ascii=False), info['id']) for info, _, entry, _ in records]
+            )
+            await self.conn.commit()
+
+    @staticmethod
+    def _call_result_row(file_info: dict, result, processed_at: datetime, seq: int) -> tuple:
+        """Рядок call_results: дата дзвінка — createdTime з Drive або час обробки."""
+        created = file_info.get('createdTime')
+        call_date = datetime.fromisoformat(created.replace("Z", "+00:00")) if created else processed_at
+        iso = call_date.isocalendar()
+        call_info = parse_call_name(file_info['name'])
+        return (
+            file_info['id'], file_info['name'], call_date.date().isoformat(),
+            f"{iso[0]}-W{iso[1]:02d}", call_info['branch'], call_info['manager'], call_info['phone'],
+            result.service_type, result.result, result.manager_score, int(result.is_critical_fail),
+            *(getattr(result, name) for name in KPI_FIELDS),
+            seq,
+        )
+
+    async def outbox_status(self) -> tuple:
+        """
+        Стан черги для таблиці: (доступні зараз рядки, час створення найстарішого
+        з них, усього рядків разом з відкладеними та орендованими).
+        """
+        cursor = await self.conn.execute(
+            """
+            SELECT COUNT(*) FILTER (WHERE available_at <= ?),
+                   MIN(created_at) FILTER (WHERE available_at <= ?),
+                   COUNT(*)
+            FROM sheets_outbox
+            """,
+            (time.time(), time.time())
+        )
+        return await cursor.fetchone()
+
+    @timed("db_claim_outbox")
+    async def claim_outbox(self, limit: int, lease_seconds: float) -> list:
+        """
+        Забирає до limit найстаріших доступних рядків для відправки в таблицю.
+        Оренда не дає іншому екземпляру відправити ті самі рядки; якщо процес
+        впаде, рядки знову стануть доступними після lease_seconds.
+        Повертає [(id, запис, кількість спроб)] у порядку надходження.
+        """
+        now = time.time()
+        async with self._write_lock:
+            cursor = await self.conn.execute(
+                """
+                UPDATE sheets_outbox SET available_at = ?, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM sheets_outbox WHERE available_at <= ? ORDER BY id LIMIT ?
+                )
+                RETURNING id, entry, attempts
+                """,
+                (now + lease_seconds, now, limit)
+            )
+            rows = await cursor.fetchall()
+            await self.conn.commit()
+        return sorted((row_id, self._outbox_row(json.loads(entry)), attempts) for row_id, entry, attempts in rows)
+
+    @staticmethod
+    def _outbox_row(entry: list) -> list:
+        """Значення рядка з запису outbox; старі записи зберігались як (рядок, червона оцінка, червоний коментар)."""
+        return entry[0] if entry and isinstance(entry[0], list) else entry
+
+    async def ack_outbox(self, ids: list):
+        """Видаляє рядки, які вже записано в таблицю."""
+        async with self._write_lock:
+            await self.conn.execute(
+                "DELETE FROM sheets_outbox WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),)
+            )
+            await self.conn.commit()
+
+    async def defer_outbox(self, ids: list, delay: float):
+        """Відкладає рядки після збою запису на delay секунд."""
+        async with self._write_lock:
+            await self.conn.execute(
+                "UPDATE sheets_outbox SET available_at = ? WHERE id IN (SELECT value FROM json_each(?))",
+                (time.time() + delay, json.dumps(ids))
+            )
+            await self.conn.commit()
+
+    async def changed_weeks(self, since_seq: int) -> tuple:
+        """
+        Тижні з новими результатами після водяного знака since_seq, а також тижні,
+        з яких результати видалено (_drop_stale_results): (список тижнів, новий знак).
+        """
+        cursor = await self.conn.execute(
+            """
+            SELECT week FROM call_results WHERE seq > ?
+            UNION
+            SELECT value FROM json_each(COALESCE((SELECT value FROM bot_state WHERE key = ?), '[]'))
+            """,
+            (since_seq, self.DIRTY_WEEKS_KEY)
+        )
+        weeks = [row[0] for row in await cursor.fetchall()]
+        cursor = await self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM call_results")
+        return weeks, (await cursor.fetchone())[0]
+
+    async def fetch_call_results(self, weeks: list) -> tuple:
+        """Результати за вказані тижні: (назви колонок, рядки) для побудови DataFrame."""
+        cursor = await self.conn.execute(
+            "SELECT * FROM call_results WHERE week IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(weeks)),)
+        )
+        columns = [d[0] for d in cursor.description]
+        return columns, await cursor.fetchall()
+
+    @timed("db_replace_rollups")
+    async def replace_rollups(self, weeks: list, columns: list, rows: list, watermark_key: str, watermark: int):
+        """
+        Перераховані підсумки тижнів замінюють старі; водяний знак зсувається, а перераховані
+        тижні знімаються з позначки "видалено результати" в тій самій транзакції.
+        """
+        async with self._write_lock:
+            await self.conn.execute(
+                """
+                UPDATE bot_state SET value = (
+                    SELECT json_group_array(d.value) FROM json_each(bot_state.value) AS d
+                    WHERE d.value NOT IN (SELECT value FROM json_each(?))
+                ) WHERE key = ?
+                """,
+                (json.dumps(list(weeks)), self.DIRTY_WEEKS_KEY)
+            )
+            await self.conn.execute(
+                "DELETE FROM call_rollups WHERE week IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(weeks)),)
+            )
+            if rows:
+                await self.conn.executemany(
+                    f"INSERT INTO call_rollups ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    rows
+                )
+            await self.conn.execute(
+                "INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (watermark_key, str(watermark))
+            )
+            await self.conn.commit()
+
+    async def fetch_rollups(self, since_week: str = None, until_week: str = None) -> tuple:
+        """Матеріалізовані підсумки (опційно в межах тижнів): (назви колонок, рядки)."""
+        cursor = await self.conn.execute(
+            "SELECT * FROM call_rollups WHERE week >= ? AND week <= ?",
+            (since_week or "", until_week or "9999")
+        )
+        columns = [d[0] for d in cursor.description]
+        return columns, await cursor.fetchall()
+
+    async def get_state(self, key: str, default: str = None) -> str:
+        """Повертає збережене службове значення (наприклад, токен змін Drive)."""
+        cursor = await self.conn.execute(
+            "SELECT value FROM bot_state WHERE key = ?", (key,)
+        )
+        row = await cursor.fetchone()
+        return row[0] if row else default
+
+    async def set_state(self, key: str, value: str):
+        """Зберігає службове значення між запусками."""
+        async with self._write_lock:
+            await self.conn.execute(
+                "INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)",
+                (key, value)
+            )
+            await self.conn.commit()
+
+    @timed("db_get_cached_analysis")
+    async def get_cached_analysis(self, cache_key: str) -> dict:
+        """Повертає збережений результат аналізу за ключем вмісту (або None) та оновлює час використання."""
+        cursor = await self.conn.execute(
+            "SELECT result FROM analysis_cache WHERE cache_key = ?", (cache_key,)
+        )
+        row = await cursor.fetchone()
+        if row is None:
+            return None
+        async with self._write_lock:
+            await self.conn.execute(
+                "UPDATE analysis_cache SET last_used_at = ? WHERE cache_key = ?",
+                (datetime.now(), cache_key)
+            )
+            await self.conn.commit()
+        return json.loads(row[0])
+
+    @timed("db_put_cached_analysis")
+    async def put_cached_analysis(self, cache_key: str, result: dict):
+        """Зберігає результат аналізу в кеш за ключем вмісту."""
+        now = datetime.now()
+        async with self._write_lock:
+            await self.conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (cache_key, result, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                (cache_key, json.dumps(result, ensure_ascii=False), now, now)
+            )
+            await self.conn.commit()
+
+    async def evict_analysis_cache(self, max_entries: int, max_age_days: int) -> int:
+        """
+        Видаляє застарілі записи кешу (старші за max_age_days) та найдавніше
+        використані понад ліміт max_entries. Повертає кількість видалених записів.
+        """
+        cutoff = datetime.now() - timedelta(days=max_age_days)
+        async with self._write_lock:
+            by_age = await self.conn.execute(
+                "DELETE FROM analysis_cache WHERE created_at < ?", (cutoff,)
+            )
+            by_size = await self.conn.execute(
+                """
+                DELETE FROM analysis_cache WHERE cache_key IN (
+                    SELECT cache_key FROM analysis_cache
+                    ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (max_entries,)
+            )
+            await self.conn.commit()
+        return by_age.rowcount + by_size.rowcount
+
+    # "Вартість" задачі для планувальника (менша — раніше): вік дзвінка, тривалість запису або порядок появи
+    _JOB_COST = {
+        "fifo": "rowid",
+        "newest": "MAX(:now - COALESCE(call_created_at, enqueued_at, :now), 1.0)",
+        "sjf": "COALESCE(duration, 3600.0)",
+    }
+
+    @timed("db_enqueue_jobs")
+    async def enqueue_jobs(self, jobs: list, retry_failed: bool = False):
+        """
+        Додає файли в чергу задач (вже відомі задачі не дублюються).
+        jobs — список кортежів (file_info, час створення дзвінка, тривалість, філія).
+        retry_failed=True повертає в чергу задачі, що вичерпали спроби.
+        """
+        now = datetime.now()
+        enqueued_at = time.time()
+        async with self._write_lock:
+            await self.conn.executemany(
+                """
+                INSERT OR IGNORE INTO jobs
+                    (file_id, payload, status, attempts, created_at, enqueued_at, call_created_at, duration, branch)
+                VALUES (?, ?, 'pending', 0, ?, ?, ?, ?, ?)
+                """,
+                [(f['id'], json.dumps(f, ensure_ascii=False), now, enqueued_at, created, duration, branch)
+                 for f, created, duration, branch in jobs]
+            )
+            if retry_failed:
+                await self.conn.executemany(
+                    "UPDATE jobs SET status = 'pending', attempts = 0, available_at = NULL WHERE file_id = ? AND status = 'failed'",
+                    [(f['id'],) for f, _, _, _ in jobs]
+                )
+            await self.conn.commit()
+
+    @timed("db_claim_jobs")
+    async def claim_jobs(self, worker_id: str, limit: int, lease_seconds: float, policy: str = "fifo",
+                         fair_share: bool = False, aging_seconds: float = 900, max_wait: float = None) -> list:
+        """
+        Атомарно забирає до limit вільних задач (нових, з минулою паузою після збою або з простроченою орендою)
+        для worker_id у порядку планувальника:
+        - задачі, що чекають довше за max_wait, — першими (у порядку появи);
+        - далі за "вартістю" політики, поділеною на (1 + очікування / aging_seconds);
+        - з fair_share задачі філій чергуються (перша задача кожної філії, потім друга...).
+        Вибір і оренда виконуються в одній транзакції BEGIN IMMEDIATE, тож різні
+        екземпляри отримують непересічні набори файлів. Повертає список file_info
+        у порядку обробки; у кожному є 'queue_wait' — секунди очікування в черзі.
+        """
+        cost = self._JOB_COST[policy]
+        turn = "ROW_NUMBER() OVER (PARTITION BY branch ORDER BY cost, rid)" if fair_share else "1"
+        now = time.time()
+        params = {
+            'now': now, 'aging': aging_seconds, 'limit': limit,
+            'max_wait': max_wait if max_wait is not None else float("inf"),
+        }
+        async with self._write_lock:
+            await self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await self.conn.execute(
+                    f"""
+                    SELECT file_id, waited FROM (
+                        SELECT *, {turn} AS turn FROM (
+                            SELECT file_id, rowid AS rid, COALESCE(branch, '-') AS branch,
+                                   :now - COALESCE(enqueued_at, :now) AS waited,
+                                   {cost} / (1.0 + (:now - COALESCE(enqueued_at, :now)) / :aging) AS cost
+                            FROM jobs
+                            WHERE (status = 'pending' AND COALESCE(available_at, 0) <= :now)
+                               OR (status = 'leased' AND lease_expires_at < :now)
+                        )
+                    )
+                    ORDER BY waited >= :max_wait DESC,
+                             CASE WHEN waited >= :max_wait THEN rid END,
+                             turn, cost, rid
+                    LIMIT :limit
+                    """,
+                    params
+                )
+                ranked = await cursor.fetchall()
+                payloads = {}
+                if ranked:
+                    cursor = await self.conn.execute(
+                        """
+                        UPDATE jobs SET status = 'leased', worker_id = ?, lease_expires_at = ?
+                        WHERE file_id IN (SELECT value FROM json_each(?))
+                        RETURNING file_id, payload
+                        """,
+                        (worker_id, now + lease_seconds, json.dumps([file_id for file_id, _ in ranked]))
+                    )
+                    payloads = dict(await cursor.fetchall())
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                raise
+
+        files = []
+        for file_id, waited in ranked:
+            file_info = json.loads(payloads[file_id])
+            file_info['queue_wait'] = waited
+            files.append(file_info)
+        return files
+
+    async def heartbeat_jobs(self, worker_id: str, file_ids: list, lease_seconds: float):
+        """Продовжує оренду задач, які ще обробляє цей екземпляр."""
+        async with self._write_lock:
+            await self.conn.execute(
+                """
+                UPDATE jobs SET lease_expires_at = ?
+                WHERE status = 'leased' AND worker_id = ?
+                  AND file_id IN (SELECT value FROM json_each(?))
+                """,
+                (time.time() + lease_seconds, worker_id, json.dumps(list(file_ids)))
+            )
+            await self.conn.commit()
+
+    @timed("db_release_jobs")
+    async def release_jobs(self, worker_id: str, file_ids: list, attempted: list, max_attempts: int,
+                           retry_delay: float = 0):
+        """
+        Повертає в чергу незавершені задачі цього екземпляра.
+        Лічильник спроб збільшується лише для attempted (обробка завершилась помилкою);
+        така задача стає доступною через retry_delay * 2^(попередні спроби) секунд, а після
+        max_attempts позначається як 'failed'. Решта (не розпочаті через зупинку)
+        повертаються в чергу одразу й без зміни лічильника.
+        """
+        async with self._write_lock:
+            await self.conn.execute(
+                """
+                WITH attempted(file_id) AS (SELECT value FROM json_each(:attempted))
+                UPDATE jobs SET
+                    attempts = attempts + (file_id IN attempted),
+                    status = CASE WHEN file_id IN attempted AND attempts + 1 >= :max_attempts
+                                  THEN 'failed' ELSE 'pending' END,
+                    available_at = CASE WHEN file_id IN attempted
+                                        THEN :now + :retry_delay * (1 << attempts) END,
+                    worker_id = NULL, lease_expires_at = NULL
+                WHERE status = 'leased' AND worker_id = :worker_id
+                  AND file_id IN (SELECT value FROM json_each(:file_ids))
+                """,
+                {'attempted': json.dumps(list(attempted)), 'max_attempts': max_attempts,
+                 'worker_id': worker_id, 'file_ids': json.dumps(list(file_ids)),
+                 'now': time.time(), 'retry_delay': retry_delay}
             )
-            await db.commit()
+            await self.conn.commit()
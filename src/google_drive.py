@@ -1,9 +1,29 @@
 import os
-import google.auth
-from google.oauth2 import service_account
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+import time
+import hashlib
+import threading
+import httplib2
+import google_auth_httplib2
 from src.config import Config
+from src.credentials import get_credentials, build_service
+from src.rate_limiter import get_limiter, is_transient, is_rate_limited, retry_after_seconds, backoff_delay
+from src.logger import logger
+from src.metrics import timed
+
+
+class _HashingWriter:
+    """
+    Обгортка над файлом, яка рахує MD5 під час запису.
+    Дозволяє перевірити контрольну суму без повторного читання файлу.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self.md5 = hashlib.md5()
+
+    def write(self, data: bytes) -> int:
+        self.md5.update(data)
+        return self._f.write(data)
 
 
 class DriveService:
@@ -13,26 +33,66 @@ class DriveService:
     """
 
     def __init__(self):
-        # Визначаємо область доступу (Scopes) для роботи з Drive
-        SCOPES = ['https://www.googleapis.com/auth/drive']
+        # Облікові дані спільні з SheetsService; клієнт API створюється при першому запиті
+        self.creds = get_credentials()
+        self._service = None
 
-        # Завантаження облікових даних із файлу сервісного акаунту
-        self.creds = service_account.Credentials.from_service_account_file(
-            Config.GOOGLE_CREDENTIALS_FILE,
-            scopes=SCOPES
-        )
+        # Окремий HTTP-клієнт для кожного потоку (httplib2 не є потокобезпечним)
+        self._local = threading.local()
 
-        # Перевірка валідності токена та його оновлення за потреби
-        if not self.creds.valid:
-            self.creds.refresh(Request())
+        # Спільний адаптивний обмежувач запитів до API
+        self.limiter = get_limiter('drive')
 
-        # Ініціалізація клієнта API версії v3
-        self.service = build('drive', 'v3', credentials=self.creds)
+    @property
+    def service(self):
+        """Клієнт Drive API v3 (створюється ліниво, discovery — зі статичного документа)."""
+        if self._service is None:
+            self._service = build_service('drive', 'v3')
+        return self._service
+
+    def _http(self):
+        """
+        Повертає авторизований HTTP-клієнт поточного потоку.
+        Дозволяє безпечно викликати API з кількох воркерів конвеєра одночасно.
+        """
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+    def _execute(self, request):
+        """Виконує запит API через спільний обмежувач (ліміт, Retry-After, backoff)."""
+        return self.limiter.call(request.execute, http=self._http())
+
+    @staticmethod
+    def _is_audio(file_info: dict) -> bool:
+        """Перевіряє, чи є файл аудіозаписом (за MIME-типом або розширенням)."""
+        name = file_info.get('name', '').lower()
+        return (file_info.get('mimeType', '').startswith('audio/')
+                or '.mp3' in name or '.wav' in name)
+
+    @staticmethod
+    def _file_entry(file_info: dict) -> dict:
+        """
+        Метадані файлу для черги: розмір, час створення та (якщо Drive його знає) тривалість —
+        за ними планувальник визначає порядок обробки.
+        """
+        entry = {
+            'id': file_info['id'], 'name': file_info['name'],
+            'md5Checksum': file_info.get('md5Checksum'), 'size': file_info.get('size'),
+            'createdTime': file_info.get('createdTime'),
+        }
+        duration = file_info.get('videoMediaMetadata', {}).get('durationMillis')
+        if duration:
+            entry['durationMillis'] = duration
+        return entry
 
     def list_audio_files(self, folder_id: str) -> list:
         """
         Отримує список аудіофайлів (.mp3, .wav) із вказаної папки Google Drive.
         Фільтрує файли за MIME-типом або розширенням, ігноруючи кошик.
+        Проходить по всіх сторінках результатів (nextPageToken).
         """
         # Формування пошукового запиту (Q parameter)
         query = (
@@ -41,30 +101,128 @@ class DriveService:
             f"and trashed=false"
         )
 
-        # Виконання запиту до API
-        results = self.service.files().list(
-            q=query,
-            fields="files(id, name)"  # Оптимізація: отримуємо лише ID та назву
-        ).execute()
+        files = []
+        page_token = None
+        while True:
+            # Виконання запиту до API (сторінка за сторінкою)
+            results = self._execute(self.service.files().list(
+                q=query,
+                pageSize=1000,
+                pageToken=page_token,
+                # Оптимізація: лише потрібні поля (тривалість Drive віддає не для всіх форматів)
+                fields="nextPageToken, files(id, name, md5Checksum, size, createdTime, videoMediaMetadata(durationMillis))"
+            ))
+
+            files.extend(self._file_entry(f) for f in results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
 
-        return results.get('files', [])
+    def get_start_page_token(self) -> str:
+        """Повертає поточний токен стрічки змін Drive (точка відліку для інкрементального режиму)."""
+        result = self._execute(self.service.changes().getStartPageToken())
+        return result['startPageToken']
 
-    def download_file(self, file_id: str, file_name: str) -> str:
+    def list_changes(self, page_token: str, folder_id: str) -> tuple:
         """
-        Завантажує файл за ID у локальну тимчасову директорію.
-        Повертає абсолютний або відносний шлях до збереженого файлу.
+        Читає стрічку змін Drive починаючи з page_token.
+        Повертає (нові або змінені аудіофайли у папці folder_id, новий стартовий токен).
         """
-        # Створення запиту на отримання медіа-вмісту файлу
+        files = {}
+        new_start_token = page_token
+        while page_token:
+            results = self._execute(self.service.changes().list(
+                pageToken=page_token,
+                pageSize=1000,
+                spaces='drive',
+                includeRemoved=False,
+                fields="nextPageToken, newStartPageToken, "
+                       "changes(fileId, removed, file(id, name, mimeType, parents, trashed, md5Checksum, size, "
+                       "createdTime, videoMediaMetadata(durationMillis)))"
+            ))
+
+            for change in results.get('changes', []):
+                file_info = change.get('file')
+                if change.get('removed') or not file_info or file_info.get('trashed'):
+                    continue
+                if folder_id not in file_info.get('parents', []) or not self._is_audio(file_info):
+                    continue
+                # Один файл може змінюватись кілька разів — залишаємо останній запис
+                files[file_info['id']] = self._file_entry(file_info)
+
+            new_start_token = results.get('newStartPageToken', new_start_token)
+            page_token = results.get('nextPageToken')
+
+        return list(files.values()), new_start_token
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """Визначає, чи варто повторити завантаження чанка після помилки (мережа, 429, 5xx)."""
+        from googleapiclient.errors import HttpError
+        if isinstance(error, HttpError):
+            return is_transient(error)
+        return isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+    @timed("download")
+    def download_file(self, file_id: str, file_name: str, md5_checksum: str = None) -> str:
+        """
+        Потоково завантажує файл за ID у локальну тимчасову директорію чанками
+        по DOWNLOAD_CHUNK_SIZE байт, продовжуючи з місця обриву після мережевих помилок.
+        Перевіряє MD5 із Drive (md5Checksum). Повертає шлях до збереженого файлу.
+        """
+        from googleapiclient.http import MediaIoBaseDownload
+        # Контрольна сума з Drive (якщо не прийшла разом зі списком файлів)
+        if md5_checksum is None:
+            meta = self._execute(self.service.files().get(
+                fileId=file_id, fields="md5Checksum"
+            ))
+            md5_checksum = meta.get('md5Checksum')
+
+        # Створення запиту на отримання медіа-вмісту файлу (з HTTP-клієнтом поточного потоку)
         request = self.service.files().get_media(fileId=file_id)
+        request.http = self._http()
 
-        # Формування локального шляху для збереження
-        local_path = os.path.join(Config.TEMP_FOLDER, file_name)
+        # Унікальний локальний шлях: однакові назви файлів не перетинаються
+        local_path = os.path.join(Config.TEMP_FOLDER, f"{file_id}_{os.path.basename(file_name)}")
 
         # Створення локальної папки, якщо вона відсутня
         os.makedirs(Config.TEMP_FOLDER, exist_ok=True)
 
-        # Запис бінарних даних у файл
-        with open(local_path, "wb") as f:
-            f.write(request.execute())
+        try:
+            with open(local_path, "wb") as f:
+                writer = _HashingWriter(f)
+                downloader = MediaIoBaseDownload(writer, request, chunksize=Config.DOWNLOAD_CHUNK_SIZE)
+
+                done = False
+                failures = 0
+                while not done:
+                    # Кожен чанк — окремий запит, тож він теж проходить через ліміт Drive
+                    self.limiter.acquire()
+                    try:
+                        # Завантажувач пам'ятає позицію, тож повтор продовжує з того ж байта
+                        _, done = downloader.next_chunk()
+                        failures = 0
+                        self.limiter.on_success()
+                    except Exception as e:
+                        failures += 1
+                        if not self._is_retryable(e) or failures > Config.DOWNLOAD_MAX_RETRIES:
+                            raise
+                        retry_after = retry_after_seconds(e)
+                        if is_rate_limited(e):
+                            self.limiter.on_throttle(retry_after)
+                        wait_time = max(retry_after or 0, backoff_delay(failures))
+                        logger.warning(f"⚠️ Обрив завантаження {file_name} ({e}). "
+                                       f"Продовження через {wait_time:.1f} с...")
+                        time.sleep(wait_time)
+
+            # Перевірка цілісності
+            if md5_checksum and writer.md5.hexdigest() != md5_checksum:
+                raise ValueError(f"Контрольна сума не збігається для {file_name}")
+
+        except Exception:
+            # Видаляємо пошкоджений або неповний файл
+            if os.path.exists(local_path):
+                os.remove(local_path)
+            raise
 
         return local_path
@@ -1,9 +1,14 @@
-import google.auth
-from google.oauth2 import service_account
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+import threading
+from collections import Counter
+import httplib2
+import google_auth_httplib2
 from datetime import datetime
 from src.config import Config
+from src.credentials import get_credentials, build_service
+from src.rate_limiter import get_limiter
+from src.logger import logger
+from src.metrics import timed
+from src.call_analysis import CallAnalysis, parse_call_name
 
 
 class SheetsService:
@@ -11,141 +16,301 @@ class SheetsService:
     Сервіс для роботи з Google Sheets.
     Відповідає за авторизацію, створення структури таблиці, запис результатів аналізу
     та умовне форматування (підсвічування проблемних дзвінків).
+    Підсвічування задається двома правилами умовного форматування на весь аркуш
+    (низька оцінка в колонці O, критична помилка — за прапорцем у колонці R),
+    тож запис рядків не потребує жодних запитів форматування.
     """
 
-    def __init__(self):
-        # Визначаємо права доступу (Scopes) для редагування таблиць
-        SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+    HEADERS = [
+        "Дата", "Назва файлу", "Телефон", "Філія", "Менеджер",
+        "Привітання (1/0)", "Дізнався КУЗОВ (1/0)", "Дізнався РІК (1/0)",
+        "Дізнався ПРОБІГ (1/0)", "Запроп. ДІАГНОСТ. (1/0)", "Історія авто (1/0)",
+        "Прощання (1/0)", "Тип послуги", "Результат",
+        "Оцінка (1-10)", "Коментар", "Транскрибація", "Критична помилка (1/0)", "ID файлу"
+    ]
+    # Остання колонка шапки (S); ID файлу Drive — ключ рядка для rewrite_rows
+    LAST_COLUMN = "S"
+    # Колонки, які підсвічуються: оцінка (O) та коментар (P)
+    SCORE_COLUMN, COMMENT_COLUMN = 14, 15
 
-        # Авторизація через Service Account
-        self.creds = service_account.Credentials.from_service_account_file(
-            Config.GOOGLE_CREDENTIALS_FILE,
-            scopes=SCOPES
-        )
+    def __init__(self, service=None):
+        """service — готовий клієнт Sheets API (наприклад, локальна заміна для бенчмарків)."""
+        # Облікові дані спільні з DriveService; клієнт API створюється при першому запиті
+        self.creds = None if service is not None else get_credentials()
+        self._service = service
 
-        # Оновлення токена доступу, якщо він застарів
-        if not self.creds.valid:
-            self.creds.refresh(Request())
-
-        # Ініціалізація клієнта API
-        self.service = build('sheets', 'v4', credentials=self.creds)
         self.spreadsheet_id = Config.SHEET_ID
-        self.sheet_name = "Test_Run"
+        self.sheet_name = Config.SHEET_NAME
+
+        # Окремий HTTP-клієнт для кожного потоку (httplib2 не є потокобезпечним)
+        self._local = threading.local()
+
+        # Спільний адаптивний обмежувач запитів до API
+        self.limiter = get_limiter('sheets')
+
+        # Кеш числового ID аркуша (резолвиться один раз)
+        self._sheet_id = None
 
-        # Перевірка наявності заголовків при старті
-        self.setup_headers()
+        # Пачки пишуться по одній, щоб номери рядків з append не перемішувались
+        self._write_lock = threading.Lock()
 
-    def _get_sheet_id_by_name(self, sheet_name: str) -> int:
+        # Шапка таблиці перевіряється перед першим записом, а не при старті:
+        # запуск без нових файлів не робить жодного запиту до Sheets
+        self._headers_ready = False
+
+    @property
+    def service(self):
+        """Клієнт Sheets API v4 (створюється ліниво, discovery — зі статичного документа)."""
+        if self._service is None:
+            self._service = build_service('sheets', 'v4')
+        return self._service
+
+    def _http(self):
         """
-        Отримує внутрішній числовий ID аркуша (sheetId) за його назвою.
-        Необхідний для запитів форматування (batchUpdate).
+        Повертає авторизований HTTP-клієнт поточного потоку.
+        Дозволяє безпечно писати в таблицю з кількох воркерів конвеєра одночасно.
         """
-        try:
-            spreadsheet = self.service.spreadsheets().get(spreadsheetId=self.spreadsheet_id).execute()
-            for sheet in spreadsheet.get('sheets', []):
-                if sheet['properties']['title'] == sheet_name:
-                    return sheet['properties']['sheetId']
-            return 0
-        except Exception:
-            return 0
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+            self._local.http = http
+        return http
 
-    def setup_headers(self):
+    def _execute(self, request, cancel: threading.Event = None):
         """
-        Перевіряє, чи порожня таблиця. Якщо так — створює заголовки та форматує їх.
+        Виконує запит API через спільний обмежувач (ліміт, Retry-After, backoff);
+        встановлений cancel перериває очікування в обмежувачі.
         """
-        range_name = f"{self.sheet_name}!A1"
-        result = self.service.spreadsheets().values().get(
-            spreadsheetId=self.spreadsheet_id, range=range_name).execute()
+        return self.limiter.call(request.execute, http=self._http(), cancel=cancel)
 
-        # Якщо даних немає, створюємо шапку
-        if not result.get('values'):
-            headers = [
-                "Дата", "Назва файлу", "Телефон", "Філія", "Менеджер",
-                "Привітання (1/0)", "Дізнався КУЗОВ (1/0)", "Дізнався РІК (1/0)",
-                "Дізнався ПРОБІГ (1/0)", "Запроп. ДІАГНОСТ. (1/0)", "Історія авто (1/0)",
-                "Прощання (1/0)", "Тип послуги", "Результат",
-                "Оцінка (1-10)", "Коментар", "Транскрибація"
-            ]
+    def _find_sheet(self, cancel: threading.Event = None) -> dict:
+        """
+        Властивості та правила умовного форматування робочого аркуша (один запит spreadsheets().get);
+        None, якщо аркуша з такою назвою немає.
+        """
+        spreadsheet = self._execute(self.service.spreadsheets().get(
+            spreadsheetId=self.spreadsheet_id,
+            fields="sheets(properties(sheetId,title,gridProperties),conditionalFormats)"), cancel)
+        for sheet in spreadsheet.get('sheets', []):
+            if sheet['properties']['title'] == self.sheet_name:
+                self._sheet_id = sheet['properties']['sheetId']
+                return sheet
+        return None
+
+    def _get_sheet_id(self) -> int:
+        """Повертає закешований sheetId робочого аркуша (запит до API лише один раз)."""
+        if self._sheet_id is None:
+            try:
+                self._find_sheet()
+            except Exception:
+                pass
+            if self._sheet_id is None:
+                self._sheet_id = 0
+        return self._sheet_id
 
-            body = {'values': [headers]}
+    def setup_headers(self, cancel: threading.Event = None):
+        """
+        Перевіряє шапку таблиці: створює її на порожньому аркуші (з форматуванням)
+        або дописує нові колонки до наявної. Також перевіряє правила підсвічування.
+        """
+        result = self._execute(self.service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id, range=f"{self.sheet_name}!A1:{self.LAST_COLUMN}1"), cancel)
+        current = (result.get('values') or [[]])[0]
 
-            # Запис заголовків
-            self.service.spreadsheets().values().update(
+        # Якщо шапки немає або в ній бракує колонок, записуємо її повністю
+        if len(current) < len(self.HEADERS):
+            self._execute(self.service.spreadsheets().values().update(
                 spreadsheetId=self.spreadsheet_id, range=f"{self.sheet_name}!A1",
-                valueInputOption="USER_ENTERED", body=body
-            ).execute()
+                valueInputOption="USER_ENTERED", body={'values': [self.HEADERS]}
+            ), cancel)
 
-            # Застосування стилю (жирний шрифт, сірий фон)
-            self._format_header(self._get_sheet_id_by_name(self.sheet_name))
+        requests = self._highlight_rule_requests(self._find_sheet(cancel))
+        # Застосування стилю (жирний шрифт, сірий фон)
+        if not current:
+            requests.append(self._header_format_request(self._get_sheet_id()))
+        if requests:
+            self._execute(self.service.spreadsheets().batchUpdate(
+                spreadsheetId=self.spreadsheet_id, body={'requests': requests}), cancel)
 
-    def append_analysis(self, file_name: str, ai_data: dict):
-        """
-        Додає новий рядок з даними аналізу в таблицю та застосовує кольорове маркування.
-        """
-        today = datetime.now().strftime("%d.%m.%Y")
-        row_values = ["-"] * 17
+    def _build_row(self, file_name: str, ai_data: CallAnalysis, processed_at: datetime = None,
+                   file_id: str = "") -> list:
+        """Формує значення рядка таблиці з результату аналізу (дата — processed_at або сьогодні)."""
+        row_values = ["-"] * len(self.HEADERS)
 
         # --- Заповнення даних ---
-        row_values[0] = today
+        row_values[0] = (processed_at or datetime.now()).strftime("%d.%m.%Y")
         row_values[1] = file_name
 
+        # Телефон, філія, менеджер — з назви файлу (якщо задано CALL_NAME_PATTERN)
+        call_info = parse_call_name(file_name)
+        row_values[2] = call_info['phone']
+        row_values[3] = call_info['branch']
+        row_values[4] = call_info['manager']
+
         # Блок KPI (ключові показники ефективності)
-        row_values[5] = ai_data.get('kpi_greeting', 0)
-        row_values[6] = ai_data.get('kpi_body', 0)
-        row_values[7] = ai_data.get('kpi_year', 0)
-        row_values[8] = ai_data.get('kpi_mileage', 0)
-        row_values[9] = ai_data.get('kpi_upsell', 0)
-        row_values[10] = ai_data.get('kpi_history', 0)
-        row_values[11] = ai_data.get('kpi_closing', 0)
+        row_values[5] = ai_data.kpi_greeting
+        row_values[6] = ai_data.kpi_body
+        row_values[7] = ai_data.kpi_year
+        row_values[8] = ai_data.kpi_mileage
+        row_values[9] = ai_data.kpi_upsell
+        row_values[10] = ai_data.kpi_history
+        row_values[11] = ai_data.kpi_closing
 
         # Інформаційний блок
-        row_values[12] = ai_data.get('service_type', '-')
-        row_values[13] = ai_data.get('result', '-')
+        row_values[12] = ai_data.service_type
+        row_values[13] = ai_data.result
+        row_values[14] = ai_data.manager_score
+
+        row_values[15] = ai_data.critical_comment
+        row_values[16] = ai_data.transcription[:1000]  # Обрізка занадто довгих текстів
+        # Прапорець для правила підсвічування коментаря (колонка R)
+        row_values[17] = int(ai_data.is_critical_fail)
+        # ID файлу Drive: назви файлів можуть повторюватись
+        row_values[18] = file_id
+
+        return row_values
+
+    def build_entry(self, file_name: str, ai_data: CallAnalysis, processed_at: datetime = None,
+                    file_id: str = "") -> list:
+        """
+        Готує запис для черги відправки (outbox) — значення рядка таблиці.
+        Нічого не відправляє в API; кольори задають правила аркуша (_highlight_rules).
+        """
+        return self._build_row(file_name, ai_data, processed_at, file_id)
 
-        score = ai_data.get('manager_score', 0)
-        row_values[14] = score
+    @timed("sheets_write")
+    def write_rows(self, batch: list, cancel: threading.Event = None):
+        """
+        Записує пачку записів (з build_entry) одним запитом values().append.
+        Підсвічування застосовують правила аркуша, тож окремого форматування немає.
+        Помилка запису передається далі: записи лишаються в черзі й будуть відправлені повторно.
+        Встановлений cancel перериває очікування ліміту й повторів (TimeoutError).
+        """
+        if not batch:
+            return
 
-        row_values[15] = ai_data.get('critical_comment', '')
-        row_values[16] = ai_data.get('transcription', '')[:1000]  # Обрізка занадто довгих текстів
+        body = {'values': list(batch)}
 
-        body = {'values': [row_values]}
+        with self._write_lock:
+            if not self._headers_ready:
+                self.setup_headers(cancel)
+                self._headers_ready = True
 
-        try:
-            # 1. Запис даних у таблицю
-            result = self.service.spreadsheets().values().append(
+            # Запис усіх рядків однією операцією
+            self._execute(self.service.spreadsheets().values().append(
                 spreadsheetId=self.spreadsheet_id, range=f"{self.sheet_name}!A1",
                 valueInputOption="USER_ENTERED", body=body
-            ).execute()
+            ), cancel)
+
+        logger.info(f"📊 Записано в таблицю {len(batch)} рядків.")
+
+    @timed("sheets_rewrite")
+    def rewrite_rows(self, entries: dict, chunk_size: int = 2000) -> int:
+        """
+        Оновлює вже записані рядки після повторного застосування правил (--replay).
+        Рядки знаходяться за ID файлу (колонка S) одним читанням аркуша; рядки, записані
+        до появи цієї колонки, — за назвою файлу (B), але лише якщо назва однозначна
+        і на аркуші, і серед entries (інакше рядок пропускається й потрапляє в попередження).
+        Перезаписуються лише змінені значення C:P, прапорець критичної помилки (R) та ID (S) —
+        пачками через values().batchUpdate. Дата (A) і транскрибація (Q) не змінюються,
+        кольори оновлюють правила аркуша.
+        entries — {ID файлу: (назва файлу, запис з build_entry)}. Повертає кількість оновлених рядків.
+        """
+        result = self._execute(self.service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id, range=f"{self.sheet_name}!A2:{self.LAST_COLUMN}"))
+        width = len(self.HEADERS)
+        sheet_rows = [row + [""] * (width - len(row)) for row in result.get('values', [])]
 
-            # 2. Отримання номера рядка, куди було записано дані
-            updated_range = result.get('updates', {}).get('updatedRange', '')
-            if updated_range:
-                # Парсинг номера рядка з відповіді API (наприклад, 'Sheet1!A2:Q2')
-                row_index = int(updated_range.split('!')[1].split(':')[0][1:])
-                sheet_id = self._get_sheet_id_by_name(self.sheet_name)
+        # Для рядків без ID: назва має відповідати рівно одному рядку аркуша й одному запису
+        sheet_names = Counter(row[1] for row in sheet_rows)
+        entry_names = Counter(name for name, _ in entries.values())
+        by_name = {name: entry for name, entry in entries.values() if entry_names[name] == 1}
 
-                # --- Логіка умовного форматування ---
+        changed, ambiguous = [], set()
+        for row_index, current in enumerate(sheet_rows, start=2):
+            file_id, name = current[18], current[1]
+            if file_id:
+                entry = entries.get(file_id, (None, None))[1]
+            elif name in entry_names and (entry_names[name] > 1 or sheet_names[name] > 1):
+                ambiguous.add(name)
+                continue
+            else:
+                entry = by_name.get(name)
+            if entry is None:
+                continue
+            values, current = entry[2:16] + entry[17:], current[2:16] + current[17:]
+            if [str(v) for v in values] != [str(v) for v in current]:
+                changed.append((row_index, entry))
 
-                # А) Якщо оцінка низька (<= 6), фарбуємо клітинку оцінки (Колонка O, індекс 14)
-                is_low_score = score <= 6
-                self._set_cell_format(row_index, sheet_id, is_low_score, 14)
+        if ambiguous:
+            logger.warning(f"⚠️ Рядки без ID файлу з неоднозначною назвою пропущено ({len(ambiguous)}): "
+                           f"{', '.join(sorted(ambiguous)[:10])}. Їх оновить --rebuild-sheet.")
 
-                # Б) Якщо є критична помилка, фарбуємо клітинку коментаря (Колонка P, індекс 15)
-                is_critical = ai_data.get('is_critical_fail', False)
-                self._set_cell_format(row_index, sheet_id, is_critical, 15)
+        for start in range(0, len(changed), chunk_size):
+            data = []
+            for row_index, row in changed[start:start + chunk_size]:
+                data.append({'range': f"{self.sheet_name}!C{row_index}:P{row_index}", 'values': [row[2:16]]})
+                data.append({'range': f"{self.sheet_name}!R{row_index}:{self.LAST_COLUMN}{row_index}",
+                             'values': [row[17:]]})
+            self._execute(self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=self.spreadsheet_id,
+                body={'valueInputOption': "USER_ENTERED", 'data': data}
+            ))
 
-        except Exception as e:
-            print(f"❌ Помилка роботи з Google Sheets: {e}")
+        return len(changed)
 
-    def _format_header(self, sheet_id: int):
+    def start_rebuild(self, total_rows: int):
         """
-        Задає стиль для першого рядка (заголовків): сірий фон та жирний шрифт.
+        Готує аркуш до повної перебудови (--rebuild-sheet): створює його, якщо немає,
+        очищає всі значення, задає розмір сітки під total_rows рядків, шапку та правила підсвічування.
+        Старе поклітинне форматування колонок O:P скидається. Кілька запитів незалежно від total_rows.
         """
+        sheet = self._find_sheet()
+        if sheet is None:
+            reply = self._execute(self.service.spreadsheets().batchUpdate(
+                spreadsheetId=self.spreadsheet_id,
+                body={'requests': [{"addSheet": {"properties": {"title": self.sheet_name}}}]}))
+            sheet = reply['replies'][0]['addSheet']
+            self._sheet_id = sheet['properties']['sheetId']
+            logger.info(f"🆕 Створено аркуш '{self.sheet_name}'.")
+
+        self._execute(self.service.spreadsheets().values().clear(
+            spreadsheetId=self.spreadsheet_id, range=self.sheet_name, body={}))
+
+        # values().update не розширює сітку, тож розмір аркуша задається наперед
         requests = [{
+            "updateSheetProperties": {
+                "properties": {
+                    "sheetId": self._sheet_id,
+                    "gridProperties": {"rowCount": total_rows + 1, "columnCount": len(self.HEADERS),
+                                       "frozenRowCount": 1}
+                },
+                "fields": "gridProperties(rowCount,columnCount,frozenRowCount)"
+            }
+        }, self._header_format_request(self._sheet_id)]
+        requests += self._highlight_rule_requests(sheet, reset_cells=True)
+        self._execute(self.service.spreadsheets().batchUpdate(
+            spreadsheetId=self.spreadsheet_id, body={'requests': requests}))
+        self._headers_ready = True
+
+    @timed("sheets_rebuild")
+    def write_block(self, first_row: int, rows: list):
+        """Записує значення рядків, починаючи з first_row (1 — шапка), одним запитом values().update."""
+        last_row = first_row + len(rows) - 1
+        self._execute(self.service.spreadsheets().values().update(
+            spreadsheetId=self.spreadsheet_id, range=f"{self.sheet_name}!A{first_row}:{self.LAST_COLUMN}{last_row}",
+            valueInputOption="USER_ENTERED", body={'values': rows}
+        ))
+
+    def _header_format_request(self, sheet_id: int) -> dict:
+        """
+        Запит стилю для першого рядка (заголовків): сірий фон та жирний шрифт.
+        """
+        return {
             "repeatCell": {
                 "range": {
                     "sheetId": sheet_id, "startRowIndex": 0, "endRowIndex": 1,
-                    "startColumnIndex": 0, "endColumnIndex": 17
+                    "startColumnIndex": 0, "endColumnIndex": len(self.HEADERS)
                 },
                 "cell": {
                     "userEnteredFormat": {
@@ -155,40 +320,65 @@ class SheetsService:
                 },
                 "fields": "userEnteredFormat(backgroundColor,textFormat)"
             }
-        }]
-        self.service.spreadsheets().batchUpdate(
-            spreadsheetId=self.spreadsheet_id, body={'requests': requests}).execute()
+        }
 
-    def _set_cell_format(self, row_index: int, sheet_id: int, is_red: bool, col_index: int):
+    def _highlight_rules(self, sheet_id: int) -> list:
         """
-        Змінює колір комірки.
-        Якщо is_red=True: Світло-червоний фон, червоний текст.
-        Якщо is_red=False: Білий фон, чорний текст.
+        Правила умовного форматування аркуша: світло-червоний фон і червоний жирний текст
+        для оцінки <= LOW_SCORE_THRESHOLD (колонка O) та коментаря дзвінка з критичною помилкою (P, за R).
         """
-        if is_red:
-            bg = {"red": 1.0, "green": 0.8, "blue": 0.8}
-            txt = {"red": 1.0, "green": 0.0, "blue": 0.0}
-            bold = True
-        else:
-            bg = {"red": 1.0, "green": 1.0, "blue": 1.0}
-            txt = {"red": 0.0, "green": 0.0, "blue": 0.0}
-            bold = False
-
-        requests = [{
-            "repeatCell": {
-                "range": {
-                    "sheetId": sheet_id,
-                    "startRowIndex": row_index - 1, "endRowIndex": row_index,
-                    "startColumnIndex": col_index, "endColumnIndex": col_index + 1
-                },
-                "cell": {
-                    "userEnteredFormat": {
-                        "backgroundColor": bg,
-                        "textFormat": {"foregroundColor": txt, "bold": bold}
-                    }
-                },
-                "fields": "userEnteredFormat(backgroundColor,textFormat)"
+        formulas = {
+            self.SCORE_COLUMN: f"=AND(ISNUMBER($O2),$O2<={Config.LOW_SCORE_THRESHOLD})",
+            self.COMMENT_COLUMN: "=$R2=1",
+        }
+        return [{
+            "ranges": [{"sheetId": sheet_id, "startRowIndex": 1,
+                        "startColumnIndex": column, "endColumnIndex": column + 1}],
+            "booleanRule": {
+                "condition": {"type": "CUSTOM_FORMULA", "values": [{"userEnteredValue": formula}]},
+                "format": {
+                    "backgroundColor": {"red": 1.0, "green": 0.8, "blue": 0.8},
+                    "textFormat": {"foregroundColor": {"red": 1.0, "green": 0.0, "blue": 0.0}, "bold": True}
+                }
             }
-        }]
-        self.service.spreadsheets().batchUpdate(
-            spreadsheetId=self.spreadsheet_id, body={'requests': requests}).execute()
+        } for column, formula in formulas.items()]
+
+    def _highlight_rule_requests(self, sheet: dict, reset_cells: bool = False) -> list:
+        """
+        Запити batchUpdate, що приводять правила підсвічування аркуша до поточних (_highlight_rules).
+        Порожній список, якщо правила вже актуальні. З reset_cells (лише --rebuild-sheet, коли аркуш
+        очищено) також скидається поклітинне форматування O:P, яке записували попередні версії бота:
+        на наявному аркуші старі рядки без прапорця в R втратили б підсвічування критичних помилок.
+        """
+        if sheet is None:
+            return []
+        sheet_id = sheet['properties']['sheetId']
+        wanted = self._highlight_rules(sheet_id)
+
+        def formula(rule):
+            return rule['booleanRule']['condition']['values'][0]['userEnteredValue']
+
+        # Свої правила впізнаються за діапазоном: одна колонка O або P від другого рядка
+        existing = sheet.get('conditionalFormats', [])
+        ours = [index for index, rule in enumerate(existing)
+                if len(rule.get('ranges', [])) == 1 and 'booleanRule' in rule
+                and rule['ranges'][0].get('startRowIndex') == 1
+                and rule['ranges'][0].get('startColumnIndex') in (self.SCORE_COLUMN, self.COMMENT_COLUMN)
+                and rule['ranges'][0].get('endColumnIndex') == rule['ranges'][0]['startColumnIndex'] + 1]
+        if not reset_cells and [formula(existing[i]) for i in ours] == [formula(rule) for rule in wanted]:
+            return []
+
+        requests = [{"deleteConditionalFormatRule": {"sheetId": sheet_id, "index": index}}
+                    for index in sorted(ours, reverse=True)]
+        requests += [{"addConditionalFormatRule": {"rule": rule, "index": index}}
+                     for index, rule in enumerate(wanted)]
+        if reset_cells:
+            requests.append({
+                "repeatCell": {
+                    "range": {"sheetId": sheet_id, "startRowIndex": 1,
+                              "startColumnIndex": self.SCORE_COLUMN, "endColumnIndex": self.COMMENT_COLUMN + 1},
+                    "cell": {},
+                    "fields": "userEnteredFormat(backgroundColor,textFormat)"
+                }
+            })
+        return requests
@@ -0,0 +1,81 @@
+import os
+import uuid
+import socket
+import asyncio
+from contextlib import asynccontextmanager
+from src.config import Config
+from src.logger import logger
+from src.metrics import metrics, Histogram
+from src.scheduler import Scheduler, format_wait
+
+
+class JobQueue:
+    """
+    Розподіл роботи між кількома екземплярами бота через таблицю jobs.
+    Кожен екземпляр забирає пачку задач в оренду, продовжує її сигналами
+    heartbeat під час обробки, а задачі аварійно зупиненого екземпляра
+    повертаються в чергу після закінчення терміну оренди.
+    Усі екземпляри мають працювати з одним файлом бази даних на одному хості:
+    база в режимі WAL покладається на спільну пам'ять, якої немає між машинами
+    (NFS/SMB), тож там оренда не атомарна, а база може зіпсуватись.
+    Порядок, у якому задачі забираються, визначає Scheduler (SCHEDULE_POLICY).
+    """
+
+    def __init__(self, db, worker_id: str = None, scheduler: Scheduler = None):
+        self.db = db
+        self.scheduler = scheduler or Scheduler()
+        self.worker_id = worker_id or Config.WORKER_ID or \
+            f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = Config.JOB_LEASE_SECONDS
+
+    async def enqueue(self, files: list, retry_failed: bool = False):
+        """Додає знайдені файли в спільну чергу (з полями для планувальника)."""
+        jobs = [(f, *self.scheduler.job_fields(f)) for f in files]
+        await self.db.enqueue_jobs(jobs, retry_failed)
+
+    async def claim(self, limit: int = None) -> list:
+        """
+        Забирає в оренду наступну пачку задач у порядку планувальника.
+        Час очікування кожного файлу в черзі потрапляє в метрику queue_wait_seconds.
+        """
+        claimed = await self.db.claim_jobs(self.worker_id, limit or Config.JOB_CLAIM_BATCH, self.lease_seconds,
+                                           **self.scheduler.claim_options())
+        for file_info in claimed:
+            metrics.observe("queue_wait_seconds", file_info['queue_wait'], buckets=Histogram.WAIT_BUCKETS)
+        if claimed:
+            waits = [f['queue_wait'] for f in claimed]
+            logger.info(f"⏳ Очікування в черзі: сер. {format_wait(sum(waits) / len(waits))}, "
+                        f"макс. {format_wait(max(waits))}")
+        return claimed
+
+    @asynccontextmanager
+    async def lease(self, files: list, failed: set = None):
+        """
+        Тримає оренду задач на час обробки (heartbeat кожну третину терміну).
+        Після виходу незавершені задачі повертаються в чергу. Спроба зараховується лише
+        файлам з failed (помилка обробки) або всім, якщо обробка обірвалась винятком, —
+        їх можна буде забрати знову лише після паузи JOB_RETRY_DELAY (подвоюється з кожною спробою);
+        файли, до яких черга не дійшла (зупинка), повертаються одразу й без зміни лічильника.
+        """
+        file_ids = [f['id'] for f in files]
+        heartbeat = asyncio.create_task(self._heartbeat(file_ids))
+        crashed = False
+        try:
+            yield
+        except Exception:
+            crashed = True
+            raise
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            attempted = file_ids if crashed else [i for i in file_ids if i in (failed or ())]
+            await self.db.release_jobs(self.worker_id, file_ids, attempted, Config.JOB_MAX_ATTEMPTS,
+                                       Config.JOB_RETRY_DELAY)
+
+    async def _heartbeat(self, file_ids: list):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.db.heartbeat_jobs(self.worker_id, file_ids, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"⚠️ Не вдалося продовжити оренду задач: {e}")
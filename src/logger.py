@@ -1,38 +1,125 @@
-import logging
-import sys
 import os
+import sys
+import gzip
+import json
+import queue
+import atexit
+import shutil
+import logging
+import contextvars
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from src.config import Config
+
+
+# Контекст поточного файлу/етапу: задається в конвеєрі й автоматично
+# потрапляє в кожен запис логу (asyncio.to_thread копіює контекст у потік)
+_log_context = contextvars.ContextVar("log_context", default={})
+
+# Поля, які структурований лог бере із записів (extra=... або контекст)
+_STRUCTURED_FIELDS = ("file_id", "stage", "duration_ms")
+
+
+def set_log_context(**fields):
+    """
+    Задає поля (file_id, stage) для всіх наступних записів логу поточної задачі asyncio
+    (у кожної задачі власна копія контексту, тож воркери не заважають один одному).
+    """
+    _log_context.set({**_log_context.get(), **fields})
+
+
+class _ContextFilter(logging.Filter):
+    """Переносить поля контексту на запис ще в потоці, що пише в лог."""
+
+    def filter(self, record):
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Один JSON-об'єкт на рядок: час, рівень, повідомлення, file_id, stage, duration_ms."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        for key in _STRUCTURED_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _gzip_rotator(source: str, dest: str):
+    """Стискає файл, що ротується, у .gz (виконується у фоновому потоці логера)."""
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _rotating_handler(path: str) -> logging.Handler:
+    """Файловий обробник з ротацією за розміром (LOG_ROTATE=size) або часом (time) і стисненням архівів."""
+    if Config.LOG_ROTATE == "time":
+        handler = TimedRotatingFileHandler(path, when=Config.LOG_ROTATE_WHEN,
+                                           backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8')
+    else:
+        handler = RotatingFileHandler(path, maxBytes=Config.LOG_MAX_BYTES,
+                                      backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8')
+    if Config.LOG_COMPRESS:
+        handler.namer = lambda name: name + ".gz"
+        handler.rotator = _gzip_rotator
+    return handler
 
 
 def setup_logger():
     """
     Налаштовує логер, який пише одночасно:
-    1. У файл 'bot.log' (з датою і часом)
+    1. У файл LOG_FILE (з датою і часом, з ротацією та стисненням)
     2. У консоль
+    3. За потреби (LOG_JSON=1) — у структурований JSON-лог LOG_JSON_FILE
+    Сам виклик logger.info лише кладе запис у чергу: форматування та запис
+    на диск виконує фоновий потік (QueueListener), тож цикл подій не блокується.
     """
     # Створюємо логер
     logger = logging.getLogger("CallAnalyzer")
-    logger.setLevel(logging.INFO)
+    logger.setLevel(Config.LOG_LEVEL)
 
     # Очищуємо старі хендлери, щоб не було дублювання при перезапуску
     if logger.handlers:
         logger.handlers.clear()
 
     # Налаштування запису у ФАЙЛ
-    file_handler = logging.FileHandler("bot.log", encoding='utf-8')
-    file_handler.setLevel(logging.INFO)
+    file_handler = _rotating_handler(Config.LOG_FILE)
     # Формат: [Час] [Рівень] Повідомлення
     file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     file_handler.setFormatter(file_formatter)
 
     # Налаштування виводу в консоль
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
     console_formatter = logging.Formatter('%(message)s')
     console_handler.setFormatter(console_formatter)
 
-    # Додаємо обидва обробники до логера
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    handlers = [file_handler, console_handler]
+    if Config.LOG_JSON:
+        json_handler = _rotating_handler(Config.LOG_JSON_FILE)
+        json_handler.setFormatter(JsonFormatter())
+        handlers.append(json_handler)
+
+    # Логер лише ставить записи в чергу, фоновий потік розсилає їх обробникам
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter())
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Дописуємо все з черги перед виходом процесу
+    atexit.register(listener.stop)
 
     return logger
 
@@ -0,0 +1,181 @@
+import time
+import asyncio
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.logger import logger
+
+
+class Histogram:
+    """Гістограма тривалостей (секунди) з фіксованими межами кошиків, як у Prometheus."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    # Для очікування в черзі та часу до результату: від секунд до кількох діб
+    WAIT_BUCKETS = (1, 10, 30, 60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400, 259200)
+
+    def __init__(self, buckets: tuple = None):
+        self.buckets = buckets or self.BUCKETS
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+
+def _labels(labels: dict, extra: dict = None) -> str:
+    items = dict(labels)
+    if extra:
+        items.update(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(items.items())) + "}"
+
+
+class Metrics:
+    """
+    Реєстр метрик процесу: гістограми тривалостей етапів та лічильники
+    (токени, вартість, повтори, 429). Потокобезпечний, бо етапи
+    виконуються у пулі потоків.
+    """
+
+    PREFIX = "call_analyzer_"
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, buckets: tuple = None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Вимірює тривалість блоку коду як етап stage."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe("stage_seconds", elapsed, stage=stage)
+            # Тривалість кожного виклику — у структурований лог (лише з LOG_LEVEL=DEBUG)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"⏱️  {stage}: {elapsed * 1000:.1f} мс",
+                             extra={"stage": stage, "duration_ms": round(elapsed * 1000, 1)})
+
+    def render(self) -> str:
+        """Текстовий формат Prometheus (exposition format 0.0.4)."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        for name in sorted({key[0] for key, _ in histograms}):
+            lines.append(f"# TYPE {self.PREFIX}{name} histogram")
+            for (hist_name, labels), h in histograms:
+                if hist_name != name:
+                    continue
+                labels = dict(labels)
+                # Лічильники кошиків уже кумулятивні (observe збільшує всі кошики з bound >= value)
+                for bound, count in zip(h.buckets, h.bucket_counts):
+                    lines.append(f"{self.PREFIX}{name}_bucket{_labels(labels, {'le': bound})} {count}")
+                lines.append(f"{self.PREFIX}{name}_bucket{_labels(labels, {'le': '+Inf'})} {h.count}")
+                lines.append(f"{self.PREFIX}{name}_sum{_labels(labels)} {h.sum}")
+                lines.append(f"{self.PREFIX}{name}_count{_labels(labels)} {h.count}")
+
+        for name in sorted({key[0] for key, _ in counters}):
+            lines.append(f"# TYPE {self.PREFIX}{name} counter")
+            for (counter_name, labels), value in counters:
+                if counter_name == name:
+                    lines.append(f"{self.PREFIX}{name}{_labels(dict(labels))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list:
+        """Короткий підсумок для логу наприкінці запуску."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        for (name, labels), h in histograms:
+            if name == "stage_seconds" and h.count:
+                stage = dict(labels).get("stage")
+                lines.append(f"⏱️  {stage:<14} {h.count:>6} викл.  сер. {h.sum / h.count:.2f} с  "
+                             f"макс. {h.max:.2f} с  всього {h.sum:.1f} с")
+            elif h.count:
+                lines.append(f"⏳ {name:<22} {h.count:>6} файлів  сер. {h.sum / h.count:.1f} с  макс. {h.max:.1f} с")
+        for (name, labels), value in counters:
+            suffix = ", ".join(f"{k}={v}" for k, v in labels)
+            label = f"{name}[{suffix}]" if suffix else name
+            lines.append(f"🔢 {label}: {round(value, 4)}")
+        return lines
+
+
+# Глобальний реєстр метрик, який імпортують інші модулі
+metrics = Metrics()
+
+
+def timed(stage: str):
+    """Декоратор: вимірює тривалість синхронної або асинхронної функції як етап stage."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with metrics.timer(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Запити Prometheus не засмічують bot.log
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Запускає локальний HTTP-ендпоінт /metrics у фоновому потоці."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"📈 Метрики доступні на http://{host}:{port}/metrics")
+    return server
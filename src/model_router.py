@@ -0,0 +1,52 @@
+from src.config import Config
+
+
+class ModelRouter:
+    """
+    Вибір моделі для дзвінка.
+    Короткі записи (до ROUTE_FAST_MAX_SECONDS) спершу йдуть у дешевшу й швидшу
+    модель GEMINI_FAST_MODEL; сильніша GEMINI_MODEL викликається повторно лише
+    тоді, коли перша відповідь сумнівна: оцінка біля порогу корекції,
+    критична помилка або порожня транскрибація. Без GEMINI_FAST_MODEL усі
+    дзвінки аналізує GEMINI_MODEL.
+    """
+
+    FAST, STRONG = "fast", "strong"
+
+    def __init__(self):
+        self.models = {self.STRONG: Config.GEMINI_MODEL, self.FAST: Config.GEMINI_FAST_MODEL or Config.GEMINI_MODEL}
+        self.enabled = bool(Config.GEMINI_FAST_MODEL) and Config.GEMINI_FAST_MODEL != Config.GEMINI_MODEL
+
+        # Ціни ($ за 1 млн токенів) для кожного рівня: (текст, аудіо, кеш, відповідь)
+        self.prices = {
+            self.STRONG: (Config.GEMINI_PRICE_INPUT_PER_M, Config.GEMINI_PRICE_AUDIO_INPUT_PER_M,
+                          Config.GEMINI_PRICE_CACHED_PER_M, Config.GEMINI_PRICE_OUTPUT_PER_M),
+            self.FAST: (Config.GEMINI_FAST_PRICE_INPUT_PER_M, Config.GEMINI_FAST_PRICE_AUDIO_INPUT_PER_M,
+                        Config.GEMINI_FAST_PRICE_CACHED_PER_M, Config.GEMINI_FAST_PRICE_OUTPUT_PER_M),
+        }
+        if not self.enabled:
+            self.prices[self.FAST] = self.prices[self.STRONG]
+
+    def tier_of(self, model: str) -> str:
+        return self.FAST if self.enabled and model == self.models[self.FAST] else self.STRONG
+
+    def choose(self, duration: float) -> str:
+        """Рівень для першого проходу: fast для коротких записів, інакше (або якщо тривалість невідома) — strong."""
+        if self.enabled and duration is not None and duration <= Config.ROUTE_FAST_MAX_SECONDS:
+            return self.FAST
+        return self.STRONG
+
+    @staticmethod
+    def escalation_reason(result) -> str:
+        """Причина повторного аналізу сильнішою моделлю або None, якщо відповідь упевнена."""
+        if result.is_error:
+            return "error"
+        if len(result.transcription.strip()) < Config.ROUTE_MIN_TRANSCRIPT_CHARS:
+            return "empty_transcript"
+        if result.is_critical_fail:
+            return "critical_fail"
+        # Оцінки по обидва боки порогу CRITICAL_CLEAR_SCORE (напр. 6 і 7 при порозі 6 та запасі 1)
+        threshold = Config.CRITICAL_CLEAR_SCORE
+        if threshold - Config.ROUTE_BORDERLINE_MARGIN < result.manager_score <= threshold + Config.ROUTE_BORDERLINE_MARGIN:
+            return "borderline_score"
+        return None
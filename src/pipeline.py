@@ -0,0 +1,236 @@
+import os
+import asyncio
+from src.config import Config
+from src.logger import logger, set_log_context
+from src.metrics import metrics, Histogram
+from src.call_analysis import CallAnalysis
+from src.scheduler import Scheduler, format_wait
+
+
+def apply_score_rules(result: CallAnalysis) -> CallAnalysis:
+    """
+    Логіка корекції оцінки: висока оцінка (> CRITICAL_CLEAR_SCORE) знімає критичну помилку.
+    Застосовується до кожного нового результату і повторно — командою --replay.
+    """
+    if result.manager_score > Config.CRITICAL_CLEAR_SCORE:
+        result.is_critical_fail = False
+        result.critical_comment = ""
+    return result
+
+
+class Pipeline:
+    """
+    Асинхронний конвеєр обробки дзвінків.
+    Складається з трьох етапів (скачування -> аналіз AI -> звіт), з'єднаних
+    обмеженими чергами. Кожен етап має власну кількість воркерів, а блокуючі
+    виклики SDK виконуються у пулі потоків, не зупиняючи цикл подій.
+    """
+
+    def __init__(self, drive, ai, sheets, db, cache=None, preprocessor=None, stop_event=None,
+                 download_workers: int = None, analyze_workers: int = None,
+                 report_workers: int = None, queue_size: int = None):
+        self.drive = drive
+        self.ai = ai
+        self.sheets = sheets
+        self.db = db
+        self.cache = cache
+        self.preprocessor = preprocessor
+        # Сигнал зупинки: нові файли не подаються, а вже взяті доробляються
+        self.stop_event = stop_event
+
+        self.download_workers = download_workers or Config.DOWNLOAD_WORKERS
+        self.analyze_workers = analyze_workers or Config.ANALYZE_WORKERS
+        self.report_workers = report_workers or Config.REPORT_WORKERS
+        self.queue_size = queue_size or Config.QUEUE_SIZE
+
+        self.total = 0
+        self.done = 0
+
+        # Успішно оброблені файли, що чекають пакетного запису в базу
+        self._completed = []
+        # ID файлів, обробка яких завершилась помилкою (для лічильника спроб у JobQueue.lease)
+        self.failed = set()
+        # Зупинка тікера запису: розпочатий запис у базу доробляється, а не скасовується
+        self._stop_flush = asyncio.Event()
+
+    async def run(self, files: list):
+        """
+        Проганяє список файлів через усі етапи конвеєра.
+        Повертає управління, коли всі файли оброблено (успішно чи з помилкою).
+        """
+        self.total = len(files)
+        self.done = 0
+
+        download_queue = asyncio.Queue(maxsize=self.queue_size)
+        analyze_queue = asyncio.Queue(maxsize=self.queue_size)
+        report_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        workers = []
+        workers += [asyncio.create_task(self._download_worker(download_queue, analyze_queue, report_queue))
+                    for _ in range(self.download_workers)]
+        workers += [asyncio.create_task(self._analyze_worker(analyze_queue, report_queue))
+                    for _ in range(self.analyze_workers)]
+        workers += [asyncio.create_task(self._report_worker(report_queue))
+                    for _ in range(self.report_workers)]
+        self._stop_flush.clear()
+        ticker = asyncio.create_task(self._flush_ticker())
+
+        try:
+            # Подаємо файли у першу чергу (блокується, якщо черга заповнена)
+            for file_info in files:
+                if self.stop_event is not None and self.stop_event.is_set():
+                    logger.info("🛑 Зупинка: нові файли не подаються, доробляємо розпочаті...")
+                    break
+                await download_queue.put(file_info)
+
+            # Чекаємо, поки кожен етап спорожніє по черзі
+            await download_queue.join()
+            await analyze_queue.join()
+            await report_queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # Тікер не скасовується: запис, перерваний посеред add_files, пішов би в базу вдруге
+            self._stop_flush.set()
+            await ticker
+
+            # Записуємо в базу (і чергу для таблиці) залишок перед завершенням
+            await self._flush_completed()
+
+    async def _download_worker(self, in_queue: asyncio.Queue, out_queue: asyncio.Queue,
+                               report_queue: asyncio.Queue):
+        """
+        Етап 1: скачування файлу з Google Drive (та попередня обробка аудіо, якщо увімкнена).
+        Якщо такий самий запис (за md5Checksum) вже аналізувався — одразу передає
+        збережений результат на етап звіту без скачування та звернення до AI.
+        """
+        while True:
+            file_info = await in_queue.get()
+            set_log_context(file_id=file_info['id'], stage="download")
+            try:
+                cached = await self._cached_result(file_info.get('md5Checksum'))
+                if cached is not None:
+                    logger.info(f"♻️  {file_info['name']}: результат взято з кешу")
+                    await report_queue.put((file_info, cached))
+                    continue
+
+                local_path = await asyncio.to_thread(
+                    self.drive.download_file, file_info['id'], file_info['name'],
+                    file_info.get('md5Checksum'))
+
+                # Необов'язкова попередня обробка аудіо (моно, частота мовлення, без тиші)
+                mime_type = None
+                if self.preprocessor is not None:
+                    prepared = await self.preprocessor.process(local_path)
+                    local_path, mime_type = prepared['path'], prepared['mime_type']
+
+                await out_queue.put((file_info, local_path, mime_type))
+            except Exception as e:
+                self._fail(file_info, "скачування", e)
+            finally:
+                in_queue.task_done()
+
+    async def _analyze_worker(self, in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+        """Етап 2: аналіз аудіо через Gemini та корекція оцінки."""
+        while True:
+            file_info, local_path, mime_type = await in_queue.get()
+            set_log_context(file_id=file_info['id'], stage="analyze")
+            try:
+                # Хеш вмісту: з Drive або локальний (якщо Drive його не надав)
+                content_hash = file_info.get('md5Checksum')
+                if not content_hash and self.cache is not None:
+                    content_hash = await asyncio.to_thread(self.cache.local_md5, local_path)
+                    result = await self._cached_result(content_hash)
+                    if result is not None:
+                        await out_queue.put((file_info, result))
+                        continue
+
+                result = await asyncio.to_thread(self.ai.analyze_call, local_path, mime_type)
+                if self.cache is not None:
+                    await self.cache.put(content_hash, result)
+
+                await out_queue.put((file_info, apply_score_rules(result)))
+            except Exception as e:
+                self._fail(file_info, "аналізу", e)
+            finally:
+                self._remove_local(local_path)
+                in_queue.task_done()
+
+    async def _report_worker(self, in_queue: asyncio.Queue):
+        """Етап 3: підготовка рядка для таблиці та фіксація успіху (пачками в базу)."""
+        while True:
+            file_info, result = await in_queue.get()
+            set_log_context(file_id=file_info['id'], stage="report")
+            try:
+                # Рядок для таблиці потрапляє в чергу (outbox) разом із записом у базу;
+                # у Google Sheets його відправляє окремий SheetsOutbox
+                entry = self.sheets.build_entry(file_info['name'], result, file_id=file_info['id'])
+                self._completed.append((file_info, result, entry))
+
+                self.done += 1
+                metrics.inc("files_processed_total")
+                # Час від появи запису в Drive до готового результату
+                insight = Scheduler.time_to_insight(file_info)
+                if insight is not None:
+                    metrics.observe("time_to_insight_seconds", insight, buckets=Histogram.WAIT_BUCKETS)
+                waited = f", у черзі {format_wait(file_info['queue_wait'])}" if 'queue_wait' in file_info else ""
+                logger.info(f"[{self.done}/{self.total}] ✅ Готово: {file_info['name']}. "
+                            f"Оцінка: {result.manager_score}{waited}")
+            except Exception as e:
+                self._fail(file_info, "запису результатів", e)
+            finally:
+                in_queue.task_done()
+
+    async def _cached_result(self, content_hash: str) -> CallAnalysis:
+        """Шукає готовий результат у кеші аналізів (з уже застосованою корекцією)."""
+        if self.cache is None:
+            return None
+        result = await self.cache.get(content_hash)
+        return apply_score_rules(result) if result is not None else None
+
+    async def _flush_ticker(self):
+        """
+        Щосекунди записує пачку готових результатів у базу (збій запису не зупиняє тікер),
+        доки не встановлено _stop_flush; розпочатий запис при цьому завершується.
+        """
+        while not self._stop_flush.is_set():
+            try:
+                await asyncio.wait_for(self._stop_flush.wait(), timeout=1)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self._flush_completed()
+            except Exception as e:
+                logger.error(f"❌ Не вдалося записати {len(self._completed)} результатів у базу "
+                             f"(повтор через 1 с): {e}")
+
+    async def _flush_completed(self):
+        """
+        Записує накопичені успішні файли в базу та чергу для таблиці однією транзакцією.
+        Пачка прибирається з _completed лише після успішного запису, тож при збої
+        вона буде записана наступним викликом разом із новими результатами.
+        """
+        batch = list(self._completed)
+        if not batch:
+            return
+        await self.db.add_files(batch)
+        # Поки йшов запис, воркери могли додати нові результати — вони лишаються
+        del self._completed[:len(batch)]
+
+    def _fail(self, file_info: dict, stage: str, error: Exception):
+        """Фіксує помилку обробки файлу на певному етапі."""
+        self.done += 1
+        self.failed.add(file_info['id'])
+        metrics.inc("files_failed_total", stage=stage)
+        logger.error(f"[{self.done}/{self.total}] ❌ Помилка {stage} {file_info['name']}: {error}")
+
+    @staticmethod
+    def _remove_local(local_path: str):
+        """Видаляє локальну копію аудіофайлу, якщо вона залишилась."""
+        if local_path and os.path.exists(local_path):
+            try:
+                os.remove(local_path)
+            except OSError:
+                pass
@@ -0,0 +1,170 @@
+import re
+import time
+import random
+import threading
+from src.config import Config
+from src.logger import logger
+from src.metrics import metrics
+
+
+def _status_code(error: Exception) -> int:
+    """Дістає HTTP-код із помилок googleapiclient (HttpError) та google-genai (APIError)."""
+    resp = getattr(error, 'resp', None)
+    if resp is not None and getattr(resp, 'status', None):
+        return int(resp.status)
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code
+    # Запасний варіант: шукаємо код у тексті помилки
+    if "429" in str(error) or "quota" in str(error).lower():
+        return 429
+    return 0
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Помилка перевищення квоти (429 Too Many Requests / RESOURCE_EXHAUSTED)."""
+    return _status_code(error) == 429
+
+
+def is_transient(error: Exception) -> bool:
+    """Тимчасова помилка, яку варто повторити (429, 5xx, мережа)."""
+    status = _status_code(error)
+    return status == 429 or status >= 500 or isinstance(error, (ConnectionError, TimeoutError))
+
+
+def retry_after_seconds(error: Exception) -> float:
+    """
+    Повертає рекомендовану сервером паузу (секунди) або None.
+    Враховує заголовок Retry-After (Drive/Sheets) та RetryInfo.retryDelay (Gemini).
+    """
+    resp = getattr(error, 'resp', None)
+    if resp is not None:
+        value = resp.get('retry-after') if hasattr(resp, 'get') else None
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+
+    # Gemini: {"error": {"details": [{"@type": "...RetryInfo", "retryDelay": "37s"}]}}
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(getattr(error, 'details', '')) + str(error))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Експоненційна затримка з повним джитером (full jitter)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class AdaptiveRateLimiter:
+    """
+    Адаптивний обмежувач частоти запитів (token bucket) для одного API.
+    Спільний для всіх воркерів: кожен виклик бере токен, а кожна відповідь 429
+    вдвічі зменшує швидкість та враховує Retry-After. Успішні виклики поступово
+    повертають швидкість до налаштованого максимуму (AIMD).
+    """
+
+    def __init__(self, name: str, rate_per_minute: float, burst: float = None):
+        self.name = name
+        self.max_rate = rate_per_minute / 60.0
+        self.min_rate = self.max_rate / 20
+        self.rate = self.max_rate
+        self.capacity = burst or max(1.0, self.max_rate)
+
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+        # Лічильники для звітності
+        self.throttled = 0
+        self.retries = 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, cancel: threading.Event = None):
+        """
+        Блокує потік, доки не з'явиться вільний токен і не мине пауза після 429.
+        Встановлений cancel перериває очікування (TimeoutError) — напр. при завершенні роботи.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            self._sleep(wait, cancel)
+
+    def on_success(self):
+        """Адитивне збільшення швидкості після успішного виклику."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def on_throttle(self, retry_after: float = None):
+        """Мультиплікативне зменшення швидкості після 429 та пауза для всіх воркерів."""
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate * 0.5)
+            self.tokens = 0
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        metrics.inc("api_throttled_total", api=self.name)
+
+    def _sleep(self, seconds: float, cancel: threading.Event = None):
+        """Пауза, яку перериває cancel (TimeoutError)."""
+        if cancel is None:
+            time.sleep(seconds)
+        elif cancel.wait(seconds):
+            raise TimeoutError(f"{self.name}: очікування ліміту запитів перервано")
+
+    def call(self, func, *args, cancel: threading.Event = None, **kwargs):
+        """
+        Виконує блокуючий виклик API з дотриманням ліміту.
+        Тимчасові помилки повторюються з джитером (не більше RATE_LIMIT_MAX_RETRIES разів).
+        Встановлений cancel перериває очікування токена та паузи між повторами (TimeoutError),
+        навіть якщо очікування почалось раніше.
+        """
+        max_retries = Config.RATE_LIMIT_MAX_RETRIES
+        for attempt in range(max_retries + 1):
+            self.acquire(cancel)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e) or attempt == max_retries:
+                    raise
+                retry_after = retry_after_seconds(e)
+                if is_rate_limited(e):
+                    self.on_throttle(retry_after)
+                self.retries += 1
+                metrics.inc("api_retries_total", api=self.name)
+                delay = max(retry_after or 0, backoff_delay(attempt))
+                logger.warning(f"⚠️ {self.name}: тимчасова помилка ({_status_code(e) or e}). "
+                               f"Повтор через {delay:.1f} с (спроба {attempt + 1}/{max_retries})...")
+                self._sleep(delay, cancel)
+                continue
+
+            self.on_success()
+            return result
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> AdaptiveRateLimiter:
+    """Повертає спільний обмежувач для API ("gemini", "drive", "sheets")."""
+    rates = {
+        "gemini": Config.GEMINI_RPM,
+        "drive": Config.DRIVE_RPM,
+        "sheets": Config.SHEETS_RPM,
+    }
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveRateLimiter(name, rates[name])
+        return _limiters[name]
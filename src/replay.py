@@ -0,0 +1,82 @@
+import json
+import time
+import asyncio
+from datetime import datetime
+from pydantic import ValidationError
+from src.logger import logger
+from src.call_analysis import CallAnalysis
+from src.pipeline import apply_score_rules
+from src.transcript_search import decompress_text
+
+
+def restore_result(raw_blob: bytes, transcript_blob: bytes = None) -> CallAnalysis:
+    """
+    Результат аналізу зі збереженої відповіді моделі з поточними правилами корекції.
+    Кидає json.JSONDecodeError або pydantic.ValidationError, якщо відповідь не розбирається.
+    """
+    result = CallAnalysis.parse(decompress_text(raw_blob))
+    # Сегментований аналіз оцінює готовий текст: транскрибація береться з бази
+    if not result.transcription and transcript_blob:
+        result.transcription = decompress_text(transcript_blob)
+    return apply_score_rules(result)
+
+
+class Replay:
+    """
+    Повторне застосування правил корекції до збережених відповідей моделі (--replay).
+    Відповіді розбираються заново (поточні валідатори CallAnalysis), до них
+    застосовується apply_score_rules з поточної конфігурації, після чого пачками
+    перезаписуються база (call_results, processed_files, sheets_outbox) і таблиця.
+    Жодних звернень до Gemini.
+    """
+
+    CHUNK = 2000
+
+    def __init__(self, db, sheets):
+        self.db = db
+        self.sheets = sheets
+
+    async def run(self) -> dict:
+        """Повертає статистику: replayed, failed, unreplayable, sheet_rows."""
+        started = time.perf_counter()
+        stats = {'replayed': 0, 'failed': 0, 'unreplayable': 0, 'sheet_rows': 0}
+        entries = {}
+
+        after = 0
+        while True:
+            rows = await self.db.fetch_raw_outputs(after, self.CHUNK)
+            if not rows:
+                break
+            after = rows[-1][0]
+
+            records = [record for record in map(self._replay_row, rows) if record is not None]
+            stats['failed'] += len(rows) - len(records)
+            stats['replayed'] += len(records)
+            await self.db.apply_replay(records)
+            entries.update((info['id'], (info['name'], entry)) for info, _, entry, _ in records)
+            logger.info(f"🔁 Повторно оцінено {stats['replayed']} дзвінків...")
+
+        stats['unreplayable'] = await self.db.count_unreplayable()
+        if stats['unreplayable']:
+            logger.warning(f"⚠️ {stats['unreplayable']} результатів оброблено до збереження відповідей моделі — "
+                           f"вони лишаються без змін.")
+
+        if entries:
+            stats['sheet_rows'] = await asyncio.to_thread(self.sheets.rewrite_rows, entries)
+
+        logger.info(f"✅ Повторний прогін за {time.perf_counter() - started:.1f} с: {stats['replayed']} дзвінків, "
+                    f"помилок розбору {stats['failed']}, оновлено рядків таблиці {stats['sheet_rows']}.")
+        return stats
+
+    def _replay_row(self, row: tuple) -> tuple:
+        """(file_info, CallAnalysis, запис для таблиці, processed_at) або None, якщо відповідь не розбирається."""
+        _, info_json, raw_blob, transcript_blob, processed_at = row
+        file_info = json.loads(info_json)
+        try:
+            result = restore_result(raw_blob, transcript_blob)
+        except (json.JSONDecodeError, ValidationError) as e:
+            logger.warning(f"⚠️ {file_info['name']}: збережену відповідь не вдалося розібрати: {e}")
+            return None
+
+        processed = datetime.fromisoformat(processed_at) if processed_at else datetime.now()
+        return file_info, result, self.sheets.build_entry(file_info['name'], result, processed, file_info['id']), processed
@@ -0,0 +1,88 @@
+import time
+from datetime import datetime
+from src.config import Config
+from src.call_analysis import parse_call_name
+
+
+POLICIES = ("fifo", "newest", "sjf")
+
+
+def drive_timestamp(value: str) -> float:
+    """Час Drive у форматі RFC 3339 ("2025-03-01T09:15:00.000Z") -> секунди epoch; None, якщо немає."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def format_wait(seconds: float) -> str:
+    """Коротке подання тривалості очікування для логу."""
+    if seconds < 60:
+        return f"{seconds:.0f} с"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} хв"
+    return f"{seconds / 3600:.1f} год"
+
+
+class Scheduler:
+    """
+    Порядок, у якому задачі забираються з черги (таблиця jobs).
+    Політики: fifo — як знайдено, newest — спершу найсвіжіші дзвінки,
+    sjf — спершу найкоротші записи. З SCHEDULE_FAIR_SHARE задачі різних філій
+    чергуються, щоб великий архів однієї філії не затримував інші.
+    Старіння: "вартість" задачі зменшується з часом очікування, а задачі,
+    що чекають довше за SCHEDULE_MAX_WAIT, ідуть першими за будь-якої політики.
+    Саме впорядкування виконується в SQL (Database.claim_jobs), тож кілька
+    екземплярів бота бачать однаковий порядок.
+    """
+
+    # Тривалість запису, якщо її не вдалося ні отримати, ні оцінити за розміром
+    UNKNOWN_DURATION = 3600.0
+
+    def __init__(self, policy: str = None, fair_share: bool = None,
+                 aging_seconds: float = None, max_wait: float = None):
+        self.policy = (policy or Config.SCHEDULE_POLICY).lower()
+        if self.policy not in POLICIES:
+            raise ValueError(f"Невідома політика черги '{self.policy}' (доступні: {', '.join(POLICIES)})")
+        self.fair_share = Config.SCHEDULE_FAIR_SHARE if fair_share is None else fair_share
+        self.aging_seconds = max(1.0, aging_seconds or Config.SCHEDULE_AGING_SECONDS)
+        self.max_wait = Config.SCHEDULE_MAX_WAIT if max_wait is None else max_wait
+
+    @staticmethod
+    def estimate_duration(file_info: dict) -> float:
+        """Тривалість запису (с): з метаданих Drive, інакше оцінка за розміром файлу."""
+        if file_info.get('durationMillis'):
+            return int(file_info['durationMillis']) / 1000
+        if file_info.get('size'):
+            return int(file_info['size']) / Config.SCHEDULE_BYTES_PER_SECOND
+        return Scheduler.UNKNOWN_DURATION
+
+    def job_fields(self, file_info: dict) -> tuple:
+        """
+        Поля задачі для впорядкування: (час створення дзвінка, тривалість, філія).
+        Без createdTime дзвінок вважається створеним у момент постановки в чергу.
+        """
+        created = drive_timestamp(file_info.get('createdTime'))
+        return created, self.estimate_duration(file_info), parse_call_name(file_info['name'])['branch']
+
+    def claim_options(self) -> dict:
+        """Параметри впорядкування для Database.claim_jobs."""
+        return {
+            'policy': self.policy,
+            'fair_share': self.fair_share,
+            'aging_seconds': self.aging_seconds,
+            'max_wait': self.max_wait,
+        }
+
+    def describe(self) -> str:
+        fair = ", почергово між філіями" if self.fair_share else ""
+        return f"{self.policy}{fair}, старіння {format_wait(self.aging_seconds)}, " \
+               f"ліміт очікування {format_wait(self.max_wait)}"
+
+    @staticmethod
+    def time_to_insight(file_info: dict) -> float:
+        """Секунди від створення запису в Drive до готового результату; None, якщо час створення невідомий."""
+        created = drive_timestamp(file_info.get('createdTime'))
+        return max(0.0, time.time() - created) if created else None
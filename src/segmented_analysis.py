@@ -0,0 +1,123 @@
+import os
+import re
+import math
+import difflib
+from concurrent.futures import ThreadPoolExecutor
+from src.config import Config
+from src.logger import logger
+from src.metrics import metrics
+from src.audio_preprocessor import probe_duration, split_audio
+
+
+_TOKEN = re.compile(r"\S+\s*")
+
+
+def _normalize(token: str) -> str:
+    return re.sub(r"[^\w]", "", token.lower())
+
+
+def merge_transcripts(parts: list, window: int = 120, min_match: int = 4) -> str:
+    """
+    Склеює транскрибації сусідніх сегментів, що перекриваються.
+    Шукає найдовший спільний фрагмент між кінцем попереднього тексту й
+    початком наступного (без урахування регістру та розділових знаків)
+    і відкидає повтор. Без збігу тексти просто з'єднуються.
+    """
+    merged = []
+    for part in parts:
+        tokens = _TOKEN.findall(part.strip())
+        if not tokens:
+            continue
+        if merged:
+            tail = [_normalize(t) for t in merged[-window:]]
+            head = [_normalize(t) for t in tokens[:window]]
+            match = difflib.SequenceMatcher(None, tail, head, autojunk=False) \
+                .find_longest_match(0, len(tail), 0, len(head))
+            if match.size >= min_match:
+                cut = len(merged) - len(tail) + match.a + match.size
+                merged = merged[:cut]
+                tokens = tokens[match.b + match.size:]
+            if merged and not merged[-1][-1:].isspace():
+                merged[-1] += " "
+        merged.extend(tokens)
+    return "".join(merged).strip()
+
+
+class SegmentedAnalyzer:
+    """
+    Аналіз довгих записів (понад SEGMENT_MIN_DURATION або SEGMENT_MAX_BYTES).
+    Запис ділиться на сегменти з перекриттям, які транскрибуються паралельно,
+    після чого один текстовий запит оцінює склеєну транскрибацію за тією самою
+    схемою CallAnalysis. Так жоден запит не обробляє 40 хвилин аудіо цілком,
+    а збій одного сегмента не перетворює весь дзвінок на рядок з помилкою.
+    """
+
+    # Менші файли точно коротші за поріг — тривалість навіть не перевіряємо
+    PROBE_MIN_BYTES = 256 * 1024
+
+    def __init__(self, ai):
+        self.ai = ai
+        self.enabled = Config.SEGMENT_LONG_CALLS
+        self._pool = ThreadPoolExecutor(max_workers=Config.SEGMENT_WORKERS, thread_name_prefix="segment")
+
+    def plan(self, audio_path: str) -> tuple:
+        """
+        Повертає (тривалість, кількість сегментів); сегментів 0 — якщо ділити не потрібно.
+        Кількість визначається тривалістю (SEGMENT_SECONDS) або розміром (SEGMENT_MAX_BYTES).
+        """
+        if not self.enabled:
+            return None, 0
+        size = os.path.getsize(audio_path)
+        if size < self.PROBE_MIN_BYTES:
+            return None, 0
+
+        duration = probe_duration(audio_path)
+        if not duration:
+            return None, 0
+        if duration < Config.SEGMENT_MIN_DURATION and size < Config.SEGMENT_MAX_BYTES:
+            return duration, 0
+
+        count = max(math.ceil(duration / Config.SEGMENT_SECONDS), math.ceil(size / Config.SEGMENT_MAX_BYTES))
+        return duration, count if count > 1 else 0
+
+    def analyze(self, audio_path: str, duration: float, count: int):
+        """Сегментований аналіз: паралельна транскрибація, склейка, одна оцінка. Повертає CallAnalysis."""
+        overlap = Config.SEGMENT_OVERLAP
+        segment_seconds = duration / count + overlap
+        segments = split_audio(audio_path, segment_seconds, overlap, duration)
+        if not segments:
+            raise RuntimeError("не вдалося поділити запис на сегменти (потрібен ffmpeg або WAV)")
+
+        logger.info(f"✂️  {os.path.basename(audio_path)}: {duration / 60:.0f} хв -> {len(segments)} сегментів")
+        metrics.inc("segmented_calls_total")
+        try:
+            parts = list(self._pool.map(lambda item: self._transcribe(*item), enumerate(segments)))
+        finally:
+            for seg_path, _ in segments:
+                if os.path.exists(seg_path):
+                    os.remove(seg_path)
+
+        if all(part is None for part in parts):
+            raise RuntimeError("жоден сегмент не вдалося транскрибувати")
+        transcript = merge_transcripts(
+            part[0] if part is not None else f"[фрагмент {i + 1} не розпізнано]" for i, part in enumerate(parts)
+        )
+
+        result = self.ai.score_transcript(transcript)
+        if not result.is_error:
+            result.transcription = transcript
+        result.ai_cost_usd += sum(part[1] for part in parts if part is not None)
+        return result
+
+    def _transcribe(self, index: int, segment: tuple) -> tuple:
+        """Транскрибація одного сегмента: (текст, вартість) або None, якщо всі спроби невдалі."""
+        seg_path, mime_type = segment
+        try:
+            return self.ai.transcribe_segment(seg_path, mime_type)
+        except Exception as e:
+            metrics.inc("segment_failures_total")
+            logger.warning(f"⚠️ Сегмент {index + 1} ({os.path.basename(seg_path)}) не транскрибовано: {e}")
+            return None
+
+    def close(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,140 @@
+import json
+import time
+import asyncio
+from datetime import datetime
+from pydantic import ValidationError
+from src.config import Config
+from src.logger import logger
+from src.call_analysis import CallAnalysis, KPI_FIELDS
+from src.pipeline import apply_score_rules
+from src.replay import restore_result
+from src.transcript_search import decompress_text
+
+
+class SheetRebuild:
+    """
+    Повна перебудова аркуша з локальної бази (--rebuild-sheet), напр. після втрати даних
+    або для нового аркуша (SHEET_NAME). Рядки читаються з бази пачками по READ_CHUNK і
+    записуються блоками одним запитом values().update; розмір блоку обмежує
+    SHEETS_REBUILD_MAX_BYTES, а підсвічування задають правила аркуша, тож 50 тис. рядків —
+    кілька десятків запитів замість тисяч.
+    Рядки будуються зі збережених відповідей моделі з поточними правилами корекції і,
+    як у --replay, спершу записуються в базу; для дзвінків, оброблених до збереження
+    відповідей, — з call_results (без коментаря).
+    """
+
+    READ_CHUNK = 2000
+
+    def __init__(self, db, sheets, max_bytes: int = None):
+        self.db = db
+        self.sheets = sheets
+        self.max_bytes = max_bytes or Config.SHEETS_REBUILD_MAX_BYTES
+        self._block, self._block_ids, self._block_bytes = [], [], 0
+        self._first_row = 1
+
+    async def run(self) -> dict:
+        """
+        Повертає статистику: rows, from_results (без збереженої відповіді), requests (запитів запису),
+        discarded (прибрано рядків з outbox).
+        """
+        started = time.perf_counter()
+        stats = {'rows': 0, 'from_results': 0, 'requests': 0, 'discarded': 0}
+
+        # Межа перебудови фіксується на старті: пізніші результати запише outbox
+        total, until = await self.db.sheet_rows_snapshot()
+        await asyncio.to_thread(self.sheets.start_rebuild, total)
+        logger.info(f"🧱 Перебудова аркуша '{self.sheets.sheet_name}': {total} рядків "
+                    f"блоками до {self.max_bytes // 1000} КБ...")
+
+        # Шапка йде першим рядком першого блоку
+        self._block, self._block_ids = [self.sheets.HEADERS], []
+        self._block_bytes, self._first_row = self._size(self.sheets.HEADERS), 1
+        after = None
+        while until is not None:
+            rows = await self.db.fetch_sheet_rows(after, until, self.READ_CHUNK)
+            if not rows:
+                break
+            after = (rows[-1]['sort_key'], rows[-1]['file_id'])
+
+            records = []
+            for record in rows:
+                result, restored = self._result(record)
+                stats['from_results'] += not restored
+                info = self._file_info(record)
+                processed = self._processed(record)
+                records.append((info, result, self.sheets.build_entry(info['name'], result, processed, info['id']),
+                                processed))
+            # Перераховані результати спершу потрапляють у базу — таблиця не випереджає її
+            await self.db.apply_replay(records)
+
+            for info, _, row, _ in records:
+                size = self._size(row)
+                if self._block_bytes + size > self.max_bytes and self._block:
+                    stats['discarded'] += await self._write_block(stats)
+                self._block.append(row)
+                self._block_ids.append(info['id'])
+                self._block_bytes += size
+            stats['rows'] += len(records)
+            logger.info(f"🧱 Підготовлено {stats['rows']}/{total} рядків...")
+
+        if self._block:
+            stats['discarded'] += await self._write_block(stats)
+
+        if stats['discarded']:
+            logger.info(f"🧹 Прибрано з черги відправки {stats['discarded']} рядків, що вже є в таблиці.")
+        if stats['from_results']:
+            logger.warning(f"⚠️ {stats['from_results']} дзвінків оброблено до збереження відповідей моделі — "
+                           f"їх рядки відновлено з результатів без коментаря.")
+
+        logger.info(f"✅ Аркуш перебудовано за {time.perf_counter() - started:.1f} с: {stats['rows']} рядків, "
+                    f"{stats['requests']} запитів запису.")
+        return stats
+
+    async def _write_block(self, stats: dict) -> int:
+        """
+        Записує накопичений блок одним запитом і прибирає з outbox рядки саме цих дзвінків
+        (вони вже в таблиці — черга записала б їх удруге). Повертає кількість прибраних рядків.
+        """
+        await asyncio.to_thread(self.sheets.write_block, self._first_row, self._block)
+        stats['requests'] += 1
+        discarded = await self.db.discard_outbox(self._block_ids)
+        self._first_row += len(self._block)
+        self._block, self._block_ids, self._block_bytes = [], [], 0
+        return discarded
+
+    @staticmethod
+    def _size(row: list) -> int:
+        """Приблизний розмір рядка в тілі запиту (JSON, UTF-8)."""
+        return len(json.dumps(row, ensure_ascii=False).encode()) + 1
+
+    @staticmethod
+    def _file_info(record: dict) -> dict:
+        """Дані файлу з Drive (збережені разом із відповіддю моделі) або відновлені з call_results."""
+        if record['file_info']:
+            return json.loads(record['file_info'])
+        return {'id': record['file_id'], 'name': record['file_name'],
+                'createdTime': f"{record['call_date']}T00:00:00Z"}
+
+    @staticmethod
+    def _result(record: dict) -> tuple:
+        """(CallAnalysis, чи відновлено зі збереженої відповіді моделі)."""
+        if record['raw_response']:
+            try:
+                return restore_result(record['raw_response'], record['transcript']), True
+            except (json.JSONDecodeError, ValidationError) as e:
+                logger.warning(f"⚠️ {record['file_name']}: збережену відповідь не вдалося розібрати: {e}")
+
+        result = CallAnalysis(
+            service_type=record['service_type'], result=record['result'],
+            manager_score=record['manager_score'], is_critical_fail=bool(record['is_critical_fail']),
+            transcription=decompress_text(record['transcript']) if record['transcript'] else "",
+            **{name: record[name] for name in KPI_FIELDS},
+        )
+        return apply_score_rules(result), False
+
+    @staticmethod
+    def _processed(record: dict) -> datetime:
+        """Дата рядка: час обробки, а якщо його немає — дата дзвінка."""
+        if record['processed_at']:
+            return datetime.fromisoformat(record['processed_at'])
+        return datetime.fromisoformat(record['call_date'])
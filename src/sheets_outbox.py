@@ -0,0 +1,106 @@
+import time
+import asyncio
+import threading
+from src.config import Config
+from src.logger import logger
+from src.metrics import metrics
+from src.rate_limiter import backoff_delay
+
+
+class SheetsOutbox:
+    """
+    Відправник рядків із локальної черги (таблиця sheets_outbox) у Google Sheets.
+    Працює окремою задачею: конвеєр лише додає рядки в базу разом з позначкою
+    "оброблено", тож повільна чи недоступна таблиця не гальмує аналіз, а рядки
+    переживають перезапуск. Пачка надсилається, коли набирається SHEETS_BATCH_SIZE
+    рядків або найстаріший чекає довше за SHEETS_FLUSH_INTERVAL; після збою
+    пачка відкладається з експоненційною паузою і ніколи не відкидається.
+    """
+
+    TICK = 1.0
+
+    def __init__(self, sheets, db):
+        self.sheets = sheets
+        self.db = db
+        self.batch_size = Config.SHEETS_BATCH_SIZE
+        self.flush_interval = Config.SHEETS_FLUSH_INTERVAL
+        self.lease_seconds = Config.SHEETS_OUTBOX_LEASE
+        self._stop_event = asyncio.Event()
+        # Перериває запис, що чекає в обмежувачі (пауза після 429), коли вичерпано час на завершення
+        self._cancel = threading.Event()
+        self._task = None
+
+    def start(self):
+        """Запускає фоновий відправник."""
+        self._cancel.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, drain_timeout: float = None):
+        """
+        Зупиняє фоновий відправник і намагається відправити все, що лишилось
+        (не довше drain_timeout секунд). Невідправлене чекає наступного запуску.
+        Час рахується від виклику stop(): запис фонового відправника, що вже чекає
+        в обмежувачі, теж переривається — його рядки лишаються в черзі.
+        """
+        timeout = Config.SHEETS_DRAIN_TIMEOUT if drain_timeout is None else drain_timeout
+        self._cancel.clear()
+        timer = asyncio.get_running_loop().call_later(timeout, self._cancel.set)
+        self._stop_event.set()
+        try:
+            if self._task is not None:
+                await self._task
+                self._task = None
+
+            while not self._cancel.is_set():
+                sent = await self.flush_once()
+                if sent <= 0:
+                    break
+        finally:
+            timer.cancel()
+
+        _, _, pending = await self.db.outbox_status()
+        if pending:
+            logger.warning(f"⚠️ У черзі для таблиці лишилось {pending} рядків — їх буде відправлено наступного запуску.")
+
+    async def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                if await self._is_due():
+                    await self.flush_once()
+                    continue
+            except Exception as e:
+                logger.error(f"❌ Помилка черги Google Sheets: {e}")
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=self.TICK)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _is_due(self) -> bool:
+        pending, oldest, _ = await self.db.outbox_status()
+        if not pending:
+            return False
+        return pending >= self.batch_size or time.time() - oldest >= self.flush_interval
+
+    async def flush_once(self) -> int:
+        """
+        Відправляє одну пачку. Повертає кількість записаних рядків,
+        0 — якщо черга порожня, -1 — якщо запис не вдався (зокрема перерваний при завершенні).
+        """
+        claimed = await self.db.claim_outbox(self.batch_size, self.lease_seconds)
+        if not claimed:
+            return 0
+
+        ids = [row_id for row_id, _, _ in claimed]
+        try:
+            await asyncio.to_thread(self.sheets.write_rows, [entry for _, entry, _ in claimed], self._cancel)
+        except Exception as e:
+            attempts = max(attempts for _, _, attempts in claimed)
+            await self.db.defer_outbox(ids, max(self.TICK, backoff_delay(attempts, base=5, cap=300)))
+            metrics.inc("sheets_outbox_failures_total")
+            logger.error(f"❌ Не вдалося записати {len(ids)} рядків у Google Sheets (спроба {attempts}): {e}. "
+                         f"Рядки лишаються в черзі.")
+            return -1
+
+        await self.db.ack_outbox(ids)
+        metrics.inc("sheets_rows_written_total", len(ids))
+        return len(ids)
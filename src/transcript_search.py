@@ -0,0 +1,70 @@
+import re
+import zlib
+
+
+# Оператори синтаксису FTS5, які не є словами для пошуку
+_FTS_OPERATORS = {"AND", "OR", "NOT", "NEAR"}
+
+
+def compress_text(text: str) -> bytes:
+    """Стискає транскрибацію для зберігання в базі (zlib, ~3-5x для тексту)."""
+    return zlib.compress(text.encode("utf-8"), 6)
+
+
+def decompress_text(blob: bytes) -> str:
+    return zlib.decompress(blob).decode("utf-8")
+
+
+class TranscriptSearch:
+    """
+    Повнотекстовий пошук по транскрибаціях (команда --search).
+    Текст зберігається стиснутим у call_transcripts, а індекс FTS5 без вмісту
+    (contentless) тримає лише слова, тож база не зберігає текст двічі.
+    Ранжування — bm25 всередині SQLite; фрагменти з підсвіченими словами
+    будуються лише для кількох найкращих результатів.
+    """
+
+    SNIPPET_RADIUS = 90
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def _terms(query: str) -> list:
+        """Слова запиту без операторів FTS5 (префікс "гаранті*" -> "гаранті")."""
+        words = re.findall(r"\w+", query)
+        return [w.lower() for w in words if w.upper() not in _FTS_OPERATORS]
+
+    def snippet(self, text: str, terms: list) -> str:
+        """Фрагмент навколо першого збігу; знайдені слова виділяються «...»."""
+        if not terms:
+            return text[:self.SNIPPET_RADIUS * 2]
+        pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, terms)) + r")\w*", re.IGNORECASE)
+        match = pattern.search(text)
+        if match is None:
+            return text[:self.SNIPPET_RADIUS * 2]
+
+        start = max(0, match.start() - self.SNIPPET_RADIUS)
+        end = min(len(text), match.end() + self.SNIPPET_RADIUS)
+        fragment = pattern.sub(lambda m: f"«{m.group(0)}»", text[start:end])
+        return ("…" if start else "") + fragment.replace("\n", " ") + ("…" if end < len(text) else "")
+
+    async def search(self, query: str, limit: int = 20) -> list:
+        """
+        Шукає дзвінки за запитом FTS5 (слова, "фрази", префікси*, AND/OR/NOT).
+        Повертає список словників із метаданими дзвінка, рангом та фрагментом.
+        """
+        terms = self._terms(query)
+        results = []
+        for row in await self.db.search_transcripts(query, limit):
+            file_id, file_name, call_date, manager, manager_score, rank, blob = row
+            results.append({
+                "file_id": file_id,
+                "file_name": file_name,
+                "call_date": call_date,
+                "manager": manager,
+                "manager_score": manager_score,
+                "rank": round(-rank, 2),
+                "snippet": self.snippet(decompress_text(blob), terms),
+            })
+        return results
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Налаштування до імпорту src: лог поза репозиторієм, без очікування обмежувачів API
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.gettempdir(), "callanalyzer-tests.log"))
+for name in ("GEMINI_RPM", "DRIVE_RPM", "SHEETS_RPM"):
+    os.environ.setdefault(name, "60000")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
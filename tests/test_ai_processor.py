@@ -0,0 +1,67 @@
+import pytest
+
+from benchmarks.fakes import ApiCounter, FakeGenaiClient, Profile
+from src.ai_processor import AIProcessor
+from src.config import Config
+
+
+@pytest.fixture
+def audio(tmp_path):
+    path = tmp_path / "call.mp3"
+    path.write_bytes(b"ID3" + bytes(4096))
+    return str(path)
+
+
+def make_ai(monkeypatch, counter):
+    monkeypatch.setattr(Config, "GEMINI_FAST_MODEL", "")
+    return AIProcessor(client=FakeGenaiClient(Profile(), Profile(), counter))
+
+
+def test_instructions_are_cached_once_and_every_upload_is_deleted(monkeypatch, audio):
+    counter = ApiCounter()
+    ai = make_ai(monkeypatch, counter)
+    configs = []
+    generate = ai.client.models.generate_content
+
+    def recording_generate(model, contents, config=None):
+        configs.append(config)
+        return generate(model, contents, config)
+
+    ai.client.models.generate_content = recording_generate
+
+    results = [ai.analyze_call(audio) for _ in range(3)]
+    ai.close()
+
+    assert not any(result.is_error for result in results)
+    assert counter.calls["gemini.caches.create"] == 1
+    # Запити посилаються на кешований контекст, а не повторюють текст промпту
+    assert all(c.cached_content == "cachedContents/fake" and c.system_instruction is None for c in configs)
+    assert counter.calls["gemini.files.upload"] == counter.calls["gemini.files.delete"] == 3
+    assert counter.calls["gemini.caches.delete"] == 1
+
+
+def test_unsupported_context_cache_falls_back_and_failed_call_still_cleans_up(monkeypatch, audio):
+    counter = ApiCounter()
+    ai = make_ai(monkeypatch, counter)
+
+    def reject(**kwargs):
+        counter.hit("gemini.caches.create")
+        raise ValueError("400 cached content is too small")
+
+    configs = []
+
+    def fail(model, contents, config=None):
+        configs.append(config)
+        raise PermissionError("403 API key not valid")
+
+    ai.client.caches.create = reject
+    ai.client.models.generate_content = fail
+
+    first, second = ai.analyze_call(audio), ai.analyze_call(audio)
+    ai.close()
+
+    assert first.is_error and second.is_error
+    assert all(c.cached_content is None and c.system_instruction == ai.prompt for c in configs)
+    # Після постійної помилки кешування більше не пробується
+    assert counter.calls["gemini.caches.create"] == 1
+    assert counter.calls["gemini.files.upload"] == counter.calls["gemini.files.delete"] == 2
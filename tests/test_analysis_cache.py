@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from benchmarks.fakes import ApiCounter, FakeDrive, FakeGenaiClient, FakeSheetsAPI, Profile
+from src.ai_processor import AIProcessor
+from src.analysis_cache import AnalysisCache
+from src.call_analysis import CallAnalysis
+from src.config import Config
+from src.database import Database
+from src.google_sheets import SheetsService
+from src.pipeline import Pipeline
+
+
+def test_copy_of_analyzed_recording_is_not_sent_to_gemini_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "TEMP_FOLDER", str(tmp_path / "audio"))
+    counter = ApiCounter()
+    drive = FakeDrive(2, Profile(), counter, file_size=1024)
+    ai = AIProcessor(client=FakeGenaiClient(Profile(), Profile(), counter))
+    sheets = SheetsService(service=FakeSheetsAPI(Profile(), counter))
+    # Той самий запис під іншим ID та назвою (md5Checksum з Drive збігається)
+    copy = dict(drive.files[0], id="copy-000000", name="call_copy.mp3")
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            cache = AnalysisCache(db, ai.prompt_version)
+            await Pipeline(drive, ai, sheets, db, cache=cache).run(drive.files)
+            analyzed = counter.calls["gemini.generate_content"]
+            await Pipeline(drive, ai, sheets, db, cache=cache).run([copy])
+            await asyncio.to_thread(ai.close)
+            cursor = await db.conn.execute(
+                "SELECT manager_score FROM call_results WHERE file_id IN (?, ?)", (drive.files[0]['id'], copy['id']))
+            scores = [row[0] for row in await cursor.fetchall()]
+            return analyzed, cache, scores
+        finally:
+            await db.close()
+
+    analyzed, cache, scores = asyncio.run(scenario())
+    assert counter.calls["gemini.generate_content"] == analyzed
+    assert counter.calls["drive.files.get_media"] == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert len(scores) == 2 and scores[0] == scores[1]
+
+
+def test_cache_skips_errors_separates_prompt_versions_and_evicts_least_recent(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "ANALYSIS_CACHE_MAX_ENTRIES", 2)
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            cache = AnalysisCache(db, "v1")
+            await cache.put("err", CallAnalysis.error("timeout"))
+            for content_hash in ("a", "b", "c"):
+                await cache.put(content_hash, CallAnalysis(manager_score=8, ai_cost_usd=0.01))
+                time.sleep(0.01)
+            hit = await cache.get("a")
+            other_prompt = await AnalysisCache(db, "v2").get("a")
+            await cache.evict()
+            kept = [await cache.get(h) is not None for h in ("a", "b", "c", "err")]
+            return hit, other_prompt, kept
+        finally:
+            await db.close()
+
+    hit, other_prompt, kept = asyncio.run(scenario())
+    # Повторний результат безкоштовний, а інший промпт — інший ключ
+    assert (hit.manager_score, hit.ai_cost_usd) == (8, 0.0)
+    assert other_prompt is None
+    # Лишаються два останні використані записи; заглушки помилок не кешувались зовсім
+    assert kept == [True, False, True, False]
@@ -0,0 +1,65 @@
+import os
+import wave
+
+import numpy as np
+import pytest
+
+from src.audio_preprocessor import detect_format, preprocess_audio
+from src.config import Config
+
+
+def write_wav(path, seconds, rate=44100, channels=2, silence=0.5):
+    """Тон 440 Гц з тишею на початку та в кінці."""
+    t = np.arange(int(seconds * rate)) / rate
+    tone = (8000 * np.sin(2 * np.pi * 440 * t)).astype("<i2")
+    pad = np.zeros(int(silence * rate), dtype="<i2")
+    mono = np.concatenate([pad, tone, pad])
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(np.repeat(mono, channels).tobytes())
+
+
+@pytest.mark.parametrize("head, expected", [
+    (b"RIFF\0\0\0\0WAVE", (".wav", "audio/wav")),
+    (b"ID3\x04\0\0\0\0\0\0\0\0", (".mp3", "audio/mp3")),
+    (b"\xff\xfb\x90\x64\0\0\0\0\0\0\0\0", (".mp3", "audio/mp3")),
+    (b"\xff\xf1\x50\x80\0\0\0\0\0\0\0\0", (".aac", "audio/aac")),
+    (b"\0\0\0\x20ftypM4A ", (".m4a", "audio/mp4")),
+    (b"OggS\0\x02\0\0\0\0\0\0", (".ogg", "audio/ogg")),
+    (b"not audio at all", (".mp3", "audio/mp3")),
+])
+def test_format_is_detected_by_content_not_name(tmp_path, head, expected):
+    path = tmp_path / "call.mp3"
+    path.write_bytes(head)
+    assert detect_format(str(path)) == expected
+
+
+def test_wav_fallback_downmixes_resamples_and_trims_silence(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.audio_preprocessor.shutil.which", lambda name: None)
+    monkeypatch.setattr(Config, "PREPROCESS_SAMPLE_RATE", 16000)
+    src = tmp_path / "call.mp3"  # назва бреше: насправді це WAV
+    write_wav(src, seconds=2)
+
+    result = preprocess_audio(str(src))
+
+    assert result['mime_type'] == "audio/wav"
+    assert result['processed_bytes'] < result['original_bytes'] / 5
+    assert not os.path.exists(src)
+    with wave.open(result['path'], "rb") as w:
+        assert (w.getnchannels(), w.getframerate()) == (1, 16000)
+        # Лишився лише тон: тишу з обох боків обрізано
+        assert abs(w.getnframes() / 16000 - 2) < 0.05
+
+
+def test_non_wav_without_ffmpeg_is_left_as_is(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.audio_preprocessor.shutil.which", lambda name: None)
+    src = tmp_path / "call.wav"
+    src.write_bytes(b"ID3" + bytes(1024))
+
+    result = preprocess_audio(str(src))
+
+    assert result == {'path': str(src), 'mime_type': "audio/mp3",
+                      'original_bytes': 1027, 'processed_bytes': 1027}
+    assert os.path.exists(src)
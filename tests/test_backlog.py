@@ -0,0 +1,121 @@
+import os
+import json
+import asyncio
+from types import SimpleNamespace
+
+from benchmarks.fakes import ApiCounter, FakeDrive, FakeGenaiClient, FakeSheetsAPI, Profile
+from src.ai_processor import AIProcessor
+from src.analytics import Analytics
+from src.backlog import BacklogProcessor, GeminiBatchBackend, LocalBatchBackend
+from src.config import Config
+from src.database import Database
+from src.google_sheets import SheetsService
+
+
+def answer(score):
+    return json.dumps({
+        "transcription": "Добрий день", "service_type": Config.SERVICES_LIST[0], "manager_score": score,
+        "result": "Записався", "is_critical_fail": False, "critical_comment": "",
+        "kpi_greeting": 1, "kpi_body": 1, "kpi_year": 1, "kpi_mileage": 1,
+        "kpi_upsell": 1, "kpi_history": 1, "kpi_closing": 1,
+    }, ensure_ascii=False)
+
+
+def requested_file(request) -> str:
+    """ID файлу Drive з посилання на завантажене аудіо (files/<id>_<назва>)."""
+    uri = request['contents'][0]['parts'][0]['file_data']['file_uri']
+    return uri.rsplit("/", 1)[1].split("_", 1)[0]
+
+
+def make_processor(tmp_path, monkeypatch, n_files, backend_factory):
+    monkeypatch.setattr(Config, "TEMP_FOLDER", str(tmp_path / "audio"))
+    counter = ApiCounter()
+    drive = FakeDrive(n_files, Profile(), counter, file_size=1024)
+    ai = AIProcessor(client=FakeGenaiClient(Profile(), Profile(), counter))
+    sheets = SheetsService(service=FakeSheetsAPI(Profile(), counter))
+    return drive, ai, sheets, counter, backend_factory(ai)
+
+
+async def outbox_file_ids(db):
+    cursor = await db.conn.execute("SELECT file_id FROM sheets_outbox ORDER BY file_id")
+    return [row[0] for row in await cursor.fetchall()]
+
+
+def test_backlog_records_results_failures_and_cleans_up_uploads(tmp_path, monkeypatch):
+    def handler(request):
+        if requested_file(request) == "fake-000002":
+            raise RuntimeError("модель не відповіла")
+        return answer(7)
+
+    drive, ai, sheets, counter, backend = make_processor(
+        tmp_path, monkeypatch, 4, lambda ai: LocalBatchBackend(handler))
+    download = drive.download_file
+
+    def flaky_download(file_id, *args):
+        if file_id == "fake-000001":
+            raise ConnectionError("обрив з'єднання")
+        return download(file_id, *args)
+
+    drive.download_file = flaky_download
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            processor = BacklogProcessor(drive, ai, sheets, db, backend=backend)
+            await processor.run(drive.files)
+            await asyncio.to_thread(ai.close)
+            ids = [f['id'] for f in drive.files]
+            processed = sorted(set(ids) - await db.filter_unprocessed(ids))
+            return processor.failed, processed, await outbox_file_ids(db)
+        finally:
+            await db.close()
+
+    failed, processed, outbox = asyncio.run(scenario())
+    assert failed == {"fake-000001", "fake-000002"}
+    assert processed == ["fake-000000", "fake-000003"]
+    assert outbox == ["fake-000000", "fake-000003"]
+    # Кожен завантажений файл видалено з Gemini, локальних копій не лишилось
+    assert counter.calls["gemini.files.upload"] == 3
+    assert counter.calls["gemini.files.delete"] == 3
+    assert os.listdir(Config.TEMP_FOLDER) == []
+
+
+def test_batch_results_keep_discounted_cost_in_model_report(tmp_path, monkeypatch):
+    usage = {'prompt_token_count': 10_000, 'candidates_token_count': 1_000, 'cached_content_token_count': 0}
+
+    def gemini_backend(ai):
+        jobs = {}
+
+        def create(model, src, config):
+            jobs["batches/1"] = src
+            return SimpleNamespace(name="batches/1")
+
+        def get(name):
+            items = [SimpleNamespace(error=None, response=SimpleNamespace(text=answer(8), usage_metadata=usage))
+                     for _ in jobs[name]]
+            return SimpleNamespace(state=SimpleNamespace(name="JOB_STATE_SUCCEEDED"),
+                                   dest=SimpleNamespace(inlined_responses=items))
+
+        ai.client.batches = SimpleNamespace(create=create, get=get)
+        return GeminiBatchBackend(ai)
+
+    drive, ai, sheets, _, backend = make_processor(tmp_path, monkeypatch, 2, gemini_backend)
+    online_cost = ai.record_usage(usage)
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            await BacklogProcessor(drive, ai, sheets, db, backend=backend).run(drive.files)
+            await asyncio.to_thread(ai.close)
+            return await Analytics(db).model_report()
+        finally:
+            await db.close()
+
+    report = asyncio.run(scenario())
+    route = f"{ai.model_name} (batch)"
+    assert list(report.index) == [route]
+    assert report.loc[route, "analyzed"] == 2
+    assert report.loc[route, "cost_usd"] == round(2 * online_cost * Config.GEMINI_BATCH_DISCOUNT, 4)
+    assert report.loc[route, "cost_usd"] > 0
@@ -0,0 +1,28 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.run_benchmark import StageTimer, run_once
+
+
+def test_stage_percentiles():
+    timer = StageTimer()
+    timer.samples["analyze"] = [i / 1000 for i in range(1, 101)]
+    assert timer.summary() == {"analyze": {"p50": 51.0, "p95": 95.0, "p99": 99.0}}
+
+
+def test_benchmark_runs_main_end_to_end_against_fakes():
+    options = {
+        "drive_latency": 0.0, "upload_latency": 0.0, "gemini_latency": 0.01, "sheets_latency": 0.0,
+        "error_rate": 0.0, "rate_429": 0.0,
+        "config": {"GEMINI_RPM": 1e6, "DRIVE_RPM": 1e6, "SHEETS_RPM": 1e6, "GEMINI_FAST_MODEL": ""},
+    }
+    # Як і сам бенчмарк — в окремому процесі, бо прогін змінює Config та підміняє сервіси в main
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        result = pool.submit(run_once, 8, options).result()
+
+    calls = result["api_calls"]
+    assert result["files"] == 8
+    assert calls["drive.files.get_media"] == calls["gemini.files.upload"] == calls["gemini.files.delete"] == 8
+    assert calls["gemini.generate_content"] == 8
+    assert calls["sheets.values.append"] >= 1
+    assert set(result["stages_ms"]) >= {"download", "analyze", "sheets_write"}
+    assert result["gemini_cost_usd"] > 0
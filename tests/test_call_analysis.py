@@ -0,0 +1,29 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from src.call_analysis import CallAnalysis
+
+
+@pytest.mark.parametrize("score", [None, "немає", float("nan"), float("inf"), [7], {"value": 7}])
+def test_parse_rejects_missing_or_non_numeric_score(score):
+    with pytest.raises(ValidationError):
+        CallAnalysis.parse(json.dumps({"manager_score": score}))
+
+
+@pytest.mark.parametrize("text", ['"str"', "7", "null", "true", '["str"]', "[null]"])
+def test_parse_rejects_non_object_payload(text):
+    with pytest.raises(ValidationError):
+        CallAnalysis.parse(text)
+
+
+def test_parse_raises_decode_error_for_non_json():
+    with pytest.raises(json.JSONDecodeError):
+        CallAnalysis.parse("не JSON")
+
+
+@pytest.mark.parametrize("score, expected", [("7/10", 7), (7.6, 8), ("8", 8), (0, 1), (15, 10)])
+def test_parse_normalizes_score(score, expected):
+    text = "```json\n" + json.dumps({"manager_score": score}) + "\n```"
+    assert CallAnalysis.parse(text).manager_score == expected
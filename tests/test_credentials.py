@@ -0,0 +1,46 @@
+import threading
+
+import googleapiclient.discovery
+from google.oauth2 import service_account
+
+from src import credentials
+from src.ai_processor import AIProcessor
+from src.config import Config
+from src.google_drive import DriveService
+from src.google_sheets import SheetsService
+
+
+def test_drive_and_sheets_share_credentials_and_build_clients_lazily_once(monkeypatch):
+    monkeypatch.setattr(credentials, "_credentials", None)
+    monkeypatch.setattr(credentials, "_services", {})
+    loads, builds = [], []
+
+    def load(path, scopes):
+        loads.append(path)
+        return object()
+
+    def build(name, version, credentials, static_discovery, cache_discovery):
+        builds.append((name, version, static_discovery))
+        return object()
+
+    monkeypatch.setattr(service_account.Credentials, "from_service_account_file", load)
+    monkeypatch.setattr(googleapiclient.discovery, "build", build)
+    monkeypatch.setattr(Config, "GEMINI_API_KEY", "test-key")
+
+    drive, sheets, ai = DriveService(), SheetsService(), AIProcessor()
+    # Запуск без нових файлів не створює жодного клієнта API
+    assert builds == []
+    assert ai._client is None
+
+    threads = [threading.Thread(target=lambda: (drive.service, sheets.service)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert drive.creds is sheets.creds
+    assert loads == [Config.GOOGLE_CREDENTIALS_FILE]
+    # Кожен API — один раз на процес, discovery зі статичного документа (без запиту в мережу)
+    assert sorted(set(builds)) == [("drive", "v3", True), ("sheets", "v4", True)]
+    assert DriveService().service is drive.service
+    ai.close()
@@ -0,0 +1,40 @@
+import os
+import signal
+import asyncio
+
+import main
+from src.config import Config
+
+
+def test_daemon_backs_off_when_idle_and_stops_on_sigterm(monkeypatch):
+    monkeypatch.setattr(Config, "POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(Config, "POLL_MAX_INTERVAL", 0.04)
+    # Кількість файлів у кожному проході: робота, простій, знову робота, простій
+    found = [3, 0, 0, 0, 0, 2, 0]
+    passes = []
+
+    async def fake_pass(drive, ai, sheets, db, full_scan, stop_event=None):
+        passes.append((full_scan, stop_event))
+        if len(passes) == len(found):
+            # Як systemd: SIGTERM посеред проходу; розпочатий прохід завершується
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.sleep(0)
+        return found[len(passes) - 1]
+
+    waits = []
+    wait_for = asyncio.wait_for
+
+    async def recording_wait_for(awaitable, timeout):
+        waits.append(timeout)
+        return await wait_for(awaitable, timeout)
+
+    monkeypatch.setattr(main, "process_new_files", fake_pass)
+    monkeypatch.setattr(asyncio, "wait_for", recording_wait_for)
+
+    asyncio.run(asyncio.wait_for(main.run_daemon(None, None, None, None, full_scan=True), 5))
+
+    # --full-scan лише для першого проходу; сигнал встановлює stop_event, переданий у прохід
+    assert [full for full, _ in passes] == [True] + [False] * 6
+    assert passes[-1][1].is_set()
+    # Після роботи — базовий інтервал, у простої — подвоєння до максимуму
+    assert waits[1:] == [0.01, 0.02, 0.04, 0.04, 0.04, 0.01, 0.02]
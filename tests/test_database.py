@@ -0,0 +1,59 @@
+import asyncio
+
+from src.analytics import Analytics
+from src.call_analysis import CallAnalysis, KPI_FIELDS
+from src.database import Database
+
+
+def call(score, transcription="добрий день, запис на діагностику"):
+    return CallAnalysis(manager_score=score, transcription=transcription, **{name: 1 for name in KPI_FIELDS})
+
+
+def test_error_on_reprocessing_removes_stale_analysis(tmp_path):
+    info = {'id': "f1", 'name': "call.mp3", 'createdTime': "2025-03-03T10:00:00Z"}
+    other = {'id': "f2", 'name': "other.mp3", 'createdTime': "2025-03-04T10:00:00Z"}
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            await db.add_files([(info, call(9), None), (other, call(4, "інший дзвінок"), None)])
+            analytics = Analytics(db)
+            before = (await analytics.report("week"))["calls"].tolist()
+
+            await db.add_files([(info, CallAnalysis.error("timeout"), None)])
+
+            counts = {}
+            for table in ("call_results", "call_raw_outputs", "call_transcripts"):
+                cursor = await db.conn.execute(f"SELECT COUNT(*) FROM {table} WHERE file_id = 'f1'")
+                counts[table] = (await cursor.fetchone())[0]
+            search = [row[0] for row in await db.search_transcripts("діагностику", 10)]
+            after = (await analytics.report("week"))["calls"].tolist()
+            return before, counts, search, after
+        finally:
+            await db.close()
+
+    before, counts, search, after = asyncio.run(scenario())
+    assert before == [2]
+    assert counts == {"call_results": 0, "call_raw_outputs": 0, "call_transcripts": 0}
+    assert search == []
+    assert after == [1]
+
+
+def test_claim_outbox_reads_legacy_entries_with_highlight_flags(tmp_path):
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            await db.add_files([({'id': "new", 'name': "new.mp3"}, call(7), ["01.03.2025", "new.mp3"])])
+            # Записи попередніх версій: (рядок, червона оцінка, червоний коментар)
+            await db.conn.execute(
+                "INSERT INTO sheets_outbox (file_id, entry, attempts, available_at, created_at) VALUES (?, ?, 0, 0, 0)",
+                ("old", '[["01.02.2025", "old.mp3"], true, false]')
+            )
+            await db.conn.commit()
+            return sorted(entry for _, entry, _ in await db.claim_outbox(10, 60))
+        finally:
+            await db.close()
+
+    assert asyncio.run(scenario()) == [["01.02.2025", "old.mp3"], ["01.03.2025", "new.mp3"]]
@@ -0,0 +1,173 @@
+import os
+import asyncio
+import hashlib
+
+import googleapiclient.http
+import pytest
+
+from main import DRIVE_TOKEN_KEY, discover_files
+from src.config import Config
+from src.database import Database
+from src.google_drive import DriveService
+from src.rate_limiter import AdaptiveRateLimiter
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self, http=None):
+        return self.result
+
+
+class FakeChanges:
+    """changes() Drive API v3: стрічка змін сторінками за токеном."""
+
+    def __init__(self, pages, start_token):
+        self.pages = pages
+        self.start_token = start_token
+        self.requested = []
+
+    def getStartPageToken(self):
+        return FakeRequest({'startPageToken': self.start_token})
+
+    def list(self, pageToken, **kwargs):
+        self.requested.append(pageToken)
+        return FakeRequest(self.pages[pageToken])
+
+
+class FakeFiles:
+    def __init__(self, files):
+        self.files = files
+        self.scans = 0
+
+    def list(self, **kwargs):
+        self.scans += 1
+        return FakeRequest({'files': self.files})
+
+
+class FakeDriveAPI:
+    def __init__(self, files, pages, start_token):
+        self._files = FakeFiles(files)
+        self._changes = FakeChanges(pages, start_token)
+
+    def files(self):
+        return self._files
+
+    def changes(self):
+        return self._changes
+
+
+def make_drive(api) -> DriveService:
+    """DriveService без облікових даних: клієнт API та HTTP підмінено."""
+    drive = DriveService.__new__(DriveService)
+    drive._service = api
+    drive._http = lambda: None
+    drive.limiter = AdaptiveRateLimiter("drive", 60000)
+    return drive
+
+
+def change(file_id, name, parents=("folder",), **extra):
+    return {'fileId': file_id, 'file': {'id': file_id, 'name': name, 'parents': list(parents), **extra}}
+
+
+def test_list_changes_keeps_latest_audio_in_folder_across_pages():
+    pages = {
+        "10": {'nextPageToken': "11", 'changes': [
+            change("a", "call_a.mp3", size="1"),
+            change("doc", "notes.txt", mimeType="text/plain"),
+            change("other", "call_o.mp3", parents=("elsewhere",)),
+            change("bin", "call_b.wav", trashed=True),
+            {'fileId': "gone", 'removed': True},
+        ]},
+        "11": {'newStartPageToken': "12", 'changes': [
+            change("a", "call_a.mp3", size="2"),
+            change("c", "voice", mimeType="audio/ogg"),
+        ]},
+    }
+    api = FakeDriveAPI([], pages, "99")
+
+    files, token = make_drive(api).list_changes("10", "folder")
+
+    assert token == "12"
+    assert api._changes.requested == ["10", "11"]
+    assert [(f['id'], f['size']) for f in files] == [("a", "2"), ("c", None)]
+
+
+def test_discover_files_scans_once_then_follows_changes_feed(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "SOURCE_FOLDER_ID", "folder")
+    monkeypatch.setattr(Config, "DISCOVERY_MODE", "changes")
+    pages = {"5": {'newStartPageToken': "6", 'changes': [change("new", "call_new.mp3")]}}
+    api = FakeDriveAPI([{'id': "old", 'name': "call_old.mp3"}], pages, "5")
+    drive = make_drive(api)
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            # Перший запуск: токена ще немає — повне сканування та стартовий токен
+            first = await discover_files(drive, db)
+            await db.set_state(DRIVE_TOKEN_KEY, first[1])
+            # Далі — лише стрічка змін від збереженого токена
+            second = await discover_files(drive, db)
+            # --full-scan ігнорує токен
+            forced = await discover_files(drive, db, full_scan=True)
+            return first, second, forced
+        finally:
+            await db.close()
+
+    first, second, forced = asyncio.run(scenario())
+    assert ([f['id'] for f in first[0]], first[1]) == (["old"], "5")
+    assert ([f['id'] for f in second[0]], second[1]) == (["new"], "6")
+    assert [f['id'] for f in forced[0]] == ["old"]
+    assert api._files.scans == 2
+    assert api._changes.requested == ["5"]
+
+
+class FakeDownloader:
+    """MediaIoBaseDownload: віддає вміст чанками, перший виклик next_chunk обривається."""
+
+    def __init__(self, fd, request, chunksize):
+        self.fd = fd
+        self.data = request.result
+        self.chunksize = chunksize
+        self.offset = 0
+        self.failed = False
+
+    def next_chunk(self):
+        if not self.failed and self.offset:
+            self.failed = True
+            raise ConnectionResetError("обрив з'єднання")
+        chunk = self.data[self.offset:self.offset + self.chunksize]
+        self.fd.write(chunk)
+        self.offset += len(chunk)
+        return None, self.offset >= len(self.data)
+
+
+class FakeMediaFiles(FakeFiles):
+    def __init__(self, content):
+        super().__init__([])
+        self.content = content
+
+    def get_media(self, fileId):
+        return FakeRequest(self.content)
+
+
+def test_download_resumes_after_dropped_chunk_and_verifies_md5(tmp_path, monkeypatch):
+    monkeypatch.setattr(googleapiclient.http, "MediaIoBaseDownload", FakeDownloader)
+    monkeypatch.setattr("src.google_drive.backoff_delay", lambda attempt: 0)
+    monkeypatch.setattr(Config, "TEMP_FOLDER", str(tmp_path))
+    monkeypatch.setattr(Config, "DOWNLOAD_CHUNK_SIZE", 4)
+    content = b"RIFF" + bytes(range(30))
+    api = FakeDriveAPI([], {}, "1")
+    api._files = FakeMediaFiles(content)
+    drive = make_drive(api)
+
+    path = drive.download_file("f1", "call.wav", hashlib.md5(content).hexdigest())
+    with open(path, "rb") as f:
+        assert f.read() == content
+
+    # Пошкоджений вміст: файл видаляється, помилка не ковтається
+    with pytest.raises(ValueError):
+        drive.download_file("f2", "call.wav", "0" * 32)
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(path)]
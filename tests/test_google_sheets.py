@@ -0,0 +1,76 @@
+from benchmarks.fakes import ApiCounter, FakeSheetsAPI, Profile
+from src.call_analysis import CallAnalysis
+from src.google_sheets import SheetsService
+
+
+def make_sheets():
+    api = FakeSheetsAPI(Profile(), ApiCounter())
+    return SheetsService(service=api), api
+
+
+def entry(sheets, name, file_id, score):
+    return sheets.build_entry(name, CallAnalysis(manager_score=score), file_id=file_id)
+
+
+def test_rewrite_rows_matches_by_file_id_when_names_repeat():
+    sheets, api = make_sheets()
+    sheets.write_rows([entry(sheets, "call.mp3", "id-a", 5), entry(sheets, "call.mp3", "id-b", 3)])
+
+    updated = sheets.rewrite_rows({
+        "id-a": ("call.mp3", entry(sheets, "call.mp3", "id-a", 9)),
+        "id-b": ("call.mp3", entry(sheets, "call.mp3", "id-b", 2)),
+    })
+
+    assert updated == 2
+    assert [(row[18], row[14]) for row in api.rows[1:]] == [("id-a", 9), ("id-b", 2)]
+
+
+def test_rewrite_rows_skips_legacy_rows_with_ambiguous_names():
+    sheets, api = make_sheets()
+    sheets.write_rows([entry(sheets, "call.mp3", "", 5), entry(sheets, "call.mp3", "", 3),
+                       entry(sheets, "other.mp3", "", 4)])
+
+    updated = sheets.rewrite_rows({
+        "id-a": ("call.mp3", entry(sheets, "call.mp3", "id-a", 9)),
+        "id-c": ("other.mp3", entry(sheets, "other.mp3", "id-c", 8)),
+    })
+
+    assert updated == 1
+    assert [row[14] for row in api.rows[1:]] == [5, 3, 8]
+    # Однозначний рядок отримує ID, тож наступний прогін знайде його за ним
+    assert api.rows[3][18] == "id-c"
+
+
+def test_first_write_to_existing_sheet_keeps_legacy_cell_formatting():
+    sheets, api = make_sheets()
+    api.rows.append(list(sheets.HEADERS))
+
+    sheets.write_rows([entry(sheets, "call.mp3", "id-a", 3)])
+
+    kinds = [next(iter(request)) for request in api.requests]
+    assert kinds.count("addConditionalFormatRule") == 2
+    # Поклітинне підсвічування старих рядків (без прапорця в R) не скидається
+    assert "repeatCell" not in kinds
+
+
+def test_rebuild_resets_legacy_cell_formatting():
+    sheets, api = make_sheets()
+
+    sheets.start_rebuild(10)
+
+    assert any("repeatCell" in request and request["repeatCell"]["range"]["startColumnIndex"] == 14
+               for request in api.requests)
+
+
+def test_each_batch_is_one_append_and_sheet_setup_happens_once():
+    sheets, api = make_sheets()
+
+    for start in range(0, 9, 3):
+        sheets.write_rows([entry(sheets, f"call_{i}.mp3", f"id-{i}", 7) for i in range(start, start + 3)])
+
+    assert api.counter.calls["sheets.values.append"] == 3
+    # Шапка та метадані аркуша (sheetId, правила) — лише перед першою пачкою
+    assert api.counter.calls["sheets.values.get"] == 1
+    assert api.counter.calls["sheets.get"] == 1
+    assert api.rows[0] == sheets.HEADERS
+    assert [row[18] for row in api.rows[1:]] == [f"id-{i}" for i in range(9)]
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from src.config import Config
+from src.database import Database
+from src.jobs import JobQueue
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def open_db(path):
+    db = Database(str(path))
+    await db.init()
+    return db
+
+
+async def job_state(db, file_id):
+    cursor = await db.conn.execute("SELECT status, attempts FROM jobs WHERE file_id = ?", (file_id,))
+    return await cursor.fetchone()
+
+
+def files(*ids):
+    return [{'id': file_id, 'name': f"{file_id}.mp3"} for file_id in ids]
+
+
+def test_lease_counts_attempts_only_for_failed_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "JOB_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(Config, "JOB_RETRY_DELAY", 0)
+
+    async def scenario():
+        db = await open_db(tmp_path / "jobs.db")
+        try:
+            queue = JobQueue(db, worker_id="w1")
+            await queue.enqueue(files("ok", "bad", "unstarted"))
+            # Кілька "коректних зупинок" поспіль: лише файл з помилкою вичерпує спроби
+            for _ in range(3):
+                claimed = await queue.claim(10)
+                async with queue.lease(claimed, failed={"bad"}):
+                    pass
+            return [await job_state(db, file_id) for file_id in ("ok", "bad", "unstarted")]
+        finally:
+            await db.close()
+
+    ok, bad, unstarted = run(scenario())
+    assert ok == ("pending", 0)
+    assert unstarted == ("pending", 0)
+    assert bad == ("failed", 2)
+
+
+def test_lease_counts_attempt_for_all_files_when_processing_crashes(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path / "jobs.db")
+        try:
+            queue = JobQueue(db, worker_id="w1")
+            await queue.enqueue(files("a", "b"))
+            claimed = await queue.claim(10)
+            with pytest.raises(RuntimeError):
+                async with queue.lease(claimed, failed=set()):
+                    raise RuntimeError("збій")
+            return [await job_state(db, file_id) for file_id in ("a", "b")]
+        finally:
+            await db.close()
+
+    assert run(scenario()) == [("pending", 1), ("pending", 1)]
+
+
+def test_concurrent_claimers_receive_disjoint_jobs(tmp_path):
+    async def scenario():
+        first, second = await open_db(tmp_path / "jobs.db"), await open_db(tmp_path / "jobs.db")
+        try:
+            await first.enqueue_jobs([(f, None, None, None) for f in files(*(f"f{i}" for i in range(20)))])
+            claims = await asyncio.gather(*(
+                db.claim_jobs(worker, 6, lease_seconds=60)
+                for _ in range(3) for db, worker in ((first, "w1"), (second, "w2"))
+            ))
+            return [[f['id'] for f in claimed] for claimed in claims]
+        finally:
+            await first.close()
+            await second.close()
+
+    claims = run(scenario())
+    claimed = [file_id for ids in claims for file_id in ids]
+    assert len(claimed) == len(set(claimed)) == 20
+
+
+def test_expired_lease_is_claimable_again(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path / "jobs.db")
+        try:
+            await db.enqueue_jobs([(f, None, None, None) for f in files("a")])
+            first = await db.claim_jobs("w1", 10, lease_seconds=0.2)
+            while_leased = await db.claim_jobs("w2", 10, lease_seconds=60)
+            # Екземпляр w1 "упав" і не продовжив оренду: задача знову доступна іншим
+            await asyncio.sleep(0.3)
+            after_expiry = await db.claim_jobs("w2", 10, lease_seconds=60)
+            return [[f['id'] for f in claimed] for claimed in (first, while_leased, after_expiry)]
+        finally:
+            await db.close()
+
+    assert run(scenario()) == [["a"], [], ["a"]]
+
+
+def test_aging_lifts_old_long_job_above_fresh_short_ones(tmp_path):
+    async def scenario():
+        db = await open_db(tmp_path / "jobs.db")
+        try:
+            await db.enqueue_jobs([(f, None, 1800.0, None) for f in files("old-long")] +
+                                  [(f, None, 600.0, None) for f in files("new-1", "new-2")])
+            await db.conn.execute("UPDATE jobs SET enqueued_at = enqueued_at - 3600 WHERE file_id = 'old-long'")
+            await db.conn.commit()
+            fresh = await db.claim_jobs("w1", 3, lease_seconds=60, policy="sjf", aging_seconds=1e9)
+            await db.conn.execute("UPDATE jobs SET status = 'pending'")
+            await db.conn.commit()
+            aged = await db.claim_jobs("w1", 3, lease_seconds=60, policy="sjf", aging_seconds=900)
+            return [f['id'] for f in fresh], [f['id'] for f in aged]
+        finally:
+            await db.close()
+
+    without_aging, with_aging = run(scenario())
+    assert without_aging[-1] == "old-long"
+    assert with_aging[0] == "old-long"
+
+
+def test_failed_job_waits_for_retry_delay_before_next_claim(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "JOB_RETRY_DELAY", 0.2)
+
+    async def scenario():
+        db = await open_db(tmp_path / "jobs.db")
+        try:
+            queue = JobQueue(db, worker_id="w1")
+            await queue.enqueue(files("bad", "unstarted"))
+            async with queue.lease(await queue.claim(10), failed={"bad"}):
+                pass
+            # Той самий цикл забирання не отримує файл з помилкою одразу знову
+            same_pass = [f['id'] for f in await queue.claim(10)]
+            await db.release_jobs("w1", same_pass, [], Config.JOB_MAX_ATTEMPTS)
+            await asyncio.sleep(0.3)
+            after_delay = [f['id'] for f in await queue.claim(10)]
+            return same_pass, after_delay
+        finally:
+            await db.close()
+
+    same_pass, after_delay = run(scenario())
+    assert same_pass == ["unstarted"]
+    assert sorted(after_delay) == ["bad", "unstarted"]
@@ -0,0 +1,60 @@
+import gzip
+import json
+import queue
+import asyncio
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+from src.config import Config
+from src.logger import JsonFormatter, _ContextFilter, _rotating_handler, set_log_context
+
+
+def test_json_log_carries_task_context_and_rotated_files_are_compressed(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "LOG_ROTATE", "size")
+    monkeypatch.setattr(Config, "LOG_MAX_BYTES", 2000)
+    monkeypatch.setattr(Config, "LOG_COMPRESS", True)
+    path = tmp_path / "bot.jsonl"
+
+    # Та сама схема, що й у setup_logger: черга в логері, запис на диск у фоновому потоці
+    handler = _rotating_handler(str(path))
+    handler.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter())
+    log = logging.getLogger("CallAnalyzer.test")
+    log.propagate = False
+    log.addHandler(queue_handler)
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+
+    async def worker(file_id):
+        set_log_context(file_id=file_id, stage="download")
+        for i in range(20):
+            await asyncio.sleep(0)
+            # Запис із потоку (як у to_thread) теж отримує контекст задачі
+            await asyncio.to_thread(log.warning, f"чанк {i}")
+        log.warning("готово", extra={"stage": "analyze", "duration_ms": 12.5})
+
+    async def scenario():
+        await asyncio.gather(worker("a"), worker("b"))
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        listener.stop()
+        log.removeHandler(queue_handler)
+        handler.close()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    archives = sorted(tmp_path.glob("bot.jsonl.*.gz"))
+    assert archives
+    for archive in archives:
+        with gzip.open(archive, "rt", encoding="utf-8") as f:
+            lines += f.read().splitlines()
+
+    entries = [json.loads(line) for line in lines]
+    assert len(entries) == 42
+    assert {entry["file_id"] for entry in entries} == {"a", "b"}
+    assert all(entry["msg"].startswith("чанк") == (entry["stage"] == "download") for entry in entries)
+    done = [entry for entry in entries if entry["msg"] == "готово"]
+    assert [entry["duration_ms"] for entry in done] == [12.5, 12.5]
@@ -0,0 +1,59 @@
+import asyncio
+import urllib.request
+
+import pytest
+
+from src.metrics import Metrics, metrics, start_metrics_server, timed
+
+
+def test_histograms_are_cumulative_and_counters_keep_labels_apart():
+    registry = Metrics()
+    for value in (0.003, 0.2, 7):
+        registry.observe("stage_seconds", value, stage="download")
+    registry.inc("api_retries_total", api="drive")
+    registry.inc("api_retries_total", 2, api="drive")
+    registry.inc("api_retries_total", api="sheets")
+
+    text = registry.render()
+    assert 'call_analyzer_stage_seconds_bucket{le="0.005",stage="download"} 1' in text
+    assert 'call_analyzer_stage_seconds_bucket{le="0.25",stage="download"} 2' in text
+    assert 'call_analyzer_stage_seconds_bucket{le="+Inf",stage="download"} 3' in text
+    assert 'call_analyzer_stage_seconds_count{stage="download"} 3' in text
+    assert registry.counter("api_retries_total", api="drive") == 3
+    assert registry.counter("api_retries_total", api="sheets") == 1
+
+
+def test_timed_measures_sync_and_async_functions_even_when_they_fail():
+    @timed("test_sync")
+    def sync():
+        raise RuntimeError("збій")
+
+    @timed("test_async")
+    async def coro():
+        await asyncio.sleep(0)
+        return 42
+
+    with pytest.raises(RuntimeError):
+        sync()
+    assert asyncio.run(coro()) == 42
+    assert coro.__name__ == "coro"
+
+    text = metrics.render()
+    assert 'call_analyzer_stage_seconds_count{stage="test_sync"} 1' in text
+    assert 'call_analyzer_stage_seconds_count{stage="test_async"} 1' in text
+
+
+def test_metrics_endpoint_serves_prometheus_text():
+    metrics.inc("test_endpoint_total")
+    server = start_metrics_server(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            content_type = response.headers["Content-Type"]
+            body = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert "call_analyzer_test_endpoint_total 1" in body
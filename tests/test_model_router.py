@@ -0,0 +1,71 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.fakes import ApiCounter, FakeGenaiClient, Profile
+from src.ai_processor import AIProcessor
+from src.call_analysis import CallAnalysis
+from src.config import Config
+from src.model_router import ModelRouter
+
+FAST = "gemini-fast-test"
+
+
+@pytest.fixture(autouse=True)
+def routing(monkeypatch):
+    monkeypatch.setattr(Config, "GEMINI_FAST_MODEL", FAST)
+    monkeypatch.setattr(Config, "ROUTE_FAST_MAX_SECONDS", 180)
+    monkeypatch.setattr(Config, "CRITICAL_CLEAR_SCORE", 6)
+    monkeypatch.setattr(Config, "ROUTE_BORDERLINE_MARGIN", 1)
+    monkeypatch.setattr(Config, "ROUTE_MIN_TRANSCRIPT_CHARS", 10)
+
+
+@pytest.mark.parametrize("result, reason", [
+    (CallAnalysis(manager_score=9, transcription="Добрий день, запишу вас"), None),
+    (CallAnalysis(manager_score=3, transcription="Добрий день, запишу вас"), None),
+    (CallAnalysis(manager_score=6, transcription="Добрий день, запишу вас"), "borderline_score"),
+    (CallAnalysis(manager_score=7, transcription="Добрий день, запишу вас"), "borderline_score"),
+    (CallAnalysis(manager_score=2, transcription="Добрий день, запишу вас", is_critical_fail=True), "critical_fail"),
+    (CallAnalysis(manager_score=9, transcription="..."), "empty_transcript"),
+    (CallAnalysis.error("timeout"), "error"),
+])
+def test_escalation_reasons(result, reason):
+    assert ModelRouter.escalation_reason(result) == reason
+
+
+def test_short_calls_go_to_fast_model_and_long_or_unknown_to_strong():
+    router = ModelRouter()
+    assert [router.choose(d) for d in (30, 180, 181, None)] == ["fast", "fast", "strong", "strong"]
+    assert router.tier_of(FAST) == "fast" and router.tier_of(Config.GEMINI_MODEL) == "strong"
+
+
+def test_disabled_router_sends_everything_to_main_model(monkeypatch):
+    monkeypatch.setattr(Config, "GEMINI_FAST_MODEL", "")
+    router = ModelRouter()
+    assert router.choose(30) == "strong"
+    assert router.models["fast"] == Config.GEMINI_MODEL
+
+
+def test_doubtful_fast_answer_is_reanalyzed_by_main_model_with_both_costs(monkeypatch):
+    monkeypatch.setattr(Config, "GEMINI_CONTEXT_CACHE", False)
+    ai = AIProcessor(client=FakeGenaiClient(Profile(), Profile(), ApiCounter()))
+    scores = {FAST: 6, Config.GEMINI_MODEL: 9}
+    models = []
+
+    def generate(model, contents, config=None):
+        models.append(model)
+        answer = CallAnalysis(manager_score=scores[model], transcription="Добрий день, запишу вас на четвер")
+        usage = SimpleNamespace(prompt_token_count=1000, candidates_token_count=100, cached_content_token_count=0)
+        return SimpleNamespace(text=json.dumps(answer.to_dict(), ensure_ascii=False), usage_metadata=usage)
+
+    ai.client.models.generate_content = generate
+
+    short = ai._routed_analysis(["аудіо"], duration=60)
+    long = ai._routed_analysis(["аудіо"], duration=600)
+    ai.close()
+
+    assert models == [FAST, Config.GEMINI_MODEL, Config.GEMINI_MODEL]
+    assert (short.manager_score, short.ai_model, short.escalation) == (9, Config.GEMINI_MODEL, "borderline_score")
+    assert short.ai_cost_usd > long.ai_cost_usd > 0
+    assert long.escalation == ""
@@ -0,0 +1,176 @@
+import os
+import asyncio
+import threading
+
+import pytest
+
+from benchmarks.fakes import ApiCounter, FakeDrive, FakeGenaiClient, FakeSheetsAPI, Profile
+from src.ai_processor import AIProcessor
+from src.call_analysis import CallAnalysis
+from src.config import Config
+from src.database import Database
+from src.google_sheets import SheetsService
+from src.pipeline import Pipeline
+
+
+class FlakyDatabase:
+    """Перший запис падає (як SQLITE_BUSY від іншого екземпляра), наступні вдаються."""
+
+    def __init__(self):
+        self.calls = 0
+        self.written = []
+
+    async def add_files(self, records):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("database is locked")
+        self.written.extend(records)
+
+
+def record(file_id):
+    return {'id': file_id, 'name': f"{file_id}.mp3"}, CallAnalysis(manager_score=7), None
+
+
+def test_failed_flush_keeps_results_and_ticker_retries():
+    async def scenario():
+        db = FlakyDatabase()
+        pipeline = Pipeline(drive=None, ai=None, sheets=None, db=db)
+        pipeline._completed.extend([record("a"), record("b")])
+
+        ticker = asyncio.create_task(pipeline._flush_ticker())
+        await asyncio.sleep(1.1)
+        # Після збою результати на місці, а тікер живий
+        assert [info['id'] for info, _, _ in pipeline._completed] == ["a", "b"]
+        assert not ticker.done()
+        pipeline._completed.append(record("c"))
+        await asyncio.sleep(1.1)
+        ticker.cancel()
+        return db, pipeline
+
+    db, pipeline = asyncio.run(scenario())
+    assert [info['id'] for info, _, _ in db.written] == ["a", "b", "c"]
+    assert pipeline._completed == []
+
+
+class SlowDatabase(Database):
+    """Запис пачки "зависає" всередині транзакції (inside) або вже після коміту (after_commit)."""
+
+    def __init__(self, path, pause):
+        super().__init__(path)
+        self.pause = pause
+        self.entered = asyncio.Event()
+
+    async def _drop_stale_results(self, file_ids):
+        await super()._drop_stale_results(file_ids)
+        if self.pause == "inside":
+            self.entered.set()
+            await asyncio.sleep(0.2)
+
+    async def add_files(self, records):
+        await super().add_files(records)
+        if self.pause == "after_commit":
+            self.entered.set()
+            await asyncio.sleep(0.2)
+
+
+async def outbox_file_ids(db):
+    cursor = await db.conn.execute("SELECT file_id FROM sheets_outbox ORDER BY file_id")
+    return [row[0] for row in await cursor.fetchall()]
+
+
+def entry_record(file_id):
+    info, result, _ = record(file_id)
+    return info, result, ["row", file_id]
+
+
+@pytest.mark.parametrize("pause", ["inside", "after_commit"])
+def test_cancelled_flush_neither_leaves_transaction_open_nor_queues_rows_twice(tmp_path, pause):
+    async def scenario():
+        db = SlowDatabase(str(tmp_path / "bot.db"), pause)
+        await db.init()
+        try:
+            pipeline = Pipeline(drive=None, ai=None, sheets=None, db=db)
+            pipeline._completed.extend([entry_record("a"), entry_record("b")])
+            flush = asyncio.create_task(pipeline._flush_completed())
+            await db.entered.wait()
+            flush.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await flush
+            in_transaction = db.conn.in_transaction
+
+            db.pause = None
+            await pipeline._flush_completed()
+            return in_transaction, await outbox_file_ids(db), pipeline._completed
+        finally:
+            await db.close()
+
+    in_transaction, outbox, completed = asyncio.run(scenario())
+    assert not in_transaction
+    assert outbox == ["a", "b"]
+    assert completed == []
+
+
+def test_stopping_ticker_lets_in_flight_flush_finish(tmp_path):
+    async def scenario():
+        db = SlowDatabase(str(tmp_path / "bot.db"), "inside")
+        await db.init()
+        try:
+            pipeline = Pipeline(drive=None, ai=None, sheets=None, db=db)
+            pipeline._completed.append(entry_record("a"))
+            ticker = asyncio.create_task(pipeline._flush_ticker())
+            await db.entered.wait()
+            pipeline._stop_flush.set()
+            await ticker
+            return await outbox_file_ids(db), pipeline._completed
+        finally:
+            await db.close()
+
+    outbox, completed = asyncio.run(scenario())
+    assert outbox == ["a"]
+    assert completed == []
+
+
+def test_pipeline_processes_files_concurrently_within_worker_limits(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "TEMP_FOLDER", str(tmp_path / "audio"))
+    counter = ApiCounter()
+    drive = FakeDrive(12, Profile(latency=0.02), counter, file_size=1024)
+    ai = AIProcessor(client=FakeGenaiClient(Profile(), Profile(latency=0.02), counter))
+    sheets = SheetsService(service=FakeSheetsAPI(Profile(), counter))
+
+    active, peak = 0, 0
+    lock = threading.Lock()
+    download = drive.download_file
+
+    def tracked_download(file_id, *args):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        try:
+            if file_id == "fake-000005":
+                raise ConnectionError("обрив з'єднання")
+            return download(file_id, *args)
+        finally:
+            with lock:
+                active -= 1
+
+    drive.download_file = tracked_download
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            pipeline = Pipeline(drive, ai, sheets, db, download_workers=3, analyze_workers=2, queue_size=2)
+            await pipeline.run(drive.files)
+            await asyncio.to_thread(ai.close)
+            return pipeline, await outbox_file_ids(db)
+        finally:
+            await db.close()
+
+    pipeline, outbox = asyncio.run(scenario())
+    assert pipeline.done == 12
+    assert pipeline.failed == {"fake-000005"}
+    assert outbox == [f['id'] for f in drive.files if f['id'] != "fake-000005"]
+    # Скачування йдуть паралельно, але не більше download_workers одночасно
+    assert 1 < peak <= 3
+    assert os.listdir(Config.TEMP_FOLDER) == []
@@ -0,0 +1,74 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src.rate_limiter import AdaptiveRateLimiter, is_transient, retry_after_seconds
+
+
+class HttpError(Exception):
+    """Як googleapiclient.errors.HttpError: код і заголовки у resp."""
+
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.resp = SimpleNamespace(status=status, get=(headers or {}).get)
+
+
+def failing(*errors):
+    """Функція, що по черзі кидає errors, а потім повертає 'ok'."""
+    queue = list(errors)
+    calls = []
+
+    def func():
+        calls.append(1)
+        if queue:
+            raise queue.pop(0)
+        return "ok"
+    return func, calls
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr("src.rate_limiter.backoff_delay", lambda attempt: 0)
+
+
+def test_errors_are_classified_and_retry_hints_parsed():
+    assert is_transient(HttpError(429)) and is_transient(HttpError(503)) and is_transient(ConnectionError())
+    assert not is_transient(HttpError(400)) and not is_transient(ValueError("bad json"))
+    assert retry_after_seconds(HttpError(429, {'retry-after': "3"})) == 3.0
+    assert retry_after_seconds(Exception("429 RESOURCE_EXHAUSTED {'retryDelay': '0.5s'}")) == 0.5
+
+
+def test_throttle_halves_rate_and_success_restores_it(no_backoff):
+    limiter = AdaptiveRateLimiter("test", 60000)
+    func, calls = failing(HttpError(429), HttpError(500))
+
+    assert limiter.call(func) == "ok"
+    assert len(calls) == 3
+    assert (limiter.throttled, limiter.retries) == (1, 2)
+    # 429 вдвічі знизив швидкість, два успішні кроки (AIMD) лише частково її повернули
+    assert limiter.rate < limiter.max_rate
+
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.rate == limiter.max_rate
+
+
+def test_permanent_error_is_raised_without_retry(no_backoff):
+    limiter = AdaptiveRateLimiter("test", 60000)
+    func, calls = failing(HttpError(404), HttpError(404))
+
+    with pytest.raises(HttpError):
+        limiter.call(func)
+    assert len(calls) == 1
+    assert limiter.retries == 0
+
+
+def test_retry_after_pauses_all_callers_until_cancelled():
+    limiter = AdaptiveRateLimiter("test", 60000)
+    limiter.on_throttle(retry_after=60)
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+
+    with pytest.raises(TimeoutError):
+        limiter.call(lambda: "ok", cancel=cancel)
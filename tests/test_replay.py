@@ -0,0 +1,53 @@
+import json
+import asyncio
+
+from benchmarks.fakes import ApiCounter, FakeSheetsAPI, Profile
+from src.call_analysis import CallAnalysis, KPI_FIELDS
+from src.config import Config
+from src.database import Database
+from src.google_sheets import SheetsService
+from src.replay import Replay
+
+
+def stored(file_id, score, raw=None):
+    """Результат, збережений до зміни правил: критична помилка ще не знята."""
+    result = CallAnalysis(manager_score=score, is_critical_fail=True, critical_comment="Не спитав пробіг",
+                          **{name: 1 for name in KPI_FIELDS})
+    result.raw_response = raw or json.dumps(result.to_dict(), ensure_ascii=False)
+    info = {'id': file_id, 'name': f"call_{file_id}.mp3", 'createdTime': "2025-03-03T10:00:00Z"}
+    return info, result
+
+
+def test_replay_applies_current_rules_to_database_outbox_and_sheet(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "CRITICAL_CLEAR_SCORE", 6)
+    api = FakeSheetsAPI(Profile(), ApiCounter())
+    sheets = SheetsService(service=api)
+    calls = [stored("f0", 9), stored("f1", 7), stored("f2", 8, raw="{обрізана відповідь")]
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            records = [(info, result, sheets.build_entry(info['name'], result, file_id=info['id']))
+                       for info, result in calls]
+            await db.add_files(records)
+            # f0 і f2 вже в таблиці, f1 ще чекає в черзі відправки
+            sheets.write_rows([records[0][2], records[2][2]])
+            await db.discard_outbox(["f0", "f2"])
+
+            stats = await Replay(db, sheets).run()
+
+            cursor = await db.conn.execute("SELECT file_id, is_critical_fail FROM call_results ORDER BY file_id")
+            critical = dict(await cursor.fetchall())
+            outbox = await db.claim_outbox(10, 60)
+            return stats, critical, outbox
+        finally:
+            await db.close()
+
+    stats, critical, outbox = asyncio.run(scenario())
+    assert stats == {'replayed': 2, 'failed': 1, 'unreplayable': 0, 'sheet_rows': 1}
+    # Висока оцінка знімає критичну помилку; відповідь, що не розбирається, лишається як була
+    assert critical == {"f0": 0, "f1": 0, "f2": 1}
+    assert [(row[18], row[17]) for row in api.rows[1:]] == [("f0", 0), ("f2", 1)]
+    # Ще не відправлений рядок у черзі теж оновлено
+    assert [(entry[18], entry[17]) for _, entry, _ in outbox] == [("f1", 0)]
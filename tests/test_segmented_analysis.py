@@ -0,0 +1,74 @@
+import os
+import wave
+
+from src.call_analysis import CallAnalysis
+from src.config import Config
+from src.segmented_analysis import SegmentedAnalyzer, merge_transcripts
+
+
+def write_wav(path, seconds, rate=8000):
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(2 * int(seconds * rate)))
+
+
+class StubAI:
+    """Транскрибує сегменти за номером; другий сегмент падає."""
+
+    def __init__(self):
+        self.segments = []
+        self.scored = None
+
+    def transcribe_segment(self, path, mime_type):
+        self.segments.append((os.path.basename(path), mime_type))
+        index = int(path.rsplit(".seg", 1)[1][:2])
+        if index == 1:
+            raise TimeoutError("504 DEADLINE_EXCEEDED")
+        return f"фрагмент {index} кінець розмови {index}", 0.01
+
+    def score_transcript(self, transcript):
+        self.scored = transcript
+        return CallAnalysis(manager_score=8, transcription="", ai_cost_usd=0.02)
+
+
+def test_overlapping_transcripts_are_merged_without_repeats():
+    parts = [
+        "Менеджер: Добрий день! Який у вас рік авто і пробіг?",
+        "рік авто і пробіг? Клієнт: Дві тисячі п'ятнадцятий, сто тисяч.",
+        "Зовсім інший текст без спільних слів.",
+    ]
+    assert merge_transcripts(parts) == (
+        "Менеджер: Добрий день! Який у вас рік авто і пробіг? Клієнт: Дві тисячі п'ятнадцятий, сто тисяч. "
+        "Зовсім інший текст без спільних слів."
+    )
+
+
+def test_long_wav_is_split_transcribed_in_parallel_and_scored_once(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.audio_preprocessor.shutil.which", lambda name: None)
+    monkeypatch.setattr(Config, "SEGMENT_LONG_CALLS", True)
+    monkeypatch.setattr(Config, "SEGMENT_MIN_DURATION", 20)
+    monkeypatch.setattr(Config, "SEGMENT_SECONDS", 15)
+    monkeypatch.setattr(Config, "SEGMENT_OVERLAP", 2)
+    short, long = tmp_path / "short.wav", tmp_path / "long.wav"
+    write_wav(short, 18)
+    write_wav(long, 40)
+    ai = StubAI()
+    analyzer = SegmentedAnalyzer(ai)
+
+    try:
+        assert analyzer.plan(str(short)) == (18, 0)
+        duration, count = analyzer.plan(str(long))
+        result = analyzer.analyze(str(long), duration, count)
+    finally:
+        analyzer.close()
+
+    assert (duration, count) == (40, 3)
+    assert sorted(ai.segments) == [(f"long.seg0{i}.wav", "audio/wav") for i in range(3)]
+    # Збій одного сегмента не зриває аналіз: на його місці — позначка
+    assert result.transcription == ai.scored
+    assert "[фрагмент 2 не розпізнано]" in result.transcription
+    assert result.manager_score == 8
+    assert round(result.ai_cost_usd, 4) == 0.04
+    assert sorted(os.listdir(tmp_path)) == ["long.wav", "short.wav"]
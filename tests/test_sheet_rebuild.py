@@ -0,0 +1,51 @@
+import asyncio
+
+from benchmarks.fakes import ApiCounter, FakeSheetsAPI, Profile
+from src.call_analysis import CallAnalysis, KPI_FIELDS
+from src.database import Database
+from src.google_sheets import SheetsService
+from src.sheet_rebuild import SheetRebuild
+
+
+def call(score, critical=False):
+    return CallAnalysis(manager_score=score, is_critical_fail=critical, **{name: 1 for name in KPI_FIELDS})
+
+
+def test_rebuild_persists_rescored_results_and_discards_only_written_rows(tmp_path):
+    api = FakeSheetsAPI(Profile(), ApiCounter())
+    sheets = SheetsService(service=api)
+    infos = [{'id': f"f{i}", 'name': f"call_{i}.mp3", 'createdTime': f"2025-03-0{i + 1}T10:00:00Z"}
+             for i in range(5)]
+    stub = {'id': "err", 'name': "broken.mp3", 'createdTime': "2025-03-09T10:00:00Z"}
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            # Перший дзвінок збережено з критичною помилкою, яку поточні правила знімають
+            records = [(info, call(9 if i == 0 else 5, critical=i == 0), None) for i, info in enumerate(infos)]
+            records = [(info, result, sheets.build_entry(info['name'], result, file_id=info['id']))
+                       for info, result, _ in records]
+            error = CallAnalysis.error("timeout")
+            records.append((stub, error, sheets.build_entry(stub['name'], error, file_id=stub['id'])))
+            await db.add_files(records)
+
+            row_bytes = SheetRebuild._size(records[0][2])
+            stats = await SheetRebuild(db, sheets, max_bytes=2 * row_bytes + 1).run()
+
+            cursor = await db.conn.execute("SELECT is_critical_fail FROM call_results WHERE file_id = 'f0'")
+            critical = (await cursor.fetchone())[0]
+            cursor = await db.conn.execute("SELECT file_id FROM sheets_outbox")
+            outbox = [row[0] for row in await cursor.fetchall()]
+            return stats, critical, outbox
+        finally:
+            await db.close()
+
+    stats, critical, outbox = asyncio.run(scenario())
+    assert stats['rows'] == 5
+    assert stats['requests'] >= 3
+    assert [row[18] for row in api.rows[1:]] == [info['id'] for info in infos]
+    assert api.rows[1][17] == 0
+    assert critical == 0
+    # Заглушка помилки в перебудову не входить — її рядок лишається в черзі
+    assert outbox == ["err"]
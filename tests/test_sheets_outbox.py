@@ -0,0 +1,111 @@
+import time
+import asyncio
+
+from benchmarks.fakes import ApiCounter, FakeSheetsAPI, Profile
+from src.call_analysis import CallAnalysis
+from src.database import Database
+from src.google_sheets import SheetsService
+from src.rate_limiter import AdaptiveRateLimiter
+from src.sheets_outbox import SheetsOutbox
+
+
+class FlakySheets(SheetsService):
+    """Перший запис падає, наступні йдуть у FakeSheetsAPI."""
+
+    def __init__(self, api):
+        super().__init__(service=api)
+        self.failures = 1
+
+    def write_rows(self, batch, cancel=None):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("мережа недоступна")
+        super().write_rows(batch, cancel)
+
+
+async def fill_outbox(db, sheets, count):
+    infos = [{'id': f"f{i}", 'name': f"call_{i}.mp3", 'createdTime': "2025-03-03T10:00:00Z"} for i in range(count)]
+    await db.add_files([(info, CallAnalysis(manager_score=7),
+                         sheets.build_entry(info['name'], CallAnalysis(manager_score=7), file_id=info['id']))
+                        for info in infos])
+
+
+def test_outbox_row_survives_failed_write_and_is_delivered_on_next_drain(tmp_path):
+    api = FakeSheetsAPI(Profile(), ApiCounter())
+    sheets = FlakySheets(api)
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            await fill_outbox(db, sheets, 1)
+            await SheetsOutbox(sheets, db).stop(drain_timeout=5)
+            after_failure = (await db.outbox_status())[2]
+
+            # Наступний запуск: пауза після збою вже минула
+            await db.conn.execute("UPDATE sheets_outbox SET available_at = 0")
+            await db.conn.commit()
+            await SheetsOutbox(sheets, db).stop(drain_timeout=5)
+            return after_failure, (await db.outbox_status())[2]
+        finally:
+            await db.close()
+
+    after_failure, after_retry = asyncio.run(scenario())
+    assert after_failure == 1
+    assert after_retry == 0
+    assert [row[18] for row in api.rows[1:]] == ["f0"]
+
+
+def test_drain_gives_up_when_rate_limit_outlasts_timeout(tmp_path):
+    api = FakeSheetsAPI(Profile(), ApiCounter())
+    sheets = SheetsService(service=api)
+    sheets.limiter = AdaptiveRateLimiter("sheets", 60000)
+    # Після 429 сервер просить зачекати хвилину — довше, ніж дозволено на завершення
+    sheets.limiter.on_throttle(retry_after=60)
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            await fill_outbox(db, sheets, 3)
+            started = time.monotonic()
+            await SheetsOutbox(sheets, db).stop(drain_timeout=0.5)
+            return time.monotonic() - started, (await db.outbox_status())[2]
+        finally:
+            await db.close()
+
+    elapsed, pending = asyncio.run(scenario())
+    assert elapsed < 5
+    assert pending == 3
+    assert api.rows == []
+
+
+def test_stop_interrupts_background_flush_already_waiting_on_rate_limit(tmp_path):
+    api = FakeSheetsAPI(Profile(), ApiCounter())
+    sheets = SheetsService(service=api)
+    sheets.limiter = AdaptiveRateLimiter("sheets", 60000)
+
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            await fill_outbox(db, sheets, 2)
+            outbox = SheetsOutbox(sheets, db)
+            outbox.flush_interval = 0
+            # Пауза після 429 почалась ще до зупинки: фоновий відправник уже чекає в обмежувачі
+            sheets.limiter.on_throttle(retry_after=60)
+            outbox.start()
+            await asyncio.sleep(0.3)
+            started = time.monotonic()
+            await outbox.stop(drain_timeout=0.5)
+            return time.monotonic() - started, (await db.outbox_status())[2]
+        finally:
+            await db.close()
+
+    started = time.monotonic()
+    elapsed, pending = asyncio.run(scenario())
+    # Завершується і сам цикл подій: потік запису не лишається висіти на паузі
+    assert time.monotonic() - started < 5
+    assert elapsed < 2
+    assert pending == 2
+    assert api.rows == []
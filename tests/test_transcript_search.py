@@ -0,0 +1,51 @@
+import asyncio
+
+from src.call_analysis import CallAnalysis
+from src.database import Database
+from src.transcript_search import TranscriptSearch
+
+
+def call(file_id, transcription):
+    info = {'id': file_id, 'name': f"{file_id}.mp3", 'createdTime': "2025-03-03T10:00:00Z"}
+    return info, CallAnalysis(manager_score=7, transcription=transcription), None
+
+
+def test_search_ranks_prefix_and_phrase_matches_and_reindexes_updates(tmp_path):
+    async def scenario():
+        db = Database(str(tmp_path / "bot.db"))
+        await db.init()
+        try:
+            await db.add_files([
+                call("a", "Клієнт: чи покриває гарантійний ремонт заміну ременя?"),
+                call("b", "Менеджер: гарантія на роботи — шість місяців. Клієнт: дякую."),
+                call("c", "Клієнт: відмова, дорого."),
+            ])
+            search = TranscriptSearch(db)
+            prefix = await search.search("гаранті*")
+            phrase = await search.search('"гарантійний ремонт"')
+            negated = await search.search("гаранті* NOT ремонт")
+
+            # Повторний аналіз із новою транскрибацією замінює старі слова в індексі
+            await db.add_files([call("a", "Клієнт: запис на шиномонтаж.")])
+            after_update = await search.search("гаранті*")
+            return prefix, phrase, negated, after_update
+        finally:
+            await db.close()
+
+    prefix, phrase, negated, after_update = asyncio.run(scenario())
+    assert sorted(hit["file_id"] for hit in prefix) == ["a", "b"]
+    assert [hit["file_id"] for hit in phrase] == ["a"]
+    assert "«гарантійний» «ремонт»" in phrase[0]["snippet"]
+    assert [hit["file_id"] for hit in negated] == ["b"]
+    assert [hit["file_id"] for hit in after_update] == ["b"]
+
+
+def test_snippet_is_cut_around_first_match():
+    search = TranscriptSearch(db=None)
+    text = "а " * 200 + "гарантія на все" + " б" * 200
+
+    snippet = search.snippet(text, search._terms("гаранті* AND NOT відмова"))
+
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert "«гарантія»" in snippet
+    assert len(snippet) < 2 * search.SNIPPET_RADIUS + 30